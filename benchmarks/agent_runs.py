@@ -0,0 +1,97 @@
+'''Compares agent run throughput of the sync request path with the async engine, using the local stub provider.
+
+Each worker thread stands in for one gunicorn sync worker. In 'sync' mode a worker is busy for the whole provider call. In 'async' mode it only inserts the run and hands it to the engine loop, so the provider waits overlap inside one process.
+
+    python -m benchmarks.agent_runs --runs 400 --workers 4 --latency 0.25
+'''
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from incontext import create_app
+from incontext.db import get_db
+
+SCHEMA_MODELS = [('Stub', 'stub', 'Stub Model', 'stub-1', 'Local stub provider.')]
+
+
+def make_app(database, engine, latency):
+    app = create_app({
+        'DATABASE': database,
+        'AGENT_MODELS': SCHEMA_MODELS,
+        'AGENT_ENGINE': engine,
+        'AGENT_STUB_LATENCY': latency,
+    })
+    with app.app_context():
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        db.executemany(
+            'INSERT INTO agent_models (provider_name, provider_code, model_name, model_code, model_description)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            SCHEMA_MODELS
+        )
+        db.execute("INSERT INTO users (username, password) VALUES ('bench', 'unused')")
+        db.execute(
+            'INSERT INTO agents (creator_id, name, description, model_id, role, instructions)'
+            " VALUES (1, 'bench agent', 'bench agent', 1, 'bench', 'Reply with one word: Working')"
+        )
+        db.commit()
+    return app
+
+
+def post_runs(app, count):
+    '''One worker: posts `count` runs one after another, like a sync worker taking requests off its queue.'''
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    for _ in range(count):
+        response = client.post('/agents/1/run', data={'prompt': 'Are you working?'})
+        assert response.status_code == 302, response.status_code
+
+
+def wait_for_runs(app, total, timeout=300):
+    with app.app_context():
+        db = get_db()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            done = db.execute("SELECT COUNT(*) AS count FROM agent_runs WHERE status != 'pending'").fetchone()['count']
+            if done >= total:
+                return
+            time.sleep(0.01)
+    raise TimeoutError('runs did not finish in time')
+
+
+def bench(engine, runs, workers, latency):
+    db_fd, database = tempfile.mkstemp()
+    try:
+        app = make_app(database, engine, latency)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            for future in [pool.submit(post_runs, app, runs // workers) for _ in range(workers)]:
+                future.result()
+        accepted = time.perf_counter() - started
+        wait_for_runs(app, runs // workers * workers)
+        finished = time.perf_counter() - started
+    finally:
+        os.close(db_fd)
+        os.unlink(database)
+    return accepted, finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.25, help='stub provider latency in seconds')
+    args = parser.parse_args()
+    print(f'{args.runs} runs, {args.workers} workers, {args.latency}s stub latency')
+    print(f'{"engine":<8}{"accepted (s)":>14}{"finished (s)":>14}{"runs/s":>10}')
+    for engine in ('sync', 'async'):
+        accepted, finished = bench(engine, args.runs, args.workers, args.latency)
+        print(f'{engine:<8}{accepted:>14.2f}{finished:>14.2f}{args.runs / finished:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
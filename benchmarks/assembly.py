@@ -0,0 +1,101 @@
+'''Times the data-assembly functions of the list pages in isolation, as curves over the number of items.
+
+For each details count, each function is timed at every items count on a database holding one list and one master list of that size. The exponent column is the slope of log(time) over log(items) from the previous point, and the last line of each curve is the least-squares fit over all points: about 1 means linear and 2 quadratic, so an algorithmic regression shows up as a change in the exponent.
+
+    python -m benchmarks.assembly --items 25,50,100,200,400 --details 2,8
+'''
+import argparse
+import math
+import os
+import tempfile
+import timeit
+
+from incontext import create_app
+from incontext.db import dict_factory, get_db
+from incontext.gendata import generate
+from incontext.lists import get_list, get_list_items_with_details
+from incontext.master_lists import get_master_list
+
+
+class FakeCursor:
+    '''Enough of a cursor for `dict_factory`.'''
+
+    def __init__(self, columns):
+        self.description = [(f'column{n}',) + (None,) * 6 for n in range(columns)]
+
+
+def make_app(database, items, details):
+    app = create_app({'DATABASE': database, 'PASSWORD_HASH_WORKERS': 0})
+    with app.app_context():
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        generate(
+            db, seed=0, users=1, admins=1, lists_per_user=1, tethered_per_user=1,
+            items_per_list=items, details_per_list=details, master_lists=1, master_items=items, master_details=details,
+            batch_size=100000, password='unused',
+        )
+    return app
+
+
+def time_call(function, repeat):
+    '''The best time of `repeat` calls, in milliseconds. The minimum is the least disturbed by other work on the machine.'''
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def time_functions(items, details, repeat):
+    '''Times each function at one size. Returns {function name: ms}.'''
+    db_fd, database = tempfile.mkstemp()
+    try:
+        app = make_app(database, items, details)
+        with app.app_context():
+            db = get_db()
+            list_id, tethered_id = [row[0] for row in db.execute('SELECT id FROM lists ORDER BY tethered')]
+            master_list_id = db.execute('SELECT id FROM master_lists').fetchone()[0]
+            cursor = FakeCursor(details + 3) # an item row with id, name, created and its details.
+            row = tuple(range(details + 3))
+            return {
+                'get_list_items_with_details': time_call(lambda: get_list_items_with_details(get_list(list_id, False)), repeat),
+                'get_list_items_with_details (tethered)': time_call(lambda: get_list_items_with_details(get_list(tethered_id, False)), repeat),
+                'get_master_list': time_call(lambda: get_master_list(master_list_id, False), repeat),
+                'dict_factory': time_call(lambda: [dict_factory(cursor, row) for _ in range(items)], repeat),
+            }
+    finally:
+        os.close(db_fd)
+        os.unlink(database)
+
+
+def fit_exponent(sizes, times):
+    '''The least-squares slope of log(time) over log(size).'''
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(time, 1e-6)) for time in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', default='25,50,100,200,400', help='comma separated items counts')
+    parser.add_argument('--details', default='2,8', help='comma separated details counts, one curve each')
+    parser.add_argument('--repeat', type=int, default=5, help='calls per point. the fastest one counts')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.items.split(',')]
+    for details in [int(count) for count in args.details.split(',')]:
+        curves = {}
+        for items in sizes:
+            for name, ms in time_functions(items, details, args.repeat).items():
+                curves.setdefault(name, []).append(ms)
+        for name, times in curves.items():
+            print(f'{name}, {details} details')
+            print(f'{"items":>8}{"ms":>12}{"exponent":>10}')
+            for n, (items, ms) in enumerate(zip(sizes, times)):
+                exponent = '' if n == 0 else f'{math.log(max(ms, 1e-6) / max(times[n - 1], 1e-6)) / math.log(items / sizes[n - 1]):.2f}'
+                print(f'{items:>8}{ms:>12.3f}{exponent:>10}')
+            if len(sizes) > 1:
+                print(f'{"fit":>8}{"":>12}{fit_exponent(sizes, times):>10.2f}')
+            print()
+
+
+if __name__ == '__main__':
+    main()
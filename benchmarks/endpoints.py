@@ -0,0 +1,203 @@
+'''Measures the hot endpoints against generated databases of increasing size, and compares the results with a saved baseline.
+
+For each size a fresh database is filled with `flask gen-data`'s generator, with that many items per list and per master list. Each endpoint is requested through Flask's test client. Latency percentiles and queries per request come from one pass. Peak Python memory per request comes from a second pass under tracemalloc, because tracing slows everything down.
+
+    python -m benchmarks.endpoints --sizes 10,100,1000 --save
+    python -m benchmarks.endpoints --sizes 10,100,1000 --threshold 0.25
+
+Repeat views of an unchanged list are served from the fragment cache. Use `--cold` to measure the full assembly of every page, and keep separate baselines for both modes. Baselines depend on the machine, so compare runs from the same one.
+
+The second form exits with status 1 if an endpoint got slower, made more queries or used more memory than the baseline by more than the threshold.
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flask import g
+
+from incontext import context, create_app, fragments
+from incontext.db import get_db
+from incontext.gendata import generate
+from incontext.passwords import hash_password
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MODELS = [('Stub', 'stub', 'Stub Model', 'stub-1', 'Local stub provider.')]
+METRICS = ('p50_ms', 'p95_ms', 'queries', 'peak_kb') # the metrics compared with the baseline.
+
+
+def make_app(database, size):
+    app = create_app({
+        'DATABASE': database,
+        'AGENT_MODELS': MODELS,
+        'PASSWORD_HASH_WORKERS': 0, # measures the hash in the request, like a single worker process.
+        'LOGIN_THROTTLE': {},
+    })
+    with app.app_context():
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        db.executemany(
+            'INSERT INTO agent_models (provider_name, provider_code, model_name, model_code, model_description)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            MODELS
+        )
+        generate(
+            db, seed=0, users=10, admins=1, lists_per_user=3, tethered_per_user=1,
+            items_per_list=size, details_per_list=5, master_lists=3, master_items=size, master_details=5,
+            batch_size=100000, password=hash_password('bench'),
+        )
+        db.executemany(
+            'INSERT INTO agents (creator_id, name, description, model_id, role, instructions) VALUES (1, ?, ?, 1, ?, ?)',
+            [(f'agent {n}', 'bench agent', 'bench', 'Reply with one word: Working') for n in range(20)]
+        )
+        db.commit()
+
+    def count_queries(): # counts the statements on the request's connection. writes made on their own connection aren't counted.
+        g.queries = 0
+        def trace(statement):
+            g.queries += 1
+        get_db().set_trace_callback(trace)
+    app.before_request_funcs.setdefault(None, []).insert(0, count_queries) # first, so the queries of `load_logged_in_user` count too.
+
+    @app.after_request
+    def report_queries(response):
+        response.headers['X-Queries'] = str(g.queries)
+        return response
+
+    return app
+
+
+def get_requests(app):
+    '''The endpoints to measure, as (name, method, url, form data) for the first user, who owns lists and is an admin.'''
+    with app.app_context():
+        db = get_db()
+        list_id = db.execute('SELECT id FROM lists WHERE creator_id = 1 AND NOT tethered ORDER BY id').fetchone()['id']
+        item_id = db.execute('SELECT item_id FROM list_item_relations WHERE list_id = ? ORDER BY id', (list_id,)).fetchone()['item_id']
+        detail_ids = [row['detail_id'] for row in db.execute('SELECT detail_id FROM list_detail_relations WHERE list_id = ?', (list_id,))]
+        master_list_id = db.execute('SELECT id FROM master_lists ORDER BY id').fetchone()['id']
+        username = db.execute('SELECT username FROM users WHERE id = 1').fetchone()['username']
+    contents = {str(detail_id): 'bench content' for detail_id in detail_ids}
+    return [
+        ('lists.view', 'GET', f'/lists/{list_id}/view', None),
+        ('lists.new_item', 'POST', f'/lists/{list_id}/items/new', {'name': 'bench item', **contents}),
+        ('lists.edit_item', 'POST', f'/lists/{list_id}/items/{item_id}/edit', {'name': 'bench item edited', **contents}),
+        ('master_lists.view', 'GET', f'/master-lists/{master_list_id}/view', None),
+        ('master_lists.new_master_detail', 'POST', f'/master-lists/{master_list_id}/master-details/new', {'name': 'bench detail', 'description': 'bench'}),
+        ('agents.index', 'GET', '/agents/', None),
+        ('auth.login', 'POST', '/auth/login', {'username': username, 'password': 'bench'}),
+    ]
+
+
+def request(client, method, url, data):
+    response = client.open(url, method=method, data=data)
+    assert response.status_code in (200, 302), (url, response.status_code)
+    return response
+
+
+def clear_caches():
+    fragments._fragments.clear()
+    context._contexts.clear()
+
+
+def measure(app, requests, count, cold):
+    client = app.test_client()
+    request(client, 'POST', '/auth/login', requests[-1][3])
+    results = {}
+    for name, method, url, data in requests:
+        request(client, method, url, data) # warms the caches a repeat request would find.
+        latencies = []
+        queries = []
+        for _ in range(count):
+            if cold:
+                clear_caches()
+            started = time.perf_counter()
+            response = request(client, method, url, data)
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(int(response.headers['X-Queries']))
+        peaks = []
+        tracemalloc.start()
+        for _ in range(max(count // 10, 3)):
+            if cold:
+                clear_caches()
+            tracemalloc.reset_peak()
+            request(client, method, url, data)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        results[name] = {
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'queries': statistics.median_high(queries),
+            'peak_kb': round(max(peaks), 1),
+        }
+    return results
+
+
+def bench(size, count, cold):
+    db_fd, database = tempfile.mkstemp()
+    try:
+        app = make_app(database, size)
+        return measure(app, get_requests(app), count, cold)
+    finally:
+        os.close(db_fd)
+        os.unlink(database)
+
+
+def find_regressions(results, baseline, threshold):
+    '''Returns a line for every metric that is worse than the baseline by more than `threshold` (a fraction).'''
+    regressions = []
+    for size, endpoints in results.items():
+        for name, metrics in endpoints.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            for metric in METRICS:
+                limit = base[metric] * (1 + threshold)
+                if metric == 'queries':
+                    limit = max(limit, base[metric] + 1) # a query count is small, so a fraction of it rounds away.
+                if metrics[metric] > limit:
+                    regressions.append(f'{name} at size {size}: {metric} {metrics[metric]} > {base[metric]} (+{threshold:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated items per list')
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per endpoint and size')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression, as a fraction of the baseline')
+    parser.add_argument('--cold', action='store_true', help='empty the rendered fragment and context caches before every request, to measure the full assembly')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline instead of comparing')
+    args = parser.parse_args()
+    results = {}
+    print(f'{"size":>6}  {"endpoint":<32}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"peak kb":>10}')
+    for size in args.sizes.split(','):
+        results[size] = bench(int(size), args.requests, args.cold)
+        for name, metrics in results[size].items():
+            print(f'{size:>6}  {name:<32}{metrics["p50_ms"]:>9.2f}{metrics["p95_ms"]:>9.2f}{metrics["p99_ms"]:>9.2f}{metrics["queries"]:>9}{metrics["peak_kb"]:>10.1f}')
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved the baseline to {args.baseline}.')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}. Run with --save first.')
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.threshold)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit(1)
+    print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
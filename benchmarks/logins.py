@@ -0,0 +1,76 @@
+'''Measures logins per second, and per core, with password hashing inline and in the process pool.
+
+Request threads stand in for the threads of one worker process. Inline hashing holds the GIL, so one process uses about one core however many threads it has. With the pool, the hashing spreads over `PASSWORD_HASH_WORKERS` cores.
+
+    python -m benchmarks.logins --logins 64 --threads 8 --pool-sizes 0,1,2,4
+'''
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from incontext import create_app
+from incontext.db import get_db
+
+
+def make_app(database, workers, method):
+    app = create_app({
+        'DATABASE': database,
+        'PASSWORD_HASH_WORKERS': workers,
+        'PASSWORD_HASH_METHOD': method,
+    })
+    with app.app_context():
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        db.execute(
+            'INSERT INTO users (username, password) VALUES (?, ?)',
+            ('bench', generate_password_hash('bench', method))
+        )
+        db.commit()
+    return app
+
+
+def log_in(app, count):
+    client = app.test_client()
+    for _ in range(count):
+        response = client.post('/auth/login', data={'username': 'bench', 'password': 'bench'})
+        assert response.status_code == 302, response.status_code
+
+
+def bench(workers, logins, threads, method):
+    db_fd, database = tempfile.mkstemp()
+    try:
+        app = make_app(database, workers, method)
+        log_in(app, 1) # starts the pool, so process start-up isn't measured.
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            for future in [pool.submit(log_in, app, logins // threads) for _ in range(threads)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        os.close(db_fd)
+        os.unlink(database)
+    return logins // threads * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--pool-sizes', default=f'0,1,{os.cpu_count() or 1}', help='comma separated PASSWORD_HASH_WORKERS values')
+    parser.add_argument('--method', default='scrypt:32768:8:1')
+    args = parser.parse_args()
+    print(f'{args.logins} logins, {args.threads} request threads, {args.method}')
+    print(f'{"workers":<10}{"logins/s":>10}{"per core":>10}')
+    for workers in [int(size) for size in args.pool_sizes.split(',')]:
+        rate = bench(workers, args.logins, args.threads, args.method)
+        cores = max(workers, 1) # inline hashing is limited to about one core by the GIL.
+        print(f'{workers or "inline":<10}{rate:>10.1f}{rate / cores:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,32 @@ import os
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from incontext.startup import StartupProfile
+
+EXTENSIONS = ( # modules whose `init_app(app)` is called, in this order.
+    'db', # registers a couple of database-related things with the app.
+    'compression', # first, so its `after_request` function runs after every other one.
+    'assets', # fingerprints static urls.
+    'sessions', # replaces the session interface if `SESSION_BACKEND` isn't 'cookie', and registers the `sweep-sessions` command.
+    'registry', # registers the `reload-models` command.
+    'gendata', # registers the `gen-data` command.
+    'querylog', # registers the `slow-queries` command.
+    'master_changes', # registers the `propagate-master-changes` command.
+)
+
+BLUEPRINTS = ( # modules whose `bp` is registered, in this order.
+    'auth', # has views for login, register, and logout.
+    'home',
+    'master_lists',
+    'lists',
+    'master_agents',
+    'agents',
+    'profiling', # after `auth`, so it can tell who asked for a profile.
+)
+
 def create_app(test_config=None):
     '''This is the application factory function: configuration, registration, and other setup.'''
+    profile = StartupProfile(enabled=bool(os.environ.get('IC_PROFILE_STARTUP'))) # set `IC_PROFILE_STARTUP=1` to print the time of each step to stderr.
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True) # creates the flask instance. `__name__` is the name of the current python module (incontext). It will be used for setting up paths. `instance_relative_config=True` tells the app that config files are relative to the instance folder, which is located outside of the package.
     app.wsgi_app = ProxyFix(
@@ -13,6 +37,36 @@ def create_app(test_config=None):
     app.config.from_mapping( # sets some default configuration.
         SECRET_KEY='dev', # used by Flask and extensions to keep data safe. should be overridden with a random valye when deploying.
         DATABASE=os.path.join(app.instance_path, 'incontext.sqlite'), # the path where the sqlite database will be saved. `app.instance_path` is the path that Flask has chosen for the instance folder.
+        DB_POOL_SIZE=0, # idle sqlite connections each worker keeps for reuse. 0 opens and closes one per request.
+        SLOW_QUERY_MS=None, # statements slower than this many milliseconds are logged to `slow_queries` (see `querylog.py`). None turns the timing off.
+        AGENT_ENGINE='async', # 'async' hands agent runs to the per-process event loop in `engine.py`. 'sync' calls the provider inside the request instead.
+        AGENT_PROVIDER_FALLBACK='stub', # the provider used for models whose `provider_code` has no client in `providers.py`.
+        AGENT_STUB_LATENCY=0.0, # seconds the stub provider waits before it answers, to simulate a provider round trip.
+        AGENT_STUB_PRICES={'default': (0.15, 0.60)}, # estimated (input, output) prices per million tokens, by `model_code`. used by the usage ledger.
+        AGENT_MAX_PENDING_PER_USER=20, # runs a user may have waiting on a provider at once. None turns the check off.
+        AGENT_RATE_LIMITS={'user': (30, 10), 'model': (600, 100), 'provider': (1200, 200)}, # (runs per minute, burst) token buckets for agent runs. leave a key out to turn that limit off.
+        CACHE_VERSION_TTL=60.0, # seconds a worker trusts its cached agent models and user snapshots before it checks `cache_versions` for changes.
+        PASSWORD_HASH_METHOD='scrypt:32768:8:1', # werkzeug hash method with all cost parameters spelled out. stored hashes made differently are upgraded at the next login.
+        PASSWORD_HASH_WORKERS=1, # processes that hash passwords, per worker process: a server with N web workers runs N times this many. 0 hashes inside the request instead.
+        LOGIN_THROTTLE={'user': (10, 300), 'ip': (50, 300)}, # (failed attempts, seconds) allowed per username and per client address before logins are refused. leave a key out to turn that limit off.
+        LOGIN_THROTTLE_SWEEP_RATE=100, # failed logins delete the counters of every username and address that are too old to matter in 1 in this many attempts. 0 never does.
+        COMPRESS_MIN_SIZE=500, # bytes below which responses are sent uncompressed. None turns compression off.
+        COMPRESS_LEVEL=6, # gzip level (1-9), or brotli quality if the brotli package is installed.
+        COMPRESS_STREAM_BUFFER=16384, # bytes of a streamed response compressed before they're flushed to the client. smaller sends the parts sooner, larger compresses better.
+        SESSION_BACKEND='cookie', # 'cookie' keeps Flask's signed cookie sessions. 'sqlite' or 'memory' keep the data on the server and only put a session id in the cookie (see `sessions.py`).
+        SESSION_SWEEP_RATE=100, # the sqlite session backend deletes expired sessions in 1 in this many session writes. 0 leaves it to `flask sweep-sessions`.
+        USER_SNAPSHOT_TTL=300.0, # seconds a session's cached user snapshot is used before it's reloaded from the users table.
+        LIST_GRIDS=True, # reads list views from the `list_grids` read model (see `grids.py`). False joins the relational tables instead. the read model is kept up to date either way.
+        STREAM_MIN_ITEMS=1000, # list and master list pages with at least this many items are rendered while they're sent, instead of being cached (see `streaming.py`). None turns streaming off.
+        PROPAGATE_MASTER_CHANGES='async', # how master list changes reach tethered lists after the write (see `master_changes.py`). 'async' applies them on the engine loop, 'sync' inside the request. None leaves them to the next read of each list and `flask propagate-master-changes`.
+        MASTER_CHANGES_BATCH_SIZE=500, # logged master changes applied to a tethered list per transaction.
+        CONTEXT_TOKEN_BUDGET=4000, # the default size limit, in estimated tokens, of list data given to an agent as context.
+        LEDGER_BATCH_SIZE=50, # usage entries buffered before they are written in one batch.
+        LEDGER_FLUSH_INTERVAL=10.0, # seconds after which a partial batch is written anyway.
+        PROFILE_REQUESTS=False, # lets admins profile a request with an `X-Profile: 1` header or `?_profile=1` (see `profiling.py`).
+        PROFILE_SAMPLE_RATE=0, # with `PROFILE_REQUESTS` on, also profiles 1 in this many requests. 0 turns sampling off.
+        PROFILE_DIR=None, # where captures are saved. None uses `profiles` in the instance folder.
+        PROFILE_KEEP=100, # captures kept. older ones are deleted.
     )
 
     if test_config is None:
@@ -23,31 +77,17 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config) # `test_config` can also be passed to the factory, and will be used instead of the instance config. This is so the tests can be configured independently of any development config values.
 
     # ensure the instance folder exists
-    try:
-        os.makedirs(app.instance_path) # Flask doesn't create the instance folder automatically, but it needs to be created because your project will create the sqlite database file there.
-    except OSError:
-        pass
-
-    from . import db
-    db.init_app(app) # calling the function to register a couple of database-related things with the app
+    if not os.path.isdir(app.instance_path): # one stat on the usual start, instead of a failing mkdir.
+        os.makedirs(app.instance_path, exist_ok=True) # Flask doesn't create the instance folder automatically, but it needs to be created because your project will create the sqlite database file there.
 
-    from . import auth
-    app.register_blueprint(auth.bp) # has views for login, register, and logout.
+    for name in EXTENSIONS:
+        module = profile.import_module(name)
+        profile.run(name, 'init_app', module.init_app, app)
 
-    from . import home
-    app.register_blueprint(home.bp)
+    for name in BLUEPRINTS:
+        module = profile.import_module(name)
+        profile.run(name, 'register', app.register_blueprint, module.bp)
     app.add_url_rule('/', endpoint='index') # you can now use `url_for('index')` for `url_for('home.index')` because there is no url prefix for the home bp.
 
-    from . import master_lists
-    app.register_blueprint(master_lists.bp)
-
-    from . import lists
-    app.register_blueprint(lists.bp)
-
-    from . import master_agents
-    app.register_blueprint(master_agents.bp)
-
-    from . import agents
-    app.register_blueprint(agents.bp)
-
+    profile.report()
     return app
@@ -0,0 +1,137 @@
+import atexit
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+# Usage entries are buffered per process and database, and written in batches, so a busy engine does one insert per batch instead of one per run. A partial batch is written `LEDGER_FLUSH_INTERVAL` seconds after its first entry by a timer on the engine loop, even if no other run finishes.
+_buffers = {} # maps a database path to its unflushed entries.
+_oldest = {} # maps a database path to the monotonic time of its oldest unflushed entry.
+_buffer_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    '''A provider-independent token estimate of about four characters per token.'''
+    return math.ceil(len(text) / 4)
+
+
+def estimate_cost(model_code, input_tokens, output_tokens, settings):
+    '''Prices usage with the stub price table. Prices are per million tokens.'''
+    prices = settings['AGENT_STUB_PRICES']
+    input_price, output_price = prices.get(model_code, prices['default'])
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def get_accounting_settings():
+    return {
+        'AGENT_STUB_PRICES': current_app.config['AGENT_STUB_PRICES'],
+        'LEDGER_BATCH_SIZE': current_app.config['LEDGER_BATCH_SIZE'],
+        'LEDGER_FLUSH_INTERVAL': current_app.config['LEDGER_FLUSH_INTERVAL'],
+    }
+
+
+def record_usage(database, settings, run, output, latency_ms):
+    '''Buffers one ledger entry for a finished run and flushes the buffer when it is full or old enough. Blocking, so the engine calls it in a worker thread.'''
+    input_tokens = estimate_tokens(run['role'] + run['instructions'] + run['context'] + run['prompt'])
+    output_tokens = estimate_tokens(output)
+    entry = (
+        time.strftime('%Y-%m-%d %H:00:00', time.gmtime()), # the hour bucket, in the same format as sqlite's CURRENT_TIMESTAMP.
+        run['creator_id'],
+        run['agent_id'],
+        run['model_id'],
+        input_tokens,
+        output_tokens,
+        latency_ms,
+        estimate_cost(run['model_code'], input_tokens, output_tokens, settings),
+    )
+    with _buffer_lock:
+        entries = _buffers.setdefault(database, [])
+        entries.append(entry)
+        first = database not in _oldest
+        oldest = _oldest.setdefault(database, time.monotonic())
+        due = (
+            len(entries) >= settings['LEDGER_BATCH_SIZE']
+            or time.monotonic() - oldest >= settings['LEDGER_FLUSH_INTERVAL']
+        )
+    if due:
+        flush_usage(database)
+    elif first:
+        schedule_flush(database, oldest, settings['LEDGER_FLUSH_INTERVAL'])
+
+
+def schedule_flush(database, oldest, interval):
+    '''Flushes the buffer on the engine loop once its oldest entry is `interval` seconds old.'''
+    from incontext.engine import get_loop # the engine imports this module.
+    loop = get_loop()
+    loop.call_soon_threadsafe(loop.call_later, interval, loop.run_in_executor, None, _flush_if_oldest, database, oldest, interval)
+
+
+def _flush_if_oldest(database, oldest, interval):
+    with _buffer_lock:
+        if _oldest.get(database) != oldest: # the batch was written already, and a newer one has a timer of its own.
+            return
+    flush_usage(database)
+    with _buffer_lock:
+        failed = _oldest.get(database) == oldest
+    if failed: # the entries are back in the buffer. try again after another interval.
+        schedule_flush(database, oldest, interval)
+
+
+def flush_usage(database):
+    '''Appends the buffered entries to `agent_usage_ledger` and folds them into the `agent_usage_hourly` rollup in one transaction. Returns the number of entries written. If the write fails, e.g. because the database stayed locked, the entries go back into the buffer for the next flush.'''
+    with _buffer_lock:
+        entries = _buffers.pop(database, [])
+        oldest = _oldest.pop(database, None)
+    if not entries:
+        return 0
+    try:
+        write_entries(database, entries)
+    except sqlite3.Error:
+        logger.exception('%d usage entries could not be written to the ledger. They are kept for the next flush.', len(entries))
+        with _buffer_lock:
+            _buffers[database] = entries + _buffers.get(database, [])
+            _oldest[database] = min(oldest, _oldest.get(database, oldest))
+        return 0
+    return len(entries)
+
+
+def write_entries(database, entries):
+    '''Writes ledger entries and their rollup in one transaction, which is rolled back if it fails.'''
+    db = sqlite3.connect(database)
+    try:
+        db.executemany(
+            'INSERT INTO agent_usage_ledger (hour, user_id, agent_id, model_id, input_tokens, output_tokens, latency_ms, cost)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            entries
+        )
+        db.executemany(
+            'INSERT INTO agent_usage_hourly (hour, user_id, agent_id, model_id, runs, input_tokens, output_tokens, latency_ms, cost)'
+            ' VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)'
+            ' ON CONFLICT (hour, user_id, agent_id, model_id) DO UPDATE SET'
+            '  runs = runs + 1,'
+            '  input_tokens = input_tokens + excluded.input_tokens,'
+            '  output_tokens = output_tokens + excluded.output_tokens,'
+            '  latency_ms = latency_ms + excluded.latency_ms,'
+            '  cost = cost + excluded.cost',
+            entries
+        )
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@atexit.register
+def _flush_at_exit():
+    for database in list(_buffers):
+        try:
+            write_entries(database, _buffers.pop(database))
+        except sqlite3.Error: # the database may be gone already, e.g. a deleted test database.
+            pass
+
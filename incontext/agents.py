@@ -1,13 +1,19 @@
+import math
+
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, url_for
 )
 from werkzeug.exceptions import abort
 
 from incontext.auth import login_required
+from incontext.context import get_list_context
 from incontext.db import get_db
-from incontext.master_agents import get_agent_models
+from incontext.engine import check_run_limits, submit_run
+from incontext.lists import get_list, get_user_lists
+from incontext.master_changes import catch_up
 from incontext.master_agents import get_master_agents
 from incontext.master_agents import get_master_agent
+from incontext.registry import get_agent_model, get_agent_models
 
 
 bp = Blueprint('agents', __name__, url_prefix='/agents')
@@ -23,7 +29,6 @@ def index():
 @bp.route('/new', methods=('GET', 'POST'))
 @login_required
 def new():
-    agent_models = get_agent_models()
     if request.method == 'POST':
         error = None
         name = request.form['name']
@@ -34,7 +39,7 @@ def new():
                 model_id = int(model_id)
             except:
                 model_id = None
-        model = next((agent_model for agent_model in agent_models if agent_model["id"] == model_id), None)
+        model = get_agent_model(model_id)
         role = request.form['role']
         instructions = request.form['instructions']
         if not name or not model or not role or not instructions:
@@ -50,7 +55,7 @@ def new():
             )
             db.commit()
             return redirect(url_for('agents.index'))
-    return render_template('agents/new.html', agent_models=agent_models)
+    return render_template('agents/new.html', agent_models=get_agent_models())
 
 
 @bp.route("/new-tethered", methods=("GET", "POST"))
@@ -81,7 +86,6 @@ def view(agent_id):
 @login_required
 def edit(agent_id):
     agent = get_agent(agent_id)
-    agent_models = get_agent_models()
     if request.method == "POST":
         error = None
         name = request.form['name']
@@ -92,7 +96,7 @@ def edit(agent_id):
                 model_id = int(model_id)
             except:
                 model_id = None
-        model = next((agent_model for agent_model in agent_models if agent_model["id"] == model_id), None)
+        model = get_agent_model(model_id)
         role = request.form["role"]
         instructions = request.form["instructions"]
         if not name or not model or not role or not instructions:
@@ -109,7 +113,7 @@ def edit(agent_id):
             )
             db.commit()
             return redirect(url_for('agents.index'))
-    return render_template("agents/edit.html", agent=agent, agent_models=agent_models)
+    return render_template("agents/edit.html", agent=agent, agent_models=get_agent_models())
 
 
 @bp.route("<int:agent_id>/delete", methods=("POST",))
@@ -122,6 +126,66 @@ def delete(agent_id):
     return redirect(url_for('agents.index'))
 
 
+@bp.route('/<int:agent_id>/run', methods=('GET', 'POST'))
+@login_required
+def run(agent_id):
+    agent = get_agent(agent_id)
+    if request.method == 'POST':
+        prompt = request.form['prompt']
+        list_id = request.form.get('list_id', type=int)
+        alist = None
+        error = None
+        retry_after = 0
+        if not prompt:
+            error = 'Prompt is required.'
+        else:
+            if list_id:
+                alist = get_list(list_id) # the access check, before the run takes tokens from the shared model and provider buckets.
+            retry_after = math.ceil(check_run_limits(g.user['id'], agent['model_id'], agent['provider_code']))
+            if retry_after:
+                error = f'Too many agent runs. Try again in {retry_after} seconds.'
+        if error is not None:
+            flash(error)
+            if retry_after:
+                return render_template('agents/run.html', agent=agent, lists=get_user_lists()), 429, {'Retry-After': str(retry_after)}
+        else:
+            context = ''
+            if alist is not None: # only for runs that passed the checks, so refused ones don't serialise the list.
+                catch_up(alist)
+                context = get_list_context(alist)
+            db = get_db()
+            cur = db.cursor()
+            cur.execute(
+                'INSERT INTO agent_runs (creator_id, agent_id, model_id, list_id, prompt)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (g.user['id'], agent_id, agent['model_id'], list_id, prompt)
+            )
+            run_id = cur.lastrowid
+            db.commit() # the engine writes the result on its own connection, so the row has to be visible to it first.
+            submit_run({
+                'id': run_id,
+                'creator_id': g.user['id'],
+                'agent_id': agent_id,
+                'model_id': agent['model_id'],
+                'provider_code': agent['provider_code'],
+                'model_code': agent['model_code'],
+                'role': agent['role'],
+                'instructions': agent['instructions'],
+                'context': context,
+                'prompt': prompt,
+            })
+            return redirect(url_for('agents.view_run', agent_id=agent_id, run_id=run_id))
+    return render_template('agents/run.html', agent=agent, lists=get_user_lists())
+
+
+@bp.route('/<int:agent_id>/runs/<int:run_id>/view')
+@login_required
+def view_run(agent_id, run_id):
+    agent = get_agent(agent_id)
+    agent_run = get_agent_run(agent_id, run_id)
+    return render_template('agents/view_run.html', agent=agent, agent_run=agent_run)
+
+
 @bp.route("<int:tethered_agent_id>/delete-tethered", methods=("POST",))
 @login_required
 def delete_tethered(tethered_agent_id):
@@ -154,7 +218,7 @@ def get_agents():
 def get_agent(agent_id, check_access=True):
     db = get_db()
     agent = db.execute(
-        'SELECT a.id, a.creator_id, a.created, a.name, a.description, a.model_id, a.role, a.instructions, m.model_name, m.provider_name, u.username'
+        'SELECT a.id, a.creator_id, a.created, a.name, a.description, a.model_id, a.role, a.instructions, m.model_name, m.model_code, m.provider_name, m.provider_code, u.username'
         ' FROM agents a'
         ' JOIN agent_models m ON m.id = a.model_id'
         ' JOIN users u ON u.id = a.creator_id'
@@ -183,3 +247,20 @@ def get_tethered_agent(tethered_agent_id, check_access=True):
         if tethered_agent['creator_id'] != g.user['id']:
             abort(403)
     return tethered_agent
+
+
+def get_agent_run(agent_id, run_id, check_access=True):
+    db = get_db()
+    agent_run = db.execute(
+        'SELECT r.id, r.creator_id, r.created, r.finished, r.agent_id, r.list_id, r.prompt, r.output, r.status, l.name AS list_name'
+        ' FROM agent_runs r'
+        ' LEFT JOIN lists l ON l.id = r.list_id'
+        ' WHERE r.id = ? AND r.agent_id = ?',
+        (run_id, agent_id)
+    ).fetchone()
+    if agent_run is None:
+        abort(404)
+    if check_access:
+        if agent_run['creator_id'] != g.user['id']:
+            abort(403)
+    return agent_run
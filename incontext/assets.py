@@ -0,0 +1,53 @@
+import hashlib
+import os
+
+from flask import current_app, request
+
+# Static asset urls get a fingerprint of the file's contents, e.g. `/static/styles.css?v=1a2b3c4d5e6f`. A fingerprinted url always serves the same bytes, so browsers may cache it for a year. A changed file gets a new url.
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+_fingerprints = {} # maps a file path to (mtime, fingerprint).
+
+
+def get_fingerprint(filename):
+    '''A short hash of a static file's contents, or None if there is no such file. It's recomputed when the file's mtime changes.'''
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        fingerprint = hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+    _fingerprints[path] = (mtime, fingerprint)
+    return fingerprint
+
+
+def add_fingerprint(endpoint, values):
+    '''Adds the fingerprint to `url_for('static', filename=...)`.'''
+    if endpoint != 'static' or 'v' in values or 'filename' not in values:
+        return
+    fingerprint = get_fingerprint(values['filename'])
+    if fingerprint is not None:
+        values['v'] = fingerprint
+
+
+def cache_fingerprinted(response):
+    '''Lets browsers cache static files requested by their current fingerprint for a year.'''
+    if (
+        request.endpoint == 'static'
+        and response.status_code in (200, 304)
+        and request.args.get('v') is not None
+        and request.args.get('v') == get_fingerprint(request.view_args['filename']) # an old fingerprint gets the current file, which must not be cached under that url.
+    ):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def init_app(app):
+    app.url_defaults(add_fingerprint)
+    app.after_request(cache_fingerprinted)
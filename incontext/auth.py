@@ -1,12 +1,15 @@
 import functools
+import random
+import time
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.exceptions import abort
 
-from incontext.db import get_db
+from incontext.db import get_cache_version, get_db
+from incontext.passwords import hash_password, needs_rehash, verify_password
+from incontext.ratelimit import count_hits, record_hit, sweep_windows
 
 bp = Blueprint('auth', __name__, url_prefix='/auth') # creates a blueprint named `'auth'`. It's passed `__name__` to know where it's defined. The `url_prefix` will be prepended to all URLs associated with the bp.
 
@@ -26,7 +29,7 @@ def register():
         if error is None:
             try:
                 db.execute(
-                    'INSERT INTO users (username, password) VALUES (?, ?)', (username, generate_password_hash(password)),
+                    'INSERT INTO users (username, password) VALUES (?, ?)', (username, hash_password(password)),
                 )
                 db.commit()
             except db.IntegrityError: # this will occur if the username already exists. (username column has a uniqueness constraint.)
@@ -45,34 +48,91 @@ def login():
         password = request.form['password']
         db = get_db()
         error = None
+        throttles = get_login_throttles(username)
+        for key, limit, window in throttles:
+            if count_hits(db, key, window) >= limit: # checked before the user lookup and the password hash, so attack bursts are cheap to turn away.
+                flash('Too many failed logins. Try again later.')
+                return render_template('auth/login.html'), 429, {'Retry-After': str(window)}
         user = db.execute(
             'SELECT * FROM users WHERE username = ?', (username,)
             ).fetchone()
 
         if user is None:
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password): # hashes the submitted password and and securely compares it with the stored password.
+        elif not verify_password(user['password'], password): # hashes the submitted password and and securely compares it with the stored password.
             error = 'Incorrect password.'
 
         if error is None:
+            if needs_rehash(user['password']): # the hashing parameters changed since this password was stored. upgrade it while we have the plain password.
+                db.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), user['id']))
+                db.commit()
             session.clear() # session is a dict that stores data across requests. 
             session['user_id'] = user['id'] # the user's id is stored in a new session. The data is stored in a cookie that is sent to the browser, and the browser then sends it back with subsequent requests. Flask securely signs the data so that it can't be tampered with.
+            session['user'] = make_user_snapshot(user)
             return redirect(url_for('index')) # now that the user's id is stored in session, it'll be available on subsequent requests. at the beginning of each request, if a user is logged in their info should be loaded and made available to other views.
 
+        for key, limit, window in throttles: # only failed attempts count towards the throttle.
+            record_hit(db, key, window)
+        rate = current_app.config['LOGIN_THROTTLE_SWEEP_RATE']
+        if throttles and rate and random.randrange(rate) == 0:
+            sweep_windows(db, max(window for _, _, window in throttles))
+        db.commit()
         flash(error)
 
     return render_template('auth/login.html')
 
+
+def get_login_throttles(username):
+    '''The (key, limit, window) failed-login counters for this attempt, per username and per client address. `ProxyFix` has already set `remote_addr` to the client's address.'''
+    throttle = current_app.config['LOGIN_THROTTLE']
+    throttles = []
+    if 'user' in throttle:
+        throttles.append((f'login:user:{username}',) + tuple(throttle['user']))
+    if 'ip' in throttle:
+        throttles.append((f'login:ip:{request.remote_addr}',) + tuple(throttle['ip']))
+    return throttles
+
+
 @bp.before_app_request # registers a function that runs before the view function no matter what URL was requested.
 def load_logged_in_user():
+    if request.endpoint == 'static': # static files don't need the user, so their requests don't read the session store.
+        g.user = None
+        return
+
     user_id = session.get('user_id')
 
     if user_id is None:
         g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM users WHERE id = ?', (user_id,)
-        ).fetchone() # g.user lasts for the lasts for the length of the request.
+        return
+
+    user = session.get('user') # a signed snapshot of the user, so most requests don't query the users table.
+    if (
+        user is None
+        or user['id'] != user_id
+        or time.time() - user['loaded'] > current_app.config['USER_SNAPSHOT_TTL']
+        or user['version'] != get_cache_version('users', current_app.config['CACHE_VERSION_TTL'])
+    ):
+        row = get_db().execute(
+            'SELECT id, username, admin FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+        if row is None: # the user was deleted.
+            session.clear()
+            g.user = None
+            return
+        user = make_user_snapshot(row)
+        session['user'] = user
+    g.user = user # g.user lasts for the lasts for the length of the request.
+
+
+def make_user_snapshot(user):
+    '''The user fields the views and templates need. It leaves out the password hash.'''
+    return {
+        'id': user['id'],
+        'username': user['username'],
+        'admin': bool(user['admin']),
+        'loaded': time.time(),
+        'version': get_cache_version('users', current_app.config['CACHE_VERSION_TTL']),
+    }
 
 
 @bp.route('/logout')
@@ -81,6 +141,18 @@ def logout():
     return redirect(url_for('index'))
 
 
+@bp.route('/logout-everywhere')
+def logout_everywhere():
+    '''Ends all of the user's sessions, on every device. Only server-side sessions can be revoked, see `sessions.py`.'''
+    delete_user_sessions = getattr(current_app.session_interface, 'delete_user_sessions', None)
+    if delete_user_sessions is None:
+        abort(404)
+    if g.user is not None:
+        delete_user_sessions(g.user['id'])
+    session.clear()
+    return redirect(url_for('index'))
+
+
 def login_required(view): # decorator to check that a user is logged in. apply it to views that require authentication.
     @functools.wraps(view)
     def wrapped_view(**kwargs):
@@ -0,0 +1,53 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''A thread-safe, per-process least-recently-used cache bounded by entry count and by approximate size in bytes.
+
+    Keys should contain everything the value depends on (e.g. a list version), so stale entries are never hit and simply age out.'''
+
+    def __init__(self, maxsize=256, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._entries = OrderedDict() # maps a key to (value, size). the most recently used entry is last.
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = sys.getsizeof(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return # it would push out everything else.
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while len(self._entries) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def discard(self, match):
+        '''Removes every entry whose key satisfies `match(key)`. Returns the number removed.'''
+        with self._lock:
+            keys = [key for key in self._entries if match(key)]
+            for key in keys:
+                self.nbytes -= self._entries.pop(key)[1]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,107 @@
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli # optional, `pip install incontext[brotli]`. without it responses are gzipped.
+except ImportError:
+    brotli = None
+
+# Compresses text responses after the views are done. Streamed responses are compressed as they're sent: template chunks are buffered up to `COMPRESS_STREAM_BUFFER` bytes before each flush, because a flush after every small chunk ends the compressor's block and leaves the page barely compressed.
+ENCODINGS = ('gzip', 'br')
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml'}
+
+
+def strip_encoding(etag):
+    '''The ETag of the uncompressed response, from the ETag of a compressed one.'''
+    for encoding in ENCODINGS:
+        if etag.endswith(f'-{encoding}'):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def choose_encoding():
+    '''The best encoding the client accepts, or None.'''
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor:
+    '''A gzip or brotli compressor for one response body.'''
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._compressor = zlib.compressobj(level, wbits=31) # 31 writes a gzip header and trailer.
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        '''Returns everything compressed so far, so a streamed chunk isn't held back.'''
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_stream(chunks, compressor, buffer_size):
+    '''Compresses a streamed body, flushing whenever `buffer_size` bytes have gone into the compressor since the last flush.'''
+    buffered = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        buffered += len(chunk)
+        if buffered >= buffer_size:
+            data += compressor.flush()
+            buffered = 0
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response):
+    '''Compresses text responses the client accepts compressed. Small bodies are left alone, because compressing them costs more than it saves.'''
+    min_size = current_app.config['COMPRESS_MIN_SIZE']
+    if (
+        min_size is None
+        or response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE
+    ):
+        return response
+    response.vary.add('Accept-Encoding') # caches must keep the compressed and uncompressed versions apart.
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    compressor = Compressor(encoding, current_app.config['COMPRESS_LEVEL'])
+    if response.is_streamed:
+        response.response = compress_stream(response.response, compressor, current_app.config['COMPRESS_STREAM_BUFFER']) # the size isn't known up front, so streams are always compressed.
+        response.headers.pop('Content-Length', None)
+        response.direct_passthrough = False
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak) # the bytes differ from the uncompressed response's, so a strong ETag must too. `conditional.not_modified` strips the encoding again.
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import current_app, g, get_flashed_messages, make_response, request
+from werkzeug.http import is_resource_modified
+
+from incontext.compression import strip_encoding
+
+# Conditional responses for pages built from versioned lists. A view computes validators from the versions it already loaded for its access check, and answers `304 Not Modified` before it runs the item queries when the client's copy is current.
+# The pages also depend on the templates and static files they're rendered with, so the validators include the build: a deploy that changes them changes every ETag and Last-Modified.
+_builds = {} # maps the template and static folders to their (hash, newest mtime).
+
+
+def hash_files(folders):
+    '''Returns a hash of the contents of the files under `folders`, and the UTC time the newest of them was changed.'''
+    digest = hashlib.blake2b(digest_size=12)
+    newest = 0
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort() # the same files in the same order, whatever order the directory lists them in.
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    digest.update(os.path.relpath(path, folder).encode() + b'\0' + f.read() + b'\0')
+                newest = max(newest, os.stat(path).st_mtime)
+    return digest.hexdigest(), datetime.fromtimestamp(int(newest), timezone.utc) # whole seconds, like Last-Modified.
+
+
+def get_build():
+    '''The (hash, newest mtime) of the app's templates and static files. Computed once per process, or for every request when templates are reloaded, e.g. in debug mode.'''
+    folders = (os.path.join(current_app.root_path, current_app.template_folder), current_app.static_folder)
+    if folders not in _builds or current_app.jinja_env.auto_reload:
+        _builds[folders] = hash_files(folders)
+    return _builds[folders]
+
+
+def make_etag(*versions):
+    '''A strong ETag for a response built from data at `versions` with the current build. The logged in user is part of it, because pages show the user's name and admin links.'''
+    user = (g.user['id'], g.user['username'], g.user['admin']) if g.user else None
+    return hashlib.blake2b(repr((versions, user, get_build()[0])).encode(), digest_size=12).hexdigest()
+
+
+def get_last_modified(*timestamps):
+    '''The latest of the `updated` timestamps (UTC, as sqlite stores them), ignoring None, and of the build's files.'''
+    return max([timestamp.replace(tzinfo=timezone.utc) for timestamp in timestamps if timestamp is not None] + [get_build()[1]])
+
+
+def not_modified(etag, last_modified):
+    '''Returns a 304 response if the client's copy matches the validators, otherwise None. If-None-Match takes precedence over If-Modified-Since. The client's ETags may be those of a compressed response (see `compression.py`): the 304 sends back the one that matched.'''
+    if get_flashed_messages(): # the page will show messages, so it isn't the page the client has. the messages stay available to the template.
+        return None
+    if request.if_none_match:
+        if request.if_none_match.star_tag:
+            matched = etag
+        else:
+            matched = next((tag for tag in request.if_none_match.as_set() if strip_encoding(tag) == etag), None)
+        if matched is None:
+            return None
+    elif is_resource_modified(request.environ, last_modified=last_modified):
+        return None
+    else:
+        matched = etag
+    return set_validators(make_response('', 304), matched, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    '''Adds the validators to a full response, unless it showed flashed messages or `etag` is None.'''
+    if etag is None or get_flashed_messages(): # returns the messages the page showed, so a later 304 can't bring them back.
+        return response
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding') # the ETag depends on the encoding, 304s included.
+    response.last_modified = last_modified
+    response.cache_control.private = True # it's a logged in user's page.
+    response.cache_control.no_cache = True # clients revalidate every time, so changes show up straight away.
+    return response
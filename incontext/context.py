@@ -0,0 +1,187 @@
+import itertools
+
+from flask import current_app
+
+from incontext.accounting import estimate_tokens
+from incontext.cache import LRUCache
+from incontext.db import get_db
+from incontext.grids import iter_grid_rows, use_list_grid
+
+# Serialised contexts, keyed by list version, so repeated runs over an unchanged list skip the queries and the serialisation.
+_contexts = LRUCache(maxsize=256, maxbytes=16 * 1024 * 1024)
+
+
+def get_list_context(alist, columns=None, budget=None):
+    '''Serialises a list (as returned by `lists.get_list`) into a compact prompt format. Tethered lists include the master items first, like the list view does.
+
+    `columns` is a list of detail ids to include, in that order (master detail ids for tethered lists). By default all details are included. `budget` is the token budget, by default `CONTEXT_TOKEN_BUDGET`.'''
+    if budget is None:
+        budget = current_app.config['CONTEXT_TOKEN_BUDGET']
+    key = (
+        current_app.config['DATABASE'], 'list', alist['id'], alist['version'], alist['master_list_version'],
+        tuple(columns) if columns is not None else None, budget,
+    )
+    context = _contexts.get(key)
+    if context is None:
+        db = get_db()
+        if alist['tethered']:
+            details = get_master_details(db, alist['master_list_id'])
+            detail_ids = select_columns(details, columns)
+            rows = iter_grid_contents(db, alist, detail_ids) if use_list_grid(alist) else iter_untethered_rows(db, alist['id'], detail_ids)
+            if not alist['snapshot']: # a snapshot list has its own copies of the master items.
+                rows = itertools.chain(iter_master_rows(db, alist['master_list_id'], detail_ids), rows)
+        else:
+            details = get_details(db, alist['id'])
+            detail_ids = select_columns(details, columns)
+            rows = iter_grid_contents(db, alist, detail_ids) if use_list_grid(alist) else iter_list_rows(db, alist['id'], detail_ids)
+        context = serialise('List', alist['name'], alist['description'], details, detail_ids, rows, budget)
+        _contexts.set(key, context)
+    return context
+
+
+def get_master_list_context(master_list_id, columns=None, budget=None):
+    '''Serialises a master list into a compact prompt format. See `get_list_context`.'''
+    if budget is None:
+        budget = current_app.config['CONTEXT_TOKEN_BUDGET']
+    db = get_db()
+    cur = db.cursor()
+    cur.row_factory = None
+    master_list = cur.execute(
+        'SELECT name, description, version FROM master_lists WHERE id = ?',
+        (master_list_id,)
+    ).fetchone()
+    if master_list is None:
+        return None
+    name, description, version = master_list
+    key = (
+        current_app.config['DATABASE'], 'master_list', master_list_id, version,
+        tuple(columns) if columns is not None else None, budget,
+    )
+    context = _contexts.get(key)
+    if context is None:
+        details = get_master_details(db, master_list_id)
+        detail_ids = select_columns(details, columns)
+        rows = iter_master_rows(db, master_list_id, detail_ids)
+        context = serialise('Master List', name, description, details, detail_ids, rows, budget)
+        _contexts.set(key, context)
+    return context
+
+
+def serialise(kind, name, description, details, detail_ids, rows, budget):
+    '''Writes a header and one line per item, with cells separated by " | ". Rows are consumed one at a time and the output stops at the token budget.'''
+    names = {detail_id: detail_name for detail_id, detail_name in details}
+    lines = [f'{kind}: {clean(name)}']
+    if description:
+        lines.append(f'Description: {clean(description)}')
+    lines.append(format_row(['Name'] + [names[detail_id] for detail_id in detail_ids]))
+    used = sum(estimate_tokens(line) + 1 for line in lines) # plus one for each newline.
+    for row in rows:
+        line = format_row(row)
+        used += estimate_tokens(line) + 1
+        if used > budget:
+            lines.append(f'[truncated at the budget of {budget} tokens]')
+            break
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def clean(value):
+    '''Collapses whitespace so every item stays on one line.'''
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())
+
+
+def format_row(cells):
+    return ' | '.join(clean(cell).replace('|', '/') for cell in cells)
+
+
+def select_columns(details, columns):
+    if columns is None:
+        return [detail_id for detail_id, name in details]
+    known = {detail_id for detail_id, name in details}
+    return [detail_id for detail_id in columns if detail_id in known]
+
+
+def get_details(db, list_id):
+    cur = db.cursor()
+    cur.row_factory = None # plain tuples, whatever the connection's row factory currently is.
+    return cur.execute(
+        'SELECT d.id, d.name'
+        ' FROM details d'
+        ' JOIN list_detail_relations r ON r.detail_id = d.id'
+        ' WHERE r.list_id = ?'
+        ' ORDER BY r.id',
+        (list_id,)
+    ).fetchall()
+
+
+def get_master_details(db, master_list_id):
+    cur = db.cursor()
+    cur.row_factory = None
+    return cur.execute(
+        'SELECT d.id, d.name'
+        ' FROM master_details d'
+        ' JOIN master_list_detail_relations r ON r.master_detail_id = d.id'
+        ' WHERE r.master_list_id = ?'
+        ' ORDER BY r.id',
+        (master_list_id,)
+    ).fetchall()
+
+
+def group_rows(cursor, detail_ids):
+    '''Turns (item_id, item_name, detail_id, content) rows, ordered by item, into one row of cells per item. Reads the cursor lazily, so only one item is in memory at a time.'''
+    for (item_id, name), cells in itertools.groupby(cursor, key=lambda row: (row[0], row[1])):
+        contents = {detail_id: content for _, _, detail_id, content in cells}
+        yield [name] + [contents.get(detail_id, '') for detail_id in detail_ids]
+
+
+def iter_grid_contents(db, alist, detail_ids):
+    '''The rows of a list from its `list_grids` read model, one item at a time.'''
+    for item_id, name, created, contents in iter_grid_rows(db, alist, detail_ids):
+        yield [name] + contents
+
+
+def iter_list_rows(db, list_id, detail_ids):
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(
+        'SELECT i.id, i.name, r.detail_id, r.content'
+        ' FROM list_item_relations l'
+        ' JOIN items i ON i.id = l.item_id'
+        ' LEFT JOIN item_detail_relations r ON r.item_id = i.id'
+        ' WHERE l.list_id = ?'
+        ' ORDER BY i.id',
+        (list_id,)
+    )
+    return group_rows(cur, detail_ids)
+
+
+def iter_untethered_rows(db, list_id, detail_ids):
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(
+        'SELECT i.id, i.name, u.master_detail_id, u.content'
+        ' FROM list_item_relations l'
+        ' JOIN items i ON i.id = l.item_id'
+        ' LEFT JOIN untethered_content u ON u.item_id = i.id AND u.list_id = l.list_id'
+        ' WHERE l.list_id = ?'
+        ' ORDER BY i.id',
+        (list_id,)
+    )
+    return group_rows(cur, detail_ids)
+
+
+def iter_master_rows(db, master_list_id, detail_ids):
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(
+        'SELECT i.id, i.name, r.master_detail_id, r.master_content'
+        ' FROM master_list_item_relations l'
+        ' JOIN master_items i ON i.id = l.master_item_id'
+        ' LEFT JOIN master_item_detail_relations r ON r.master_item_id = i.id'
+        ' WHERE l.master_list_id = ?'
+        ' ORDER BY i.id',
+        (master_list_id,)
+    )
+    return group_rows(cur, detail_ids)
@@ -1,10 +1,16 @@
+import asyncio
 import os
+import queue
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
 import click
 from flask import current_app, g
 
+from incontext.querylog import TimedConnection, flush_slow_queries
+
 
 def dict_factory(cursor, row):
     fields = [column[0] for column in cursor.description]
@@ -13,23 +19,152 @@ def dict_factory(cursor, row):
 
 def get_db():
     if 'db' not in g: # `g` is the application context global - a special object unique for each request. It is used for data that might be accessed by multiple functions during the request. This conditional ensures that for any given request there is only one connection to the database.
-        g.db = sqlite3.connect( # establishes a connection to the file pointed at by the `DATABASE` configuration key. This file doesn't have to exist yet, and won't until the database is initialized. (see protocol doc).
-            current_app.config['DATABASE'], # `current_app` is also a special object. It points to the Flask application handling the request. It's available because the project uses an application factory in `__init__.py`. `get_db` will be called while the application is handling a request. It's not being called outside of that context. Therefore `current_app` will be available.
-            detect_types=sqlite3.PARSE_DECLTYPES # Does things like parsing timestamps to python datetime objects because sqlite has only very few native data types (INTEGER, TEXT, REAL, and BLOB).
-        )
+        g.db = take_connection() # None unless pooling is on and a connection is idle.
+        if g.db is None:
+            g.db = sqlite3.connect( # establishes a connection to the file pointed at by the `DATABASE` configuration key. This file doesn't have to exist yet, and won't until the database is initialized. (see protocol doc).
+                current_app.config['DATABASE'], # `current_app` is also a special object. It points to the Flask application handling the request. It's available because the project uses an application factory in `__init__.py`. `get_db` will be called while the application is handling a request. It's not being called outside of that context. Therefore `current_app` will be available.
+                detect_types=sqlite3.PARSE_DECLTYPES, # Does things like parsing timestamps to python datetime objects because sqlite has only very few native data types (INTEGER, TEXT, REAL, and BLOB).
+                check_same_thread=not current_app.config['DB_POOL_SIZE'], # pooled connections are used by one request thread after another.
+                **get_timing_options(),
+            )
+        if isinstance(g.db, TimedConnection):
+            g.db.database = current_app.config['DATABASE']
+            g.db.slow_query_ms = current_app.config['SLOW_QUERY_MS']
         g.db.row_factory = sqlite3.Row # returns rows that behave like dicts, allowing access to the columns by name.
 
     return g.db
 
 
+def get_timing_options():
+    '''Extra `sqlite3.connect` arguments that make the connection log slow statements when `SLOW_QUERY_MS` is set (see `querylog.py`).'''
+    if current_app.config['SLOW_QUERY_MS'] is None:
+        return {}
+    return {'factory': TimedConnection}
+
+
 def close_db(e=None):
     '''Checks if a connection was created and closes it if so. Called by the application factory after each request.'''
     db = g.pop('db', None)
 
-    if db is not None:
+    if db is not None and not release_connection(db):
+        db.close()
+    if isinstance(db, TimedConnection):
+        flush_slow_queries(db.database) # usually there's nothing to write.
+
+
+# Idle connections kept for reuse when `DB_POOL_SIZE` is set. Connections must not cross a fork, so the pools belong to the process that opened them. See `startup.py` for the gunicorn hooks.
+_pools = {} # maps a database path to a queue of idle connections.
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    '''This process's pool for the app's database, or None if pooling is off.'''
+    global _pools, _pools_pid
+    size = current_app.config['DB_POOL_SIZE']
+    if not size:
+        return None
+    with _pools_lock:
+        if _pools_pid != os.getpid(): # inherited connections belong to the parent process. leave them alone.
+            _pools = {}
+            _pools_pid = os.getpid()
+        return _pools.setdefault(current_app.config['DATABASE'], queue.LifoQueue(maxsize=size)) # the most recently used connection has the warmest page cache.
+
+
+def take_connection():
+    '''An idle pooled connection, or None.'''
+    pool = get_pool()
+    if pool is None:
+        return None
+    try:
+        return pool.get_nowait()
+    except queue.Empty:
+        return None
+
+
+def release_connection(db):
+    '''Puts a connection back into the pool, in a clean state. Returns False if it should be closed instead.'''
+    pool = get_pool()
+    if pool is None:
+        return False
+    if db.in_transaction: # whatever the request didn't commit is dropped, like closing the connection would.
+        db.rollback()
+    db.row_factory = sqlite3.Row # views change it to `dict_factory`.
+    try:
+        pool.put_nowait(db)
+    except queue.Full:
+        return False
+    return True
+
+
+def open_pool(app):
+    '''Fills this process's pool, so the first requests of a new worker don't wait for connections. Call it after the fork.'''
+    contexts = [app.app_context() for _ in range(app.config['DB_POOL_SIZE'])]
+    for context in contexts:
+        context.push()
+        get_db() # each context opens its own connection,
+    for context in reversed(contexts):
+        context.pop() # and its teardown puts it into the pool.
+
+
+def close_pool():
+    '''Closes this process's pooled connections. Call it before forking.'''
+    global _pools
+    with _pools_lock:
+        pools, _pools = _pools, {}
+        if _pools_pid != os.getpid():
+            return
+    for pool in pools.values():
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# Per-worker copies of `cache_versions` rows, so hot paths don't query them on every request.
+_cache_versions = {} # maps (database, name) to (version, monotonic time it was read).
+
+
+def get_cache_version(name, max_age=0):
+    '''Returns the version of a cached data set from the `cache_versions` table. A value read by this worker less than `max_age` seconds ago is returned without a query.'''
+    key = (current_app.config['DATABASE'], name)
+    cached = _cache_versions.get(key)
+    now = time.monotonic()
+    if cached is not None and now - cached[1] < max_age:
+        return cached[0]
+    cur = get_db().cursor()
+    cur.row_factory = None
+    row = cur.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+    version = row[0] if row is not None else 0
+    _cache_versions[key] = (version, now)
+    return version
+
+
+def bump_cache_version(db, name):
+    '''Tells every worker that the data cached under `name` changed. Call it before the commit of the change.'''
+    db.execute(
+        'INSERT INTO cache_versions (name, version) VALUES (?, 1)'
+        ' ON CONFLICT (name) DO UPDATE SET version = version + 1',
+        (name,)
+    )
+
+
+def execute_write(database, sql, parameters=()):
+    '''Runs one write statement on a short-lived connection. This is for code that runs outside of a request, where `g` is not available.'''
+    db = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        db.execute(sql, parameters)
+        db.commit()
+    finally:
         db.close()
 
 
+async def execute_write_async(database, sql, parameters=()):
+    '''The asyncio version of `execute_write`. The blocking sqlite call runs in a worker thread so the event loop keeps serving other coroutines meanwhile.'''
+    await asyncio.to_thread(execute_write, database, sql, parameters)
+
+
 def init_db():
     db = get_db() # returns a database connection
 
@@ -44,6 +179,9 @@ def init_db():
         current_app.config["AGENT_MODELS"]
     )
 
+    bump_cache_version(db, 'agent_models') # running workers reload their cached agent models
+    bump_cache_version(db, 'users') # and user snapshots.
+
     db.commit()
 
 
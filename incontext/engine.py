@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+from incontext.accounting import get_accounting_settings, record_usage
+from incontext.db import execute_write_async, get_db
+from incontext.providers import get_provider, get_provider_settings
+from incontext.ratelimit import per_minute, take_tokens
+
+logger = logging.getLogger(__name__)
+ORPHANED_AFTER = '-10 minutes' # how long after its start a run that's still pending is taken to be lost, e.g. with a worker that restarted. a sqlite datetime modifier.
+
+# Each process has one event loop running in a background thread. Agent runs are scheduled on it as coroutines, so a run that is waiting on a provider costs a coroutine instead of a whole worker, and hundreds of them can be in flight in one process.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    '''Returns this process's engine event loop, and starts the thread that runs it on first use.'''
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid(): # a loop inherited through a fork has no thread running it in this process.
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name='incontext-engine', daemon=True).start()
+    return _loop
+
+
+async def execute_run(database, provider, settings, run):
+    '''Calls the provider for one run, stores the outcome in `agent_runs` and records the usage in the ledger. Nothing reads the result of a run scheduled on the loop, so failures are logged here, and a run whose outcome can't be stored is marked as failed if possible.'''
+    started = time.perf_counter()
+    try:
+        output = await provider(run, settings)
+        status = 'done'
+    except Exception as e: # a failing provider must not take the engine down. The error is shown on the run instead.
+        output = str(e)
+        status = 'error'
+    latency_ms = (time.perf_counter() - started) * 1000
+    try:
+        await execute_write_async(
+            database,
+            'UPDATE agent_runs SET status = ?, output = ?, finished = CURRENT_TIMESTAMP'
+            ' WHERE id = ?',
+            (status, output, run['id'])
+        )
+    except Exception:
+        logger.exception('The outcome of agent run %s could not be stored.', run['id'])
+        status = 'error'
+        try:
+            await execute_write_async(
+                database,
+                "UPDATE agent_runs SET status = 'error', output = 'The outcome of the run could not be stored.', finished = CURRENT_TIMESTAMP"
+                ' WHERE id = ?',
+                (run['id'],)
+            )
+        except Exception: # the run stays pending until `fail_orphaned_runs` gives up on it.
+            logger.exception('Agent run %s could not be marked as failed.', run['id'])
+    try:
+        await asyncio.to_thread(record_usage, database, settings, run, output, latency_ms)
+    except Exception:
+        logger.exception('The usage of agent run %s could not be recorded.', run['id'])
+    return status
+
+
+def log_run_failure(future):
+    '''A done callback for the futures of scheduled runs, which nothing else reads.'''
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('An agent run failed.', exc_info=future.exception())
+
+
+def fail_orphaned_runs(db, user_id):
+    '''Marks the user's runs that have been pending for longer than `ORPHANED_AFTER` as failed. Their coroutines were lost, e.g. with a worker that restarted, so nothing else will finish them. Commit afterwards.'''
+    db.execute(
+        "UPDATE agent_runs SET status = 'error', output = 'The run was interrupted.', finished = CURRENT_TIMESTAMP"
+        " WHERE creator_id = ? AND status = 'pending' AND created < datetime('now', ?)",
+        (user_id, ORPHANED_AFTER)
+    )
+
+
+def check_run_limits(user_id, model_id, provider_code):
+    '''Checks the concurrency and rate limits for a new run. Returns 0 if the run may start, otherwise the number of seconds to wait.
+
+    A user may have at most `AGENT_MAX_PENDING_PER_USER` runs in flight. `AGENT_RATE_LIMITS` holds token buckets per user, per `agent_models` row and per provider, so one heavy user can't take the whole capacity of a model or provider.'''
+    db = get_db()
+    fail_orphaned_runs(db, user_id) # so they neither count as in flight nor show as pending for good.
+    db.commit() # `take_tokens` starts a transaction of its own.
+    max_pending = current_app.config['AGENT_MAX_PENDING_PER_USER']
+    if max_pending is not None:
+        pending = db.execute(
+            "SELECT COUNT(*) AS count FROM agent_runs"
+            " WHERE creator_id = ? AND status = 'pending'",
+            (user_id,)
+        ).fetchone()['count']
+        if pending >= max_pending:
+            return 1
+    rate_limits = current_app.config['AGENT_RATE_LIMITS']
+    limits = [
+        per_minute(f'agent-runs:user:{user_id}', rate_limits.get('user')),
+        per_minute(f'agent-runs:model:{model_id}', rate_limits.get('model')),
+        per_minute(f'agent-runs:provider:{provider_code}', rate_limits.get('provider')),
+    ]
+    return take_tokens(db, [limit for limit in limits if limit is not None])
+
+
+def submit_run(run):
+    '''Starts an agent run. `run` needs the keys id, creator_id, agent_id, model_id, provider_code, model_code, role, instructions, context and prompt, and its `agent_runs` row must already be committed.
+
+    With `AGENT_ENGINE = 'async'` (the default) the run is handed to the engine loop and a `concurrent.futures.Future` is returned straight away. With `'sync'` the provider is called inside the request, which holds the worker for the whole call.'''
+    coroutine = execute_run(
+        current_app.config['DATABASE'],
+        get_provider(run['provider_code']),
+        {**get_provider_settings(), **get_accounting_settings()},
+        run
+    )
+    if current_app.config['AGENT_ENGINE'] == 'sync':
+        return asyncio.run(coroutine)
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+    future.add_done_callback(log_run_failure)
+    return future
@@ -0,0 +1,26 @@
+from flask import current_app, request
+from markupsafe import Markup
+
+from incontext.cache import LRUCache
+
+# Rendered HTML of the item and detail sections of list pages. Keys hold the list versions, so repeat views of an unchanged list skip the item queries and most of the template rendering, and a changed list never matches an old entry.
+_fragments = LRUCache(maxsize=512, maxbytes=32 * 1024 * 1024)
+
+
+def get_fragment(kind, object_id, versions, render):
+    '''Returns the cached fragment of `kind` (e.g. 'list') for `object_id` at `versions`, a tuple of every version the fragment depends on. On a miss it calls `render()` and caches the result.'''
+    key = (
+        current_app.config['DATABASE'],
+        request.script_root, # the fragments contain urls.
+        kind, object_id, versions,
+    )
+    fragment = _fragments.get(key)
+    if fragment is None:
+        fragment = Markup(render()) # rendered templates are already escaped.
+        _fragments.set(key, fragment)
+    return fragment
+
+
+def discard_fragments(kind, object_id):
+    '''Drops this worker's fragments of an object right away, instead of leaving them to age out of the cache.'''
+    return _fragments.discard(lambda key: key[2] == kind and key[3] == object_id)
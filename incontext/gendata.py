@@ -0,0 +1,178 @@
+import itertools
+import random
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from incontext.db import get_db
+from incontext.passwords import hash_password
+
+# Synthetic data for load testing. Rows are generated lazily and written with `executemany` in batches of `--batch-size` rows per transaction, so large databases fit in memory and generate quickly. Ids are assigned here instead of by sqlite, so related rows can be generated without reading anything back.
+WORDS = (
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliett',
+    'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango',
+    'uniform', 'victor', 'whiskey', 'xray', 'yankee', 'zulu', 'red', 'green', 'blue', 'amber',
+)
+
+
+def words(rng, count):
+    return ' '.join(rng.choices(WORDS, k=count))
+
+
+def next_id(db, table):
+    return db.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+
+
+def insert_rows(db, sql, rows, batch_size):
+    '''Inserts rows from an iterable in batches, one transaction each. Returns the number of rows.'''
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return count
+        db.executemany(sql, batch)
+        db.commit()
+        count += len(batch)
+
+
+def generate(db, seed, users, admins, lists_per_user, tethered_per_user, items_per_list, details_per_list, master_lists, master_items, master_details, batch_size, password):
+    '''Adds the synthetic data and returns the number of rows written to each table.'''
+    rng = random.Random(seed)
+    first = {table: next_id(db, table) for table in ('users', 'master_lists', 'master_items', 'master_details', 'lists', 'items', 'details')}
+    admin_ids = [first['users'] + n for n in range(min(admins, users))]
+    if master_lists and not admin_ids:
+        row = db.execute('SELECT id FROM users WHERE admin = 1 ORDER BY id LIMIT 1').fetchone()
+        if row is None:
+            raise click.UsageError('Master lists need an admin. Use --admins.')
+        admin_ids = [row[0]]
+    if tethered_per_user and not master_lists:
+        raise click.UsageError('Tethered lists need master lists. Use --master-lists.')
+    rows = {}
+
+    def user_id(u):
+        return first['users'] + u
+
+    rows['users'] = insert_rows(db, 'INSERT INTO users (id, username, password, admin) VALUES (?, ?, ?, ?)', (
+        (user_id(u), f'user{user_id(u)}', password, user_id(u) in admin_ids)
+        for u in range(users)
+    ), batch_size)
+
+    # master lists, each with its own details and items.
+    def master_detail_ids(m):
+        start = first['master_details'] + m * master_details
+        return range(start, start + master_details)
+
+    def master_item_ids(m):
+        start = first['master_items'] + m * master_items
+        return range(start, start + master_items)
+
+    creators = [admin_ids[m % len(admin_ids)] for m in range(master_lists)]
+    rows['master_lists'] = insert_rows(db, 'INSERT INTO master_lists (id, creator_id, name, description) VALUES (?, ?, ?, ?)', (
+        (first['master_lists'] + m, creators[m], f'master list {first["master_lists"] + m}', words(rng, 8))
+        for m in range(master_lists)
+    ), batch_size)
+    rows['master_details'] = insert_rows(db, 'INSERT INTO master_details (id, creator_id, name, description) VALUES (?, ?, ?, ?)', (
+        (detail_id, creators[m], words(rng, 2), words(rng, 6))
+        for m in range(master_lists) for detail_id in master_detail_ids(m)
+    ), batch_size)
+    rows['master_list_detail_relations'] = insert_rows(db, 'INSERT INTO master_list_detail_relations (master_list_id, master_detail_id) VALUES (?, ?)', (
+        (first['master_lists'] + m, detail_id)
+        for m in range(master_lists) for detail_id in master_detail_ids(m)
+    ), batch_size)
+    rows['master_items'] = insert_rows(db, 'INSERT INTO master_items (id, creator_id, name) VALUES (?, ?, ?)', (
+        (item_id, creators[m], words(rng, 3))
+        for m in range(master_lists) for item_id in master_item_ids(m)
+    ), batch_size)
+    rows['master_list_item_relations'] = insert_rows(db, 'INSERT INTO master_list_item_relations (master_list_id, master_item_id) VALUES (?, ?)', (
+        (first['master_lists'] + m, item_id)
+        for m in range(master_lists) for item_id in master_item_ids(m)
+    ), batch_size)
+    rows['master_item_detail_relations'] = insert_rows(db, 'INSERT INTO master_item_detail_relations (master_item_id, master_detail_id, master_content) VALUES (?, ?, ?)', (
+        (item_id, detail_id, words(rng, 4))
+        for m in range(master_lists) for item_id in master_item_ids(m) for detail_id in master_detail_ids(m)
+    ), batch_size)
+
+    # untethered lists first, then tethered lists. list `l` belongs to user `l // lists_per_user` (or `t // tethered_per_user`).
+    plain_lists = users * lists_per_user
+    tethered_lists = users * tethered_per_user
+    tethers = [rng.randrange(master_lists) for _ in range(tethered_lists)] # the master list of each tethered list.
+
+    def list_owner(l):
+        if l < plain_lists:
+            return user_id(l // lists_per_user)
+        return user_id((l - plain_lists) // tethered_per_user)
+
+    def detail_ids(l):
+        start = first['details'] + l * details_per_list
+        return range(start, start + details_per_list)
+
+    def item_ids(l):
+        start = first['items'] + l * items_per_list
+        return range(start, start + items_per_list)
+
+    rows['lists'] = insert_rows(db, 'INSERT INTO lists (id, creator_id, name, description, tethered) VALUES (?, ?, ?, ?, ?)', itertools.chain(
+        ((first['lists'] + l, list_owner(l), f'list {first["lists"] + l}', words(rng, 8), False) for l in range(plain_lists)),
+        ((first['lists'] + l, list_owner(l), f'master list {first["master_lists"] + tethers[l - plain_lists]} (tethered)', None, True) for l in range(plain_lists, plain_lists + tethered_lists)),
+    ), batch_size)
+    rows['list_tethers'] = insert_rows(db, 'INSERT INTO list_tethers (list_id, master_list_id) VALUES (?, ?)', (
+        (first['lists'] + plain_lists + t, first['master_lists'] + tethers[t])
+        for t in range(tethered_lists)
+    ), batch_size)
+    rows['details'] = insert_rows(db, 'INSERT INTO details (id, creator_id, name, description) VALUES (?, ?, ?, ?)', (
+        (detail_id, list_owner(l), words(rng, 2), words(rng, 6))
+        for l in range(plain_lists) for detail_id in detail_ids(l)
+    ), batch_size)
+    rows['list_detail_relations'] = insert_rows(db, 'INSERT INTO list_detail_relations (list_id, detail_id) VALUES (?, ?)', (
+        (first['lists'] + l, detail_id)
+        for l in range(plain_lists) for detail_id in detail_ids(l)
+    ), batch_size)
+    rows['items'] = insert_rows(db, 'INSERT INTO items (id, creator_id, name) VALUES (?, ?, ?)', (
+        (item_id, list_owner(l), words(rng, 3))
+        for l in range(plain_lists + tethered_lists) for item_id in item_ids(l)
+    ), batch_size)
+    rows['list_item_relations'] = insert_rows(db, 'INSERT INTO list_item_relations (list_id, item_id) VALUES (?, ?)', (
+        (first['lists'] + l, item_id)
+        for l in range(plain_lists + tethered_lists) for item_id in item_ids(l)
+    ), batch_size)
+    rows['item_detail_relations'] = insert_rows(db, 'INSERT INTO item_detail_relations (item_id, detail_id, content) VALUES (?, ?, ?)', (
+        (item_id, detail_id, words(rng, 4))
+        for l in range(plain_lists) for item_id in item_ids(l) for detail_id in detail_ids(l)
+    ), batch_size)
+    rows['untethered_content'] = insert_rows(db, 'INSERT INTO untethered_content (list_id, item_id, master_detail_id, content) VALUES (?, ?, ?, ?)', (
+        (first['lists'] + l, item_id, detail_id, words(rng, 4))
+        for l in range(plain_lists, plain_lists + tethered_lists) for item_id in item_ids(l) for detail_id in master_detail_ids(tethers[l - plain_lists])
+    ), batch_size)
+    return rows
+
+
+@click.command('gen-data')
+@click.option('--seed', default=0, show_default=True, help='Same seed, same data.')
+@click.option('--users', default=100, show_default=True)
+@click.option('--admins', default=1, show_default=True, help='How many of the new users are admins.')
+@click.option('--lists', 'lists_per_user', default=5, show_default=True, help='Untethered lists per user.')
+@click.option('--tethered', 'tethered_per_user', default=2, show_default=True, help='Tethered lists per user.')
+@click.option('--items', 'items_per_list', default=50, show_default=True, help='Items per list.')
+@click.option('--details', 'details_per_list', default=5, show_default=True, help='Details per untethered list.')
+@click.option('--master-lists', default=10, show_default=True)
+@click.option('--master-items', default=100, show_default=True, help='Items per master list.')
+@click.option('--master-details', default=5, show_default=True, help='Details per master list.')
+@click.option('--batch-size', default=100000, show_default=True, help='Rows per transaction.')
+@click.option('--password', default='password', show_default=True, help='The password of every new user.')
+@with_appcontext
+def gen_data_command(password, **options):
+    '''Add synthetic users, lists and master lists for load testing.'''
+    db = get_db()
+    db.execute('PRAGMA synchronous = OFF') # it's throwaway data. a crash mid-run loses the last batches instead of paying for an fsync per transaction.
+    started = time.perf_counter()
+    rows = generate(db, password=hash_password(password), **options) # one hash for every user.
+    elapsed = time.perf_counter() - started
+    for table, count in rows.items():
+        click.echo(f'{table:<32}{count:>12}')
+    cells = rows['item_detail_relations'] + rows['untethered_content'] + rows['master_item_detail_relations']
+    click.echo(f'Generated {cells} content cells in {elapsed:.1f}s.')
+
+
+def init_app(app):
+    app.cli.add_command(gen_data_command)
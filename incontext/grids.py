@@ -0,0 +1,169 @@
+import json
+
+from flask import current_app
+
+# A denormalised read model of each list's item × detail grid: one `list_grids` row per item, with all of its cells packed into a JSON object keyed by detail id (master detail id for tethered lists). Reading a list's grid is one range scan of the primary key instead of joining the items with their contents.
+# The write paths in `lists.py` keep the rows up to date in the same transaction as the change, and so does applying a master list change to a tethered list (see `master_changes.py`). `lists.grid_version` is the list version the rows are known to match: `bump_list_version` carries it forward when it matched before the write, and a grid that doesn't match, e.g. after `gen-data` or with `LIST_GRIDS` off for a while, is rebuilt from the relational tables on the next read.
+
+
+def dump_cells(cells):
+    '''Packs cells like sqlite's JSON functions do, without spaces.'''
+    return json.dumps({str(detail_id): content for detail_id, content in cells.items()}, separators=(',', ':'))
+
+
+def path(detail_id):
+    '''The JSON path of a cell in `cells`.'''
+    return f'$."{detail_id}"'
+
+
+def build_list_grid(db, list_id, tethered):
+    '''Rebuilds a list's grid from the relational tables and marks it as matching the current list version. Call it in a transaction.'''
+    db.execute('DELETE FROM list_grids WHERE list_id = ?', (list_id,))
+    if tethered:
+        db.execute( # the cells a snapshot copy still shares with its master item, patched with the list's own.
+            'INSERT INTO list_grids (list_id, item_id, name, created, cells)'
+            ' SELECT r.list_id, i.id, i.name, i.created, json_patch('
+            '  (SELECT json_group_object(c.master_detail_id, c.master_content)'
+            '   FROM master_item_detail_relations c'
+            '   WHERE c.master_item_id = s.master_item_id'
+            '    AND c.master_detail_id IN (SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = t.master_list_id)),'
+            '  (SELECT json_group_object(c.master_detail_id, c.content)'
+            '   FROM untethered_content c'
+            '   WHERE c.list_id = r.list_id AND c.item_id = i.id'
+            '    AND c.master_detail_id IN (SELECT master_detail_id FROM master_list_detail_relations WHERE master_list_id = t.master_list_id)))'
+            ' FROM list_item_relations r'
+            ' JOIN items i ON i.id = r.item_id'
+            ' JOIN list_tethers t ON t.list_id = r.list_id'
+            ' LEFT JOIN snapshot_items s ON s.item_id = i.id'
+            ' WHERE r.list_id = ?',
+            (list_id,)
+        )
+    else:
+        db.execute(
+            'INSERT INTO list_grids (list_id, item_id, name, created, cells)'
+            ' SELECT r.list_id, i.id, i.name, i.created,'
+            '  (SELECT json_group_object(c.detail_id, c.content)'
+            '   FROM item_detail_relations c'
+            '   WHERE c.item_id = i.id'
+            '    AND c.detail_id IN (SELECT detail_id FROM list_detail_relations WHERE list_id = r.list_id))'
+            ' FROM list_item_relations r'
+            ' JOIN items i ON i.id = r.item_id'
+            ' WHERE r.list_id = ?',
+            (list_id,)
+        )
+    db.execute('UPDATE lists SET grid_version = version WHERE id = ?', (list_id,))
+
+
+class GridItem:
+    '''One item of a `Grid`. Its cells are kept in the grid's columns, so an item is one small object however many details the list has.'''
+    __slots__ = ('id', 'name', 'created', '_grid', '_index')
+
+    def __init__(self, grid, index, id, name, created):
+        self._grid = grid
+        self._index = index
+        self.id = id
+        self.name = name
+        self.created = created
+
+    @property
+    def cells(self):
+        '''The item's contents, in the order of the grid's details. A missing cell is ''.'''
+        index = self._index
+        return [column[index] for column in self._grid.columns]
+
+
+class Grid:
+    '''A list's items and their contents. Contents are stored by column, one python list of string references per detail, instead of a dict per item and per cell. Iterating yields the `GridItem`s in item order, and `iter_rows` yields plain rows for exporters.'''
+    __slots__ = ('detail_ids', 'items', 'columns')
+
+    def __init__(self, detail_ids):
+        self.detail_ids = list(detail_ids)
+        self.items = []
+        self.columns = [[] for _ in self.detail_ids]
+
+    def append(self, item_id, name, created, cells):
+        '''Adds an item. `cells` are its contents in the order of `detail_ids`.'''
+        self.items.append(GridItem(self, len(self.items), item_id, name, created))
+        for column, content in zip(self.columns, cells):
+            column.append(content)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def iter_rows(self):
+        '''Yields [name, content, ...] for each item.'''
+        for item in self.items:
+            yield [item.name] + item.cells
+
+
+def use_list_grid(alist):
+    '''Whether a list is read from its grid. Snapshot lists always are: their rows hold the cells they share with the master items.'''
+    return current_app.config['LIST_GRIDS'] or bool(alist['snapshot'])
+
+
+def ensure_list_grid(db, alist):
+    '''Rebuilds and commits a list's grid if it doesn't match the list version. `alist` is a row from `get_list`.'''
+    if alist['grid_version'] != alist['version']:
+        build_list_grid(db, alist['id'], alist['tethered'])
+        db.commit()
+
+
+def iter_grid_rows(db, alist, detail_ids):
+    '''Yields (item id, name, created, contents) for each item of a list in item order, with the contents in the order of `detail_ids`. Rows are decoded one at a time, so exporters can stop early without reading the rest.'''
+    ensure_list_grid(db, alist)
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(
+        'SELECT item_id, name, created, cells FROM list_grids WHERE list_id = ? ORDER BY item_id',
+        (alist['id'],)
+    )
+    keys = [str(detail_id) for detail_id in detail_ids]
+    for item_id, name, created, cells in cur:
+        cells = json.loads(cells)
+        yield item_id, name, created, [cells.get(key, '') for key in keys]
+
+
+def get_list_grid(db, alist, detail_ids):
+    '''A list's `Grid`, read from `list_grids`, with a column for each of `detail_ids`.'''
+    grid = Grid(detail_ids)
+    for row in iter_grid_rows(db, alist, detail_ids): # one row's JSON at a time, instead of all of them from `fetchall`.
+        grid.append(*row)
+    return grid
+
+
+def add_grid_item(db, list_id, item_id, cells):
+    '''Adds the row of a new item. `cells` maps detail ids to contents.'''
+    db.execute(
+        'INSERT INTO list_grids (list_id, item_id, name, created, cells)'
+        ' SELECT ?, id, name, created, ? FROM items WHERE id = ?',
+        (list_id, dump_cells(cells), item_id)
+    )
+
+
+def update_grid_item(db, list_id, item_id, name, cells):
+    '''Renames an item and overwrites the given cells.'''
+    db.execute(
+        'UPDATE list_grids SET name = ?, cells = json_patch(cells, ?) WHERE list_id = ? AND item_id = ?',
+        (name, dump_cells(cells), list_id, item_id)
+    )
+
+
+def delete_grid_item(db, list_id, item_id):
+    db.execute('DELETE FROM list_grids WHERE list_id = ? AND item_id = ?', (list_id, item_id))
+
+
+def delete_list_grid(db, list_id):
+    db.execute('DELETE FROM list_grids WHERE list_id = ?', (list_id,))
+
+
+def add_grid_column(db, list_id, detail_id):
+    '''Adds an empty cell for a new detail to every item of a list that doesn't have it yet.'''
+    db.execute('UPDATE list_grids SET cells = json_insert(cells, ?, ?) WHERE list_id = ?', (path(detail_id), '', list_id))
+
+
+def delete_grid_column(db, list_id, detail_id):
+    db.execute('UPDATE list_grids SET cells = json_remove(cells, ?) WHERE list_id = ?', (path(detail_id), list_id))
+
@@ -0,0 +1,23 @@
+'''Gunicorn settings for a preloaded, fork-safe deployment.
+
+    gunicorn -c python:incontext.gunicorn_conf
+
+The app is built and warmed once in the master (see `wsgi.py`) and the workers are forked from it. Settings can be overridden on the command line as usual.
+'''
+import os
+
+wsgi_app = 'incontext.wsgi:app'
+preload_app = True # the app, its modules and its warm caches are shared copy-on-write by the workers.
+bind = os.environ.get('IC_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.environ.get('IC_THREADS', 1))
+
+
+def pre_fork(server, worker):
+    from incontext.startup import before_fork
+    before_fork(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    from incontext.startup import after_fork
+    after_fork(server.app.wsgi())
@@ -1,13 +1,26 @@
+import itertools
+import json
+
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for, jsonify
+    Blueprint, flash, g, redirect, render_template, request, url_for, jsonify, make_response, Response
 )
 from werkzeug.exceptions import abort
 
 from incontext.auth import login_required
+from incontext.conditional import get_last_modified, make_etag, not_modified, set_validators
+from incontext.context import get_list_context
 from incontext.db import get_db
 from incontext.db import dict_factory
+from incontext.fragments import discard_fragments, get_fragment
+from incontext.grids import (
+    Grid, add_grid_column, add_grid_item, build_list_grid, delete_grid_column, delete_grid_item, delete_list_grid, ensure_list_grid, get_list_grid, iter_grid_rows, update_grid_item, use_list_grid
+)
 from incontext.master_lists import get_master_lists
 from incontext.master_lists import get_master_list
+from incontext.master_lists import iter_master_items
+from incontext.master_changes import catch_up, get_latest_seq
+from incontext.snapshots import set_untethered_content, snapshot_master_items
+from incontext.streaming import RowStream, should_stream, stream_page
 
 
 bp = Blueprint('lists', __name__, url_prefix='/lists')
@@ -49,6 +62,7 @@ def new():
 def new_tethered():
     if request.method == "POST":
         requested_master_list = get_master_list(request.form["master_list_id"], False)
+        snapshot = bool(request.form.get("snapshot"))
         db = get_db()
         cur = db.cursor()
         # Get the master list name and description
@@ -60,12 +74,16 @@ def new_tethered():
             (new_list_name, g.user['id'])
         )
         new_list_id = cur.lastrowid
-        # Record the tether
+        # Record the tether. The list starts from the master list as it is now, after the changes logged so far
         cur.execute(
-            "INSERT INTO list_tethers(list_id, master_list_id)"
-            " VALUES (?, ?)",
-            (new_list_id, requested_master_list["id"])
+            "INSERT INTO list_tethers(list_id, master_list_id, snapshot, applied_seq)"
+            " VALUES (?, ?, ?, ?)",
+            (new_list_id, requested_master_list["id"], snapshot, get_latest_seq(db, requested_master_list["id"]))
         )
+        # Copy the master items into a snapshot
+        if snapshot:
+            snapshot_master_items(db, new_list_id, requested_master_list["id"], g.user['id'])
+            build_list_grid(db, new_list_id, True)
         db.commit()
         # Redirect to the list's view view
         return redirect(url_for('lists.view', list_id=new_list_id))
@@ -76,20 +94,53 @@ def new_tethered():
 @bp.route('/<int:list_id>/view')
 @login_required
 def view(list_id):
-    alist = get_list(list_id)
-    items = get_list_items_with_details(list_id, True)
-    details = get_list_details(list_id)
+    alist = get_list(list_id, with_header=True) # the first of the page's two queries.
+    master_list, details, count = get_list_header(alist)
+    etag, last_modified = get_list_validators(alist)
+    response = not_modified(etag, last_modified) # answered before the item queries and the rendering.
+    if response is not None:
+        return response
+    if not catch_up(alist): # the page shows the list as it was before the latest master changes. it's neither cached nor given validators.
+        etag = last_modified = None
     if alist["tethered"]:
-        db = get_db()
-        master_list_id = db.execute(
-            "SELECT master_list_id"
-            " FROM list_tethers"
-            " WHERE list_id = ?",
-            (list_id,)
-        ).fetchone()["master_list_id"]
-        master_list = get_master_list(master_list_id, False)
-        return render_template('lists/view_tethered.html', alist=alist, master_list=master_list, items=items, details=details)
-    return render_template('lists/view.html', alist=alist, items=items, details=details)
+        master_detail_ids = [master_detail['id'] for master_detail in master_list['master_details']]
+        if should_stream(count, master_list['master_items_count']):
+            master_items = [] if alist['snapshot'] else RowStream(iter_master_items(master_list['id'], master_detail_ids), master_list['master_items_count'])
+            master_list = dict(master_list, master_items=master_items)
+            items = RowStream(iter_list_items(alist, master_detail_ids), count)
+            page = stream_page('lists/view_tethered.html', alist=alist, master_list=master_list, items=items, details=details)
+            return set_validators(page, etag, last_modified)
+        def render():
+            master_items, items = get_tethered_items(alist, master_detail_ids)
+            return render_template('lists/view_tethered_main.html', alist=alist, master_list=dict(master_list, master_items=master_items), items=items, details=details)
+        main = get_fragment('list', list_id, (alist['version'], alist['master_list_version']), render) if etag else render()
+        page = render_template('lists/view_tethered.html', alist=alist, master_list=master_list, main=main)
+    else:
+        if should_stream(count):
+            items = RowStream(iter_list_items(alist, [detail['id'] for detail in details]), count)
+            return set_validators(stream_page('lists/view.html', alist=alist, items=items, details=details), etag, last_modified)
+        def render():
+            items = get_list_items_with_details(alist, details)
+            return render_template('lists/view_main.html', alist=alist, items=items, details=details)
+        main = get_fragment('list', list_id, (alist['version'],), render) # only runs the item queries when the list changed since it was last rendered.
+        page = render_template('lists/view.html', alist=alist, main=main)
+    return set_validators(make_response(page), etag, last_modified)
+
+
+@bp.route('/<int:list_id>/export')
+@login_required
+def export(list_id):
+    alist = get_list(list_id)
+    etag, last_modified = get_list_validators(alist)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    if not catch_up(alist):
+        etag = last_modified = None
+    columns = request.args.getlist('column', type=int) or None
+    budget = request.args.get('budget', type=int)
+    context = get_list_context(alist, columns, budget)
+    return set_validators(Response(context, mimetype='text/plain'), etag, last_modified)
 
 
 @bp.route('/<int:list_id>/edit', methods=('GET', 'POST'))
@@ -113,6 +164,7 @@ def edit(list_id):
                 ' WHERE id = ?',
                 (name, description, list_id)
             )
+            bump_list_version(list_id)
             db.commit()
             return redirect(url_for('lists.index'))
     return render_template('lists/edit.html', alist=alist)
@@ -150,6 +202,10 @@ def delete(list_id):
     db.execute('DELETE FROM list_detail_relations WHERE list_id = ?', (list_id,))
     # Delete list_tethers
     db.execute("DELETE FROM list_tethers WHERE list_id = ?", (list_id,))
+    # Delete the links of snapshot copies to their master items
+    db.execute("DELETE FROM snapshot_items WHERE list_id = ?", (list_id,))
+    # Delete the list's grid
+    delete_list_grid(db, list_id)
     # Delete list
     db.execute('DELETE FROM lists WHERE id = ?', (list_id,))
     db.commit()
@@ -215,6 +271,8 @@ def new_item(list_id):
                     ' VALUES(?, ?, ?)',
                     relations
                 )
+            add_grid_item(db, list_id, item_id, dict(detail_fields))
+            bump_list_version(list_id)
             db.commit()
             return redirect(url_for('lists.view', list_id=list_id))
     alist = get_list(list_id)
@@ -238,6 +296,7 @@ def new_item(list_id):
 @login_required
 def view_item(list_id, item_id):
     alist = get_list(list_id)
+    catch_up(alist)
     item, details = get_list_item(list_id, item_id)
     return render_template('lists/items/view.html', alist=alist, item=item, details=details)
 
@@ -246,6 +305,7 @@ def view_item(list_id, item_id):
 @login_required
 def edit_item(list_id, item_id):
     alist = get_list(list_id)
+    catch_up(alist) # the form shows, and the edit compares against, the item's current contents.
     master_list_id = get_db().execute(
         "SELECT master_list_id FROM list_tethers"
         " WHERE list_id = ?",
@@ -256,6 +316,7 @@ def edit_item(list_id, item_id):
         alist["name"] = master_list["name"] + " (tethered)"
         alist["description"] = master_list["description"]
     item, details = get_list_item(list_id, item_id)
+    cells = {detail['id']: detail['content'] for detail in details}
     if request.method == 'POST':
         name = request.form['name']
         detail_fields = []
@@ -282,16 +343,9 @@ def edit_item(list_id, item_id):
                 (name, item_id)
             )
             if master_list_id:
-                for detail_field in detail_fields:
-                    detail_field.append(list_id)    
-                db.executemany(
-                    "UPDATE untethered_content"
-                    " SET content = ?"
-                    " WHERE item_id = ?"
-                    " AND master_detail_id = ?"
-                    " AND list_id = ?",
-                    detail_fields
-                )
+                for content, item_id, detail_id in detail_fields:
+                    if cells.get(detail_id) != content: # a snapshot copy gets its own content only for the cells that changed.
+                        set_untethered_content(db, list_id, item_id, detail_id, content)
             else:
                 db.executemany(
                     'UPDATE item_detail_relations'
@@ -300,6 +354,8 @@ def edit_item(list_id, item_id):
                     ' AND detail_id = ?',
                     detail_fields
                 )
+            update_grid_item(db, list_id, item_id, name, {detail_field[2]: detail_field[0] for detail_field in detail_fields})
+            bump_list_version(list_id)
             db.commit()
             return redirect(url_for('lists.view', list_id=list_id))
     return render_template('lists/items/edit.html', alist=alist, item=item, details=details)
@@ -320,8 +376,11 @@ def delete_item(list_id, item_id):
     tethered = True if alist["tethered"] else False
     if tethered:
         db.execute("DELETE FROM untethered_content WHERE item_id = ?", (item_id,))
+        db.execute("DELETE FROM snapshot_items WHERE item_id = ?", (item_id,))
     else:
         db.execute('DELETE FROM item_detail_relations WHERE item_id = ?', (item_id,))
+    delete_grid_item(db, list_id, item_id)
+    bump_list_version(list_id)
     db.commit()
     return redirect(url_for('lists.view', list_id=list_id))
 
@@ -361,6 +420,8 @@ def new_detail(list_id):
                 'VALUES (?, ?, ?)',
                 data
             )
+            add_grid_column(db, list_id, detail_id)
+            bump_list_version(list_id)
             db.commit()
             return redirect(url_for('lists.view', list_id=list_id))
     return render_template('lists/details/new.html', alist=alist)
@@ -386,6 +447,7 @@ def edit_detail(list_id, detail_id):
                 ' WHERE id = ?',
                 (name, description, detail_id)
             )
+            bump_list_version(list_id)
             db.commit()
             return redirect(url_for('lists.view', list_id=list_id))
     return render_template('lists/details/edit.html', alist=alist, detail=detail)
@@ -400,6 +462,8 @@ def delete_detail(list_id, detail_id):
     db.execute('DELETE FROM details WHERE id = ?', (detail_id,))
     db.execute('DELETE FROM item_detail_relations WHERE detail_id = ?', (detail_id,))
     db.execute('DELETE FROM list_detail_relations WHERE detail_id = ?', (detail_id,))
+    delete_grid_column(db, list_id, detail_id)
+    bump_list_version(list_id)
     db.commit()
     return redirect(url_for('lists.view', list_id=list_id))
 
@@ -408,7 +472,7 @@ def get_user_lists():
     db = get_db()
     db.row_factory = dict_factory
     user_lists = db.execute(
-        'SELECT l.id, l.name, l.description, l.created, t.master_list_id, m.name AS master_list_name, m.description AS master_list_description'
+        'SELECT l.id, l.name, l.description, l.created, t.master_list_id, t.snapshot, m.name AS master_list_name, m.description AS master_list_description'
         ' FROM lists l'
         " LEFT JOIN list_tethers t"
         " ON t.list_id = l.id"
@@ -420,14 +484,31 @@ def get_user_lists():
     return user_lists
 
 
-def get_list(list_id, check_creator=True):
+def get_list(list_id, check_creator=True, with_header=False):
+    '''Returns the list with its tether. `with_header` also loads, in the same query, what the top of the list's page shows: see `get_list_header`.'''
     db = get_db()
     db.row_factory = dict_factory
+    header_sql = (
+        ',  (SELECT json_group_array(json_object(\'id\', d.id, \'name\', d.name, \'description\', d.description))'
+        '   FROM list_detail_relations r JOIN details d ON d.id = r.detail_id'
+        '   WHERE r.list_id = l.id) AS header_details,'
+        '  (SELECT COUNT(*) FROM list_item_relations WHERE list_id = l.id) AS header_items_count,'
+        '  m.creator_id AS master_list_creator_id, m.created AS master_list_created, m.name AS master_list_name, m.description AS master_list_description, mu.username AS master_list_username,'
+        '  (SELECT COUNT(*) FROM master_list_item_relations WHERE master_list_id = m.id) AS master_items_count,'
+        '  (SELECT json_group_array(json_object(\'id\', d.id, \'name\', d.name, \'description\', d.description))'
+        '   FROM master_list_detail_relations r JOIN master_details d ON d.id = r.master_detail_id'
+        '   WHERE r.master_list_id = m.id) AS master_details'
+    ) if with_header else ''
     alist = get_db().execute(
-        'SELECT l.id, l.name, l.description, l.tethered, l.creator_id, t.master_list_id'
+        'SELECT l.id, l.name, l.description, l.tethered, l.creator_id, l.version, l.updated, l.grid_version, t.master_list_id, t.snapshot, t.applied_seq, m.version AS master_list_version, m.updated AS master_list_updated,'
+        '  (SELECT MAX(seq) FROM master_changes c WHERE c.master_list_id = t.master_list_id) AS master_change_seq'
+        + header_sql +
         ' FROM lists l'
         " LEFT JOIN list_tethers t"
         " ON t.list_id = l.id"
+        " LEFT JOIN master_lists m"
+        " ON m.id = t.master_list_id"
+        + (' LEFT JOIN users mu ON mu.id = m.creator_id' if with_header else '') +
         ' WHERE l.id = ?',
         (list_id,)
     ).fetchone()
@@ -440,37 +521,41 @@ def get_list(list_id, check_creator=True):
     return alist
 
 
-def get_list_items_with_details(list_id, check_creator=True):
-    if check_creator:
-        list_creator_id = get_list_creator_id(list_id)
-        if list_creator_id != g.user['id']:
-            abort(403)
-    alist = get_list(list_id)
-    tethered = False
-    if alist["tethered"]:
-        tethered = True
-        master_list_id = get_db().execute(
-            "SELECT master_list_id FROM list_tethers"
-            " WHERE list_id = ?",
-            (list_id,)
-        ).fetchone()["master_list_id"]
+def get_list_header(alist):
+    '''Splits the header of a row from `get_list(..., with_header=True)`. Returns the master list with its `master_details` and `master_items_count` (None for untethered lists), the list's own details, and the number of the list's items.'''
+    details = json.loads(alist.pop('header_details'))
+    count = alist.pop('header_items_count')
+    master_list = {key[len('master_list_'):]: alist.pop(key) for key in ('master_list_creator_id', 'master_list_created', 'master_list_name', 'master_list_description', 'master_list_username')}
+    master_items_count = alist.pop('master_items_count')
+    master_details = alist.pop('master_details')
+    if not alist['tethered']:
+        return None, details, count
+    if master_list['name'] is None: # the master list is gone.
+        abort(404)
+    master_list.update(
+        id=alist['master_list_id'],
+        version=alist['master_list_version'],
+        updated=alist['master_list_updated'],
+        master_details=json.loads(master_details),
+        master_items_count=0 if alist['snapshot'] else master_items_count, # snapshot lists have their own copies of the master items.
+    )
+    return master_list, details, count
+
+
+def get_list_items_with_details(alist, details=None):
+    '''Returns the list's items and their contents as a `grids.Grid`, with a column for each of the list's details (master details for tethered lists). `alist` is a row from `get_list`, and `details` the details if the caller has them already.'''
     db = get_db()
-    items = db.execute(
-        'SELECT i.id, i.name, i.created'
-        ' FROM items i'
-        ' JOIN list_item_relations r ON r.item_id = i.id'
-        ' WHERE r.list_id = ?',
-        (list_id,)
-    ).fetchall()
-    if tethered:
+    list_id = alist['id']
+    tethered = alist['tethered']
+    if details is None and tethered:
         details = db.execute(
             'SELECT d.id, d.name, d.description'
             ' FROM master_details d'
             ' JOIN master_list_detail_relations r ON r.master_detail_id = d.id'
             ' WHERE r.master_list_id = ?',
-            (master_list_id,)
+            (alist['master_list_id'],)
         ).fetchall()
-    else:
+    elif details is None:
         details = db.execute(
             'SELECT d.id, d.name, d.description'
             ' FROM details d'
@@ -478,40 +563,115 @@ def get_list_items_with_details(list_id, check_creator=True):
             ' WHERE r.list_id = ?',
             (list_id,)
         ).fetchall()
-    item_ids = [item['id'] for item in items]
-    placeholders = f'{"?, " * len(item_ids)}'[:-2]
+    detail_ids = [detail['id'] for detail in details]
+    if use_list_grid(alist):
+        return get_list_grid(db, alist, detail_ids)
+    items = db.execute(
+        'SELECT i.id, i.name, i.created'
+        ' FROM items i'
+        ' JOIN list_item_relations r ON r.item_id = i.id'
+        ' WHERE r.list_id = ?'
+        ' ORDER BY i.id',
+        (list_id,)
+    ).fetchall()
     if tethered:
-        data = item_ids + [list_id]
         relations = db.execute(
             'SELECT r.item_id, r.master_detail_id as detail_id, r.content'
             ' FROM untethered_content r'
-            f' WHERE r.item_id IN ({placeholders})'
-            "  AND r.list_id = ?",
-            data
+            ' WHERE r.list_id = ?',
+            (list_id,)
         ).fetchall()
     else:
         relations = db.execute(
             'SELECT r.item_id, r.detail_id, r.content'
             ' FROM item_detail_relations r'
-            f' WHERE r.item_id IN ({placeholders})',
-            item_ids
+            ' JOIN list_item_relations l ON l.item_id = r.item_id'
+            ' WHERE l.list_id = ?',
+            (list_id,)
         ).fetchall()
-    list_items = []
+    contents = {(relation['item_id'], relation['detail_id']): relation['content'] for relation in relations}
+    grid = Grid(detail_ids)
     for item in items:
-        this_item = {}
-        this_item['id'] = item['id']
-        this_item['name'] = item['name']
-        this_item['created'] = item['created']
-        this_item['details'] = []
-        for detail in details:
-            this_detail = {}
-            this_detail['name'] = detail['name']
-            for relation in relations:
-                if relation['item_id'] == item['id'] and relation['detail_id'] == detail['id']:
-                    this_detail['content'] = relation['content']
-            this_item['details'].append(this_detail)
-        list_items.append(this_item)
-    return list_items
+        grid.append(item['id'], item['name'], item['created'], [contents.get((item['id'], detail_id), '') for detail_id in detail_ids])
+    return grid
+
+
+def get_tethered_items(alist, master_detail_ids):
+    '''The master items and the list's own items of a tethered list, in one query. Returns the master items like `get_master_list` does, and the list's items as a `grids.Grid`, both with their contents in the order of `master_detail_ids`. Snapshot lists have no master items: they're among the list's items.'''
+    db = get_db()
+    if use_list_grid(alist):
+        ensure_list_grid(db, alist)
+        items_sql = 'SELECT 1, item_id, name, created, NULL, cells FROM list_grids WHERE list_id = ?'
+    else:
+        items_sql = (
+            'SELECT 1, i.id, i.name, i.created, NULL,'
+            '  (SELECT json_group_object(c.master_detail_id, c.content) FROM untethered_content c WHERE c.list_id = l.list_id AND c.item_id = i.id)'
+            ' FROM list_item_relations l'
+            ' JOIN items i ON i.id = l.item_id'
+            ' WHERE l.list_id = ?'
+        )
+    cur = db.cursor()
+    cur.row_factory = None
+    if alist['snapshot']:
+        cur.execute(items_sql + ' ORDER BY 2', (alist['id'],))
+    else:
+        cur.execute(
+            'SELECT 0, i.id, i.name, i.created, u.username,'
+            '  (SELECT json_group_object(r.master_detail_id, r.master_content) FROM master_item_detail_relations r WHERE r.master_item_id = i.id)'
+            ' FROM master_list_item_relations m'
+            ' JOIN master_items i ON i.id = m.master_item_id'
+            ' JOIN users u ON u.id = i.creator_id'
+            ' WHERE m.master_list_id = ?'
+            ' UNION ALL '
+            + items_sql +
+            ' ORDER BY 1, 2',
+            (alist['master_list_id'], alist['id'])
+        )
+    keys = [str(master_detail_id) for master_detail_id in master_detail_ids]
+    master_items = []
+    items = Grid(master_detail_ids)
+    for own, item_id, name, created, username, cells in cur:
+        cells = json.loads(cells) if cells else {}
+        contents = [cells.get(key, '') for key in keys]
+        if own:
+            items.append(item_id, name, created, contents)
+        else:
+            master_items.append({'id': item_id, 'name': name, 'created': created, 'username': username, 'master_contents': contents})
+    return master_items, items
+
+
+def iter_list_items(alist, detail_ids):
+    '''Yields the list's items one at a time, as dicts with their `cells` in the order of `detail_ids`. The rows are read from a cursor as the caller consumes them, for streamed pages.'''
+    db = get_db() # taken when the first item is read, which for a streamed page is after the view's connection was closed.
+    if use_list_grid(alist):
+        for item_id, name, created, cells in iter_grid_rows(db, alist, detail_ids):
+            yield {'id': item_id, 'name': name, 'created': created, 'cells': cells}
+        return
+    cur = db.cursor()
+    cur.row_factory = None
+    if alist['tethered']:
+        cur.execute(
+            'SELECT i.id, i.name, i.created, u.master_detail_id, u.content'
+            ' FROM list_item_relations l'
+            ' JOIN items i ON i.id = l.item_id'
+            ' LEFT JOIN untethered_content u ON u.item_id = i.id AND u.list_id = l.list_id'
+            ' WHERE l.list_id = ?'
+            ' ORDER BY i.id',
+            (alist['id'],)
+        )
+    else:
+        cur.execute(
+            'SELECT i.id, i.name, i.created, r.detail_id, r.content'
+            ' FROM list_item_relations l'
+            ' JOIN items i ON i.id = l.item_id'
+            ' LEFT JOIN item_detail_relations r ON r.item_id = i.id'
+            ' WHERE l.list_id = ?'
+            ' ORDER BY i.id',
+            (alist['id'],)
+        )
+    for (item_id, name, created), rows in itertools.groupby(cur, key=lambda row: row[:3]):
+        contents = {detail_id: content for *_, detail_id, content in rows}
+        yield {'id': item_id, 'name': name, 'created': created, 'cells': [contents.get(detail_id, '') for detail_id in detail_ids]}
 
 
 def get_list_items(list_id, check_creator=True):
@@ -550,14 +710,17 @@ def get_list_item(list_id, item_id, check_relation=True):
         (item_id,)
     ).fetchone()
     if tethered:
-        details = db.execute(
-            'SELECT d.name, d.id, u.content'
-            ' FROM master_details d'
-            " LEFT JOIN untethered_content u"
-            " ON d.id = u.master_detail_id"
-            " WHERE u.item_id = ?"
-            " AND u.list_id = ?",
-            (item_id, list_id)
+        details = db.execute( # a snapshot copy's cells without their own content are shared with its master item.
+            'SELECT d.name, d.id, COALESCE(u.content, r.master_content) AS content'
+            ' FROM list_tethers t'
+            ' JOIN master_list_detail_relations m ON m.master_list_id = t.master_list_id'
+            ' JOIN master_details d ON d.id = m.master_detail_id'
+            ' LEFT JOIN untethered_content u ON u.list_id = t.list_id AND u.item_id = ? AND u.master_detail_id = d.id'
+            ' LEFT JOIN snapshot_items s ON s.item_id = ?'
+            ' LEFT JOIN master_item_detail_relations r ON r.master_item_id = s.master_item_id AND r.master_detail_id = d.id'
+            ' WHERE t.list_id = ?'
+            ' AND (u.id IS NOT NULL OR r.id IS NOT NULL)',
+            (item_id, item_id, list_id)
         ).fetchall()
     else:
         details = db.execute(
@@ -632,3 +795,20 @@ def get_detail_list_id(detail_id):
     if list_id:
         return list_id['list_id']
     abort(404)
+
+
+def get_list_validators(alist):
+    '''The (ETag, Last-Modified) of a list's pages. Tethered lists also show their master list's data.'''
+    etag = make_etag('list', alist['id'], alist['version'], alist['master_list_version'])
+    return etag, get_last_modified(alist['updated'], alist['master_list_updated'])
+
+
+def bump_list_version(list_id):
+    '''Marks the list as changed. Call it in every write to the list, its items or its details, before the commit. Caches keyed on the version then stop matching. A grid that was up to date stays so, because the write paths update it along with the list.'''
+    get_db().execute(
+        'UPDATE lists SET version = version + 1, updated = CURRENT_TIMESTAMP,'
+        ' grid_version = CASE WHEN grid_version = version THEN version + 1 END'
+        ' WHERE id = ?',
+        (list_id,)
+    )
+    discard_fragments('list', list_id)
@@ -5,6 +5,7 @@ from werkzeug.exceptions import abort
 
 from incontext.auth import login_required, admin_only
 from incontext.db import get_db
+from incontext.registry import get_agent_model, get_agent_models
 
 bp = Blueprint('master_agents', __name__, url_prefix='/master-agents')
 
@@ -16,11 +17,20 @@ def index():
     return render_template('master-agents/index.html', master_agents=master_agents)
 
 
+@bp.route('/usage')
+@login_required
+@admin_only
+def usage():
+    hours = request.args.get('hours', 24, type=int)
+    hot_agents = get_hot_agents(hours)
+    hot_users = get_hot_users(hours)
+    return render_template('master-agents/usage.html', hours=hours, hot_agents=hot_agents, hot_users=hot_users)
+
+
 @bp.route('/new', methods=('GET', 'POST'))
 @login_required
 @admin_only
 def new():
-    agent_models = get_agent_models()
     if request.method == 'POST':
         error = None
         name = request.form['name']
@@ -31,7 +41,7 @@ def new():
                 model_id = int(model_id)
             except:
                 model_id = None
-        model = next((agent_model for agent_model in agent_models if agent_model["id"] == model_id), None)
+        model = get_agent_model(model_id)
         role = request.form['role']
         instructions = request.form['instructions']
         if not name or not model or not role or not instructions:
@@ -47,7 +57,7 @@ def new():
             )
             db.commit()
             return redirect(url_for('master_agents.index'))
-    return render_template('master-agents/new.html', agent_models=agent_models)
+    return render_template('master-agents/new.html', agent_models=get_agent_models())
 
 
 @bp.route('/<int:master_agent_id>/view')
@@ -62,7 +72,6 @@ def view(master_agent_id):
 @admin_only
 def edit(master_agent_id):
     master_agent = get_master_agent(master_agent_id)
-    agent_models = get_agent_models()
     if request.method == "POST":
         error = None
         name = request.form['name']
@@ -73,7 +82,7 @@ def edit(master_agent_id):
                 model_id = int(model_id)
             except:
                 model_id = None
-        model = next((agent_model for agent_model in agent_models if agent_model["id"] == model_id), None)
+        model = get_agent_model(model_id)
         role = request.form["role"]
         instructions = request.form["instructions"]
         if not name or not model or not role or not instructions:
@@ -90,7 +99,7 @@ def edit(master_agent_id):
             )
             db.commit()
             return redirect(url_for('master_agents.index'))
-    return render_template("master-agents/edit.html", master_agent=master_agent, agent_models=agent_models)
+    return render_template("master-agents/edit.html", master_agent=master_agent, agent_models=get_agent_models())
 
 
 @bp.route("<int:master_agent_id>/delete", methods=("POST",))
@@ -135,10 +144,32 @@ def get_master_agent(master_agent_id, check_access=True):
     return master_agent
 
 
-def get_agent_models():
-    db = get_db()
-    agent_models = db.execute(
-        "SELECT id, provider_name, provider_code, model_name, model_code, model_description"
-        " FROM agent_models"
+def get_hot_agents(hours, limit=10):
+    '''The agents with the highest estimated cost over the last `hours` hours, read from the hourly rollup.'''
+    return get_db().execute(
+        "SELECT h.agent_id, a.name, u.username, SUM(h.runs) AS runs, SUM(h.input_tokens) AS input_tokens,"
+        " SUM(h.output_tokens) AS output_tokens, SUM(h.latency_ms) / SUM(h.runs) AS mean_latency_ms, SUM(h.cost) AS cost"
+        " FROM agent_usage_hourly h"
+        " LEFT JOIN agents a ON a.id = h.agent_id"
+        " LEFT JOIN users u ON u.id = a.creator_id"
+        " WHERE h.hour >= strftime('%Y-%m-%d %H:00:00', 'now', ?)"
+        " GROUP BY h.agent_id"
+        " ORDER BY cost DESC, runs DESC"
+        " LIMIT ?",
+        (f'-{hours} hours', limit)
+    ).fetchall()
+
+
+def get_hot_users(hours, limit=10):
+    '''The users with the highest estimated cost over the last `hours` hours, read from the hourly rollup.'''
+    return get_db().execute(
+        "SELECT h.user_id, u.username, SUM(h.runs) AS runs, SUM(h.input_tokens) AS input_tokens,"
+        " SUM(h.output_tokens) AS output_tokens, COUNT(DISTINCT h.agent_id) AS agents, SUM(h.cost) AS cost"
+        " FROM agent_usage_hourly h"
+        " LEFT JOIN users u ON u.id = h.user_id"
+        " WHERE h.hour >= strftime('%Y-%m-%d %H:00:00', 'now', ?)"
+        " GROUP BY h.user_id"
+        " ORDER BY cost DESC, runs DESC"
+        " LIMIT ?",
+        (f'-{hours} hours', limit)
     ).fetchall()
-    return agent_models
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import sqlite3
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from incontext.db import get_db
+from incontext.engine import get_loop
+from incontext.grids import add_grid_column, delete_grid_column
+from incontext.snapshots import copy_shared_cells, release_copies
+
+logger = logging.getLogger(__name__)
+
+# A log of the master list writes that tethered lists have to follow. The master views append a `master_changes` row in the same transaction as the write, instead of writing to every tethered list, and each tether records in `applied_seq` the last change it has applied. A tethered list catches up by applying the changes after its `applied_seq` in order, in batches that commit their progress, so a propagation that's cut short resumes where it stopped:
+# - after the master write, on the engine loop (`PROPAGATE_MASTER_CHANGES = 'async'`) or in the request ('sync'),
+# - with `catch_up`, by the views that show a list's contents, before a list that's behind is read. It's one transaction, and a read goes ahead without it if the database is locked,
+# - with `flask propagate-master-changes`.
+# Applying a change is idempotent, so a change applied twice by racing workers does no harm. Changes every tether has applied are pruned.
+KINDS = ('add_detail', 'delete_detail', 'edit_item', 'delete_item')
+
+
+def log_master_change(db, master_list_id, kind, master_item_id=None, master_detail_id=None, cells=None):
+    '''Appends a change to the log. Call it in the transaction of the write. `cells` are the old contents of the cells an item change overwrites or deletes, {master detail id: content}, for the snapshot lists that still share them.'''
+    assert kind in KINDS
+    db.execute(
+        'INSERT INTO master_changes (master_list_id, kind, master_item_id, master_detail_id, cells) VALUES (?, ?, ?, ?, ?)',
+        (master_list_id, kind, master_item_id, master_detail_id, json.dumps(cells) if cells is not None else None)
+    )
+
+
+def get_old_cells(db, master_item_id, new_contents=None):
+    '''The current contents of a master item's cells, before a write. With `new_contents`, {master detail id: content}, only the cells whose content changes.'''
+    cur = db.cursor()
+    cur.row_factory = None
+    cells = dict(cur.execute('SELECT master_detail_id, master_content FROM master_item_detail_relations WHERE master_item_id = ?', (master_item_id,)))
+    if new_contents is not None:
+        cells = {master_detail_id: content for master_detail_id, content in cells.items() if new_contents.get(master_detail_id, content) != content}
+    return cells
+
+
+def get_latest_seq(db, master_list_id):
+    cur = db.cursor()
+    cur.row_factory = None
+    return cur.execute('SELECT COALESCE(MAX(seq), 0) FROM master_changes WHERE master_list_id = ?', (master_list_id,)).fetchone()[0]
+
+
+def apply_change(db, tether, kind, master_item_id, master_detail_id, cells):
+    list_id = tether['list_id']
+    if kind == 'add_detail':
+        db.execute(
+            'INSERT INTO untethered_content (list_id, item_id, master_detail_id, content)'
+            " SELECT l.list_id, l.item_id, ?, ''"
+            ' FROM list_item_relations l'
+            ' WHERE l.list_id = ?'
+            '  AND NOT EXISTS (SELECT 1 FROM untethered_content u WHERE u.list_id = l.list_id AND u.item_id = l.item_id AND u.master_detail_id = ?)',
+            (master_detail_id, list_id, master_detail_id)
+        )
+        add_grid_column(db, list_id, master_detail_id)
+    elif kind == 'delete_detail':
+        db.execute('DELETE FROM untethered_content WHERE list_id = ? AND master_detail_id = ?', (list_id, master_detail_id))
+        delete_grid_column(db, list_id, master_detail_id)
+    elif not tether['snapshot']: # live tethers read the master items themselves.
+        return
+    elif kind == 'edit_item':
+        copy_shared_cells(db, list_id, master_item_id, json.loads(cells))
+    elif kind == 'delete_item':
+        release_copies(db, list_id, master_item_id, json.loads(cells))
+
+
+def apply_master_changes(db, tether, batch_size):
+    '''Applies the changes a tethered list hasn't applied yet, committing after each batch of `batch_size`, or once for all of them if `batch_size` is None. `tether` has the keys list_id, master_list_id, snapshot and applied_seq. Returns the number of changes applied.'''
+    cur = db.cursor()
+    cur.row_factory = None
+    applied_seq = tether['applied_seq']
+    applied = 0
+    while True:
+        changes = cur.execute(
+            'SELECT seq, kind, master_item_id, master_detail_id, cells FROM master_changes'
+            ' WHERE master_list_id = ? AND seq > ?'
+            ' ORDER BY seq LIMIT ?',
+            (tether['master_list_id'], applied_seq, batch_size or -1) # a negative LIMIT is no limit.
+        ).fetchall()
+        if not changes:
+            return applied
+        for seq, *change in changes:
+            apply_change(db, tether, *change)
+        applied_seq = changes[-1][0]
+        db.execute('UPDATE list_tethers SET applied_seq = ? WHERE list_id = ? AND applied_seq < ?', (applied_seq, tether['list_id'], applied_seq))
+        db.commit()
+        applied += len(changes)
+        if batch_size is None or len(changes) < batch_size:
+            return applied
+
+
+def catch_up(alist):
+    '''Applies the changes a tethered list is behind on, before its contents are read. `alist` is a row from `lists.get_list`. Returns whether the list is up to date. A failure doesn't fail the read: if the database stays locked, e.g. by a propagation on the engine loop, the list is read as it is and catches up later. Such a read must not be cached.'''
+    if alist['master_change_seq'] is None or alist['master_change_seq'] <= alist['applied_seq']:
+        return True
+    db = get_db()
+    tether = {'list_id': alist['id'], 'master_list_id': alist['master_list_id'], 'snapshot': alist['snapshot'], 'applied_seq': alist['applied_seq']}
+    try:
+        apply_master_changes(db, tether, None)
+    except sqlite3.OperationalError:
+        db.rollback()
+        logger.warning('List %s could not catch up on the changes of master list %s.', alist['id'], alist['master_list_id'], exc_info=True)
+        return False
+    alist['applied_seq'] = alist['master_change_seq']
+    return True
+
+
+def prune_master_changes(db, master_list_id):
+    '''Deletes the changes every tether of the master list has applied.'''
+    db.execute(
+        'DELETE FROM master_changes WHERE master_list_id = ?'
+        ' AND seq <= (SELECT COALESCE(MIN(applied_seq), (SELECT MAX(seq) FROM master_changes WHERE master_list_id = ?)) FROM list_tethers WHERE master_list_id = ?)',
+        (master_list_id, master_list_id, master_list_id)
+    )
+    db.commit()
+
+
+def propagate_master_changes(database, master_list_id, batch_size):
+    '''Brings every tether of a master list up to date, on a connection of its own. Returns the number of changes applied, summed over the tethers.'''
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    try:
+        latest_seq = get_latest_seq(db, master_list_id)
+        tethers = db.execute(
+            'SELECT list_id, master_list_id, snapshot, applied_seq FROM list_tethers'
+            ' WHERE master_list_id = ? AND applied_seq < ?',
+            (master_list_id, latest_seq)
+        ).fetchall()
+        applied = sum(apply_master_changes(db, tether, batch_size) for tether in tethers)
+        prune_master_changes(db, master_list_id)
+        return applied
+    except sqlite3.OperationalError: # e.g. the database stayed locked. the lists catch up when they're read.
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+
+def schedule_propagation(master_list_id):
+    '''Propagates a master list's changes as `PROPAGATE_MASTER_CHANGES` says. Call it after the commit of the write. Returns a `concurrent.futures.Future` with 'async', the number of changes applied with 'sync', and None if propagation is left to the reads.'''
+    mode = current_app.config['PROPAGATE_MASTER_CHANGES']
+    if mode is None:
+        return None
+    args = (current_app.config['DATABASE'], master_list_id, current_app.config['MASTER_CHANGES_BATCH_SIZE'])
+    if mode == 'sync':
+        return propagate_master_changes(*args)
+    return asyncio.run_coroutine_threadsafe(asyncio.to_thread(propagate_master_changes, *args), get_loop())
+
+
+@click.command('propagate-master-changes')
+@click.option('--batch-size', type=int, default=None, help='Changes applied per transaction. Defaults to MASTER_CHANGES_BATCH_SIZE.')
+@with_appcontext
+def propagate_master_changes_command(batch_size):
+    '''Apply the logged master list changes to every tethered list that is behind.'''
+    batch_size = batch_size or current_app.config['MASTER_CHANGES_BATCH_SIZE']
+    master_list_ids = [row[0] for row in get_db().execute('SELECT DISTINCT master_list_id FROM master_changes').fetchall()]
+    applied = sum(propagate_master_changes(current_app.config['DATABASE'], master_list_id, batch_size) for master_list_id in master_list_ids)
+    click.echo(f'Applied {applied} changes for {len(master_list_ids)} master lists.')
+
+
+def init_app(app):
+    app.cli.add_command(propagate_master_changes_command)
@@ -1,11 +1,18 @@
+import itertools
+
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, flash, g, redirect, render_template, request, url_for, make_response, Response
 )
 from werkzeug.exceptions import abort
 
 from incontext.auth import login_required, admin_only
+from incontext.conditional import get_last_modified, make_etag, not_modified, set_validators
+from incontext.context import get_master_list_context
 from incontext.db import get_db
 from incontext.db import dict_factory
+from incontext.fragments import discard_fragments, get_fragment
+from incontext.master_changes import get_old_cells, log_master_change, schedule_propagation
+from incontext.streaming import RowStream, should_stream, stream_page
 
 
 bp = Blueprint('master_lists', __name__, url_prefix='/master-lists')
@@ -46,8 +53,38 @@ def new():
 @bp.route('/<int:master_list_id>/view')
 @login_required
 def view(master_list_id):
-    master_list = get_master_list(master_list_id, False)
-    return render_template('master-lists/view.html', master_list=master_list)
+    master_list = get_master_list_summary(master_list_id)
+    etag = make_etag('master_list', master_list_id, master_list['version'])
+    last_modified = get_last_modified(master_list['updated'])
+    response = not_modified(etag, last_modified) # answered before the item queries and the rendering.
+    if response is not None:
+        return response
+    count = count_master_items(master_list_id)
+    if should_stream(count):
+        master_list = get_master_list_stream(master_list, count)
+        return set_validators(stream_page('master-lists/view.html', master_list=master_list), etag, last_modified)
+    def render():
+        return render_template('master-lists/view_main.html', master_list=get_master_list(master_list_id, False))
+    main = get_fragment('master_list', master_list_id, (master_list['version'],), render) # only runs the item queries when the master list changed since it was last rendered.
+    page = render_template('master-lists/view.html', master_list=master_list, main=main)
+    return set_validators(make_response(page), etag, last_modified)
+
+
+@bp.route('/<int:master_list_id>/export')
+@login_required
+def export(master_list_id):
+    master_list = get_master_list_summary(master_list_id)
+    etag = make_etag('master_list', master_list_id, master_list['version'])
+    last_modified = get_last_modified(master_list['updated'])
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    columns = request.args.getlist('column', type=int) or None
+    budget = request.args.get('budget', type=int)
+    context = get_master_list_context(master_list_id, columns, budget)
+    if context is None:
+        abort(404)
+    return set_validators(Response(context, mimetype='text/plain'), etag, last_modified)
 
 
 @bp.route('/<int:master_list_id>/edit', methods=('GET', 'POST'))
@@ -70,6 +107,7 @@ def edit(master_list_id):
                 ' WHERE id = ?',
                 (name, description, master_list_id)
             )
+            bump_master_list_version(master_list_id)
             db.commit()
             return redirect(url_for('master_lists.index'))
     return render_template("master-lists/edit.html", master_list=master_list)
@@ -106,6 +144,8 @@ def delete(master_list_id):
     db.execute('DELETE FROM master_list_item_relations WHERE master_list_id = ?',(master_list_id,))
     # Delete master-detail relations
     db.execute('DELETE FROM master_list_detail_relations WHERE master_list_id = ?', (master_list_id,))
+    # Delete the change log
+    db.execute('DELETE FROM master_changes WHERE master_list_id = ?', (master_list_id,))
     # Delete master
     db.execute('DELETE FROM master_lists WHERE id = ?', (master_list_id,))
     db.commit()
@@ -152,6 +192,7 @@ def new_master_item(master_list_id):
                 ' VALUES(?, ?, ?)',
                 master_i_d_relations
             )
+            bump_master_list_version(master_list_id)
             db.commit()
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
     return render_template("master-lists/master-items/new.html", master_list=master_list)
@@ -198,6 +239,7 @@ def edit_master_item(master_list_id, master_item_id):
                 ' WHERE id = ?',
                 (name, master_item_id)
             )
+            old_cells = get_old_cells(db, master_item_id, {master_detail_id: content for content, _, master_detail_id in master_i_d_relations})
             db.executemany(
                 'UPDATE master_item_detail_relations'
                 ' SET master_content = ?'
@@ -205,7 +247,11 @@ def edit_master_item(master_list_id, master_item_id):
                 ' AND master_detail_id = ?',
                 master_i_d_relations
             )
+            if old_cells:
+                log_master_change(db, master_list_id, 'edit_item', master_item_id=master_item_id, cells=old_cells)
+            bump_master_list_version(master_list_id)
             db.commit()
+            schedule_propagation(master_list_id)
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
     return render_template("master-lists/master-items/edit.html", master_list=master_list, master_item=requested_master_item)
 
@@ -220,6 +266,7 @@ def delete_master_item(master_list_id, master_item_id):
         abort(404)
     master_details = master_list["master_details"]
     db = get_db()
+    log_master_change(db, master_list_id, 'delete_item', master_item_id=master_item_id, cells=get_old_cells(db, master_item_id))
     db.execute('DELETE FROM master_items WHERE id = ?', (master_item_id,))
     db.execute('DELETE FROM master_item_detail_relations WHERE master_item_id = ?', (master_item_id,))
     db.execute(
@@ -227,7 +274,9 @@ def delete_master_item(master_list_id, master_item_id):
         ' WHERE master_list_id = ? AND master_item_id = ?',
         (master_list_id, master_item_id)
     )
+    bump_master_list_version(master_list_id)
     db.commit()
+    schedule_propagation(master_list_id)
     return redirect(url_for('master_lists.view', master_list_id=master_list_id))
 
 
@@ -265,29 +314,11 @@ def new_master_detail(master_list_id):
                 'VALUES (?, ?, ?)',
                 data
             )
-            tethered_lists = cur.execute(
-                "SELECT lir.item_id, lir.list_id"
-                " FROM list_item_relations lir"
-                " RIGHT JOIN list_tethers lt"
-                " ON lt.list_id = lir.list_id"
-                " WHERE lt.master_list_id = ?",
-                (master_list_id,)
-            ).fetchall()
-            entries = []
-            for tethered_list in tethered_lists:
-                entries.append([
-                    tethered_list["list_id"],
-                    tethered_list["item_id"],
-                    master_detail_id,
-                    ""
-                ])
-            if entries:
-                cur.executemany(
-                    "INSERT INTO untethered_content (list_id, item_id, master_detail_id, content)"
-                    " VALUES (?, ?, ?, ?)",
-                    entries
-                )
+            # The tethered lists get empty untethered content for the new detail from the change log
+            log_master_change(db, master_list_id, 'add_detail', master_detail_id=master_detail_id)
+            bump_master_list_version(master_list_id)
             db.commit()
+            schedule_propagation(master_list_id)
             return redirect(url_for('master_lists.view', master_list_id=master_list["id"]))
     return render_template("master-lists/master-details/new.html", master_list=master_list)
 
@@ -315,6 +346,7 @@ def edit_master_detail(master_list_id, master_detail_id):
                 ' WHERE id = ?',
                 (name, description, master_detail_id)
             )
+            bump_master_list_version(master_list_id)
             db.commit()
             return redirect(url_for('master_lists.view', master_list_id=master_list_id))
     return render_template("master-lists/master-details/edit.html", master_list=master_list, master_detail=requested_master_detail)
@@ -332,7 +364,10 @@ def delete_master_detail(master_list_id, master_detail_id):
     db.execute('DELETE FROM master_details WHERE id = ?', (master_detail_id,))
     db.execute('DELETE FROM master_item_detail_relations WHERE master_detail_id = ?', (master_detail_id,))
     db.execute('DELETE FROM master_list_detail_relations WHERE master_detail_id = ?', (master_detail_id,))
+    log_master_change(db, master_list_id, 'delete_detail', master_detail_id=master_detail_id)
+    bump_master_list_version(master_list_id)
     db.commit()
+    schedule_propagation(master_list_id)
     return redirect(url_for('master_lists.view', master_list_id=master_list_id))
 
 
@@ -347,11 +382,12 @@ def get_master_lists():
     return master_lists
 
 
-def get_master_list(master_list_id, check_access=True):
+def get_master_list_summary(master_list_id):
+    '''The master list's own fields, without its items and details.'''
     db = get_db()
     db.row_factory = dict_factory
     master_list = db.execute(
-        "SELECT m.id, m.creator_id, m.created, m.name, m.description, u.username"
+        "SELECT m.id, m.creator_id, m.created, m.name, m.description, m.version, m.updated, u.username"
         " FROM master_lists m"
         " JOIN users u"
         " ON u.id = m.creator_id"
@@ -360,6 +396,12 @@ def get_master_list(master_list_id, check_access=True):
     ).fetchone()
     if master_list is None:
         abort(404)
+    return master_list
+
+
+def get_master_list(master_list_id, check_access=True):
+    db = get_db()
+    master_list = get_master_list_summary(master_list_id)
     if check_access:
         if not g.user["admin"]:
             abort(403)
@@ -384,15 +426,7 @@ def get_master_list(master_list_id, check_access=True):
         new_master_item['master_contents'] = []
         master_item_id = str(master_item['id'])
         master_list_ext['master_items'].append(new_master_item)
-    master_details = db.execute(
-        'SELECT d.id, d.name, d.description'
-        ' FROM master_details d'
-        ' JOIN master_list_detail_relations m'
-        ' ON m.master_detail_id = d.id'
-        ' WHERE m.master_list_id = ?',
-        (master_list_id,)
-    ).fetchall()
-    master_list_ext['master_details'] = master_details
+    master_list_ext['master_details'] = get_master_list_details(master_list_id)
     master_contents = db.execute(
         'SELECT master_item_id, master_content'
         ' FROM master_item_detail_relations'
@@ -407,3 +441,60 @@ def get_master_list(master_list_id, check_access=True):
         master_item = next((master_item for master_item in master_list_ext["master_items"] if master_item["id"] == master_item_id), None)
         master_item['master_contents'].append(master_content['master_content'])
     return master_list_ext
+
+
+def get_master_list_details(master_list_id):
+    db = get_db()
+    master_details = db.execute(
+        'SELECT d.id, d.name, d.description'
+        ' FROM master_details d'
+        ' JOIN master_list_detail_relations m'
+        ' ON m.master_detail_id = d.id'
+        ' WHERE m.master_list_id = ?',
+        (master_list_id,)
+    ).fetchall()
+    return master_details
+
+
+def count_master_items(master_list_id):
+    cur = get_db().cursor()
+    cur.row_factory = None
+    return cur.execute('SELECT COUNT(*) FROM master_list_item_relations WHERE master_list_id = ?', (master_list_id,)).fetchone()[0]
+
+
+def iter_master_items(master_list_id, master_detail_ids):
+    '''Yields the items of a master list one at a time, like the `master_items` of `get_master_list`, with the `master_contents` in the order of `master_detail_ids`. The rows are read from the cursor as the caller consumes them.'''
+    cur = get_db().cursor() # taken when the first item is read, which for a streamed page is after the view's connection was closed.
+    cur.row_factory = None
+    cur.execute(
+        'SELECT i.id, i.name, i.created, u.username, r.master_detail_id, r.master_content'
+        ' FROM master_list_item_relations m'
+        ' JOIN master_items i ON i.id = m.master_item_id'
+        ' JOIN users u ON u.id = i.creator_id'
+        ' LEFT JOIN master_item_detail_relations r ON r.master_item_id = i.id'
+        ' WHERE m.master_list_id = ?'
+        ' ORDER BY i.id',
+        (master_list_id,)
+    )
+    for (master_item_id, name, created, username), rows in itertools.groupby(cur, key=lambda row: row[:4]):
+        contents = {master_detail_id: content for *_, master_detail_id, content in rows}
+        yield {
+            'id': master_item_id,
+            'name': name,
+            'created': created,
+            'username': username,
+            'master_contents': [contents.get(master_detail_id, '') for master_detail_id in master_detail_ids],
+        }
+
+
+def get_master_list_stream(master_list, count):
+    '''Like `get_master_list`, but the master items are read while the page is streamed. `master_list` is a row from `get_master_list_summary`.'''
+    master_details = get_master_list_details(master_list['id'])
+    master_items = iter_master_items(master_list['id'], [master_detail['id'] for master_detail in master_details])
+    return dict(master_list, master_details=master_details, master_items=RowStream(master_items, count))
+
+
+def bump_master_list_version(master_list_id):
+    '''Marks the master list as changed. Call it in every write to the master list, its items or its details, before the commit. Tethered lists show master data, so this also invalidates their cached views.'''
+    get_db().execute('UPDATE master_lists SET version = version + 1, updated = CURRENT_TIMESTAMP WHERE id = ?', (master_list_id,))
+    discard_fragments('master_list', master_list_id) # fragments of tethered lists have the master version in their key and age out.
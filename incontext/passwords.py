@@ -0,0 +1,54 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing is deliberately slow and CPU bound. It runs in a bounded pool of processes, so a burst of logins can use at most `PASSWORD_HASH_WORKERS` cores and the request threads only wait on it without holding the GIL.
+_pool = None
+_pool_key = None # (pid, workers) the pool was made for.
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    '''Returns this process's hashing pool, or None if `PASSWORD_HASH_WORKERS` is 0 and hashing runs inline.'''
+    global _pool, _pool_key
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    if not workers:
+        return None
+    key = (os.getpid(), workers)
+    with _pool_lock:
+        if _pool_key != key:
+            if _pool is not None and _pool_key[0] == key[0]: # a pool inherited through a fork has no workers in this process, so there's nothing to shut down.
+                _pool.shutdown(wait=False) # hashes already submitted still finish.
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'), # a fork of a process with running threads could deadlock.
+            )
+            _pool_key = key
+    return _pool
+
+
+def hash_password(password):
+    '''Hashes a password with the configured `PASSWORD_HASH_METHOD`.'''
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    pool = get_pool()
+    if pool is None:
+        return generate_password_hash(password, method)
+    return pool.submit(generate_password_hash, password, method).result()
+
+
+def verify_password(pwhash, password):
+    '''Checks a password against a stored hash, whatever method the hash was made with.'''
+    pool = get_pool()
+    if pool is None:
+        return check_password_hash(pwhash, password)
+    return pool.submit(check_password_hash, pwhash, password).result()
+
+
+def needs_rehash(pwhash):
+    '''True if the hash wasn't made with the configured method and cost parameters, e.g. after they were raised.'''
+    return pwhash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
+
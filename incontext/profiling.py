@@ -0,0 +1,145 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import time
+
+from flask import (
+    Blueprint, current_app, g, render_template, request, send_from_directory
+)
+from werkzeug.exceptions import abort
+
+from incontext.auth import admin_only, login_required
+
+# Per-request profiling for finding out why a request was slow. With `PROFILE_REQUESTS` on, a request is profiled with cProfile if an admin asks for it with an `X-Profile: 1` header or a `_profile=1` query arg, or if it's picked by sampling 1 in `PROFILE_SAMPLE_RATE` requests. Each capture is saved as a pstats file in `PROFILE_DIR`, named `<started ms>-<pid>-<endpoint>-<duration us>.pstats`, so listing them needs no database. Open one with `python -m pstats`, snakeviz, or flameprof for a flamegraph.
+# The blueprint is registered after `auth`, so its `before_app_request` function runs after `load_logged_in_user` and can check `g.user`. Flask runs `after_request` functions in reverse order of registration, so `save_profile` is put first in the app's list, to run last: the profile covers the view and every other `after_request` function (compression included), but not the saving of the session or the streaming of a response body.
+bp = Blueprint('profiling', __name__, url_prefix='/profiles')
+SUFFIX = '.pstats'
+
+
+def get_profile_dir():
+    return current_app.config['PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles')
+
+
+def is_requested():
+    '''Whether an admin asked for this request to be profiled.'''
+    flag = request.headers.get('X-Profile') or request.args.get('_profile')
+    return flag == '1' and g.user is not None and bool(g.user['admin'])
+
+
+def is_sampled():
+    rate = current_app.config['PROFILE_SAMPLE_RATE']
+    return bool(rate) and random.randrange(rate) == 0
+
+
+@bp.before_app_request
+def start_profile():
+    if not current_app.config['PROFILE_REQUESTS'] or request.blueprint == 'profiling':
+        return
+    if not (is_requested() or is_sampled()):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError: # another profiler is already active in this thread.
+        return
+    g.profiler = profiler
+    g.profile_started = time.time()
+
+
+@bp.record_once
+def register_save_profile(state):
+    state.app.after_request_funcs.setdefault(None, []).insert(0, save_profile) # runs after the `after_request` functions registered before it too.
+
+
+def save_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = time.time() - g.profile_started
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f'{int(g.profile_started * 1000):013d}-{os.getpid()}-{request.endpoint or "none"}-{int(duration * 1000000)}{SUFFIX}'
+    profiler.dump_stats(os.path.join(profile_dir, name))
+    prune_profiles(profile_dir, current_app.config['PROFILE_KEEP'])
+    return response
+
+
+@bp.teardown_app_request
+def stop_profile(exception=None): # the request failed before `save_profile` ran.
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def parse_name(name):
+    '''Returns the capture described by a profile's file name, or None if it isn't one.'''
+    if not name.endswith(SUFFIX):
+        return None
+    try:
+        started, pid, rest = name[:-len(SUFFIX)].split('-', 2)
+        endpoint, duration = rest.rsplit('-', 1)
+        return {
+            'name': name,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(started) / 1000)),
+            'pid': int(pid),
+            'endpoint': endpoint,
+            'duration_ms': int(duration) / 1000,
+        }
+    except ValueError:
+        return None
+
+
+def list_profiles(profile_dir):
+    '''The captures in `profile_dir`, newest first.'''
+    try:
+        names = os.listdir(profile_dir)
+    except FileNotFoundError:
+        return []
+    profiles = [profile for profile in map(parse_name, names) if profile is not None]
+    profiles.sort(key=lambda profile: profile['name'], reverse=True) # names start with the zero padded time.
+    return profiles
+
+
+def prune_profiles(profile_dir, keep):
+    '''Deletes all but the newest `keep` captures.'''
+    for profile in list_profiles(profile_dir)[keep:]:
+        try:
+            os.remove(os.path.join(profile_dir, profile['name']))
+        except FileNotFoundError: # another worker pruned it first.
+            pass
+
+
+@bp.route('/')
+@login_required
+@admin_only
+def index():
+    return render_template('profiling/index.html', profiles=list_profiles(get_profile_dir()))
+
+
+@bp.route('/<name>')
+@login_required
+@admin_only
+def view(name):
+    profile = parse_name(name)
+    path = os.path.join(get_profile_dir(), name)
+    if profile is None or not os.path.isfile(path):
+        abort(404)
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        sort = 'cumulative'
+    stream = io.StringIO()
+    stats = pstats.Stats(path, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(request.args.get('limit', 40, type=int))
+    return render_template('profiling/view.html', profile=profile, sort=sort, stats=stream.getvalue())
+
+
+@bp.route('/<name>/download')
+@login_required
+@admin_only
+def download(name):
+    if parse_name(name) is None:
+        abort(404)
+    return send_from_directory(get_profile_dir(), name, as_attachment=True)
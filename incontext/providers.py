@@ -0,0 +1,34 @@
+import asyncio
+
+from flask import current_app
+
+
+async def stub_complete(run, settings):
+    '''A local provider that needs no network access. It waits `AGENT_STUB_LATENCY` seconds to stand in for the provider round trip and then answers with a short, deterministic reply.'''
+    await asyncio.sleep(settings['AGENT_STUB_LATENCY']) # yields to the event loop, just like a real HTTP call to a provider would.
+    reply = f"[{run['model_code']}] Received {len(run['prompt'])} characters"
+    if run['context']:
+        reply += f" and {len(run['context'].splitlines())} lines of context"
+    return reply + '.'
+
+
+PROVIDERS = { # maps `agent_models.provider_code` to the coroutine function that calls that provider.
+    'stub': stub_complete,
+}
+
+
+def get_provider(provider_code):
+    '''Returns the completion coroutine function for a provider code, or the configured fallback provider if there is no client for it.'''
+    provider = PROVIDERS.get(provider_code)
+    if provider is None:
+        provider = PROVIDERS.get(current_app.config['AGENT_PROVIDER_FALLBACK'])
+    if provider is None:
+        raise LookupError(f'No provider is available for {provider_code}.')
+    return provider
+
+
+def get_provider_settings():
+    '''Copies the config values the providers need, because runs can finish after the app context is gone.'''
+    return {
+        'AGENT_STUB_LATENCY': current_app.config['AGENT_STUB_LATENCY'],
+    }
@@ -0,0 +1,234 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app, has_request_context, request
+from flask.cli import with_appcontext
+
+# A slow query log for sqlite. With `SLOW_QUERY_MS` set, `get_db` opens its connections as `TimedConnection`s, whose cursors time each statement from `execute` until its rows are fetched, because sqlite does most of a query's work while the rows are stepped through. A statement slower than the threshold is buffered per process under its shape: the sql with literals replaced by `?`, hashed. Parameters are never kept, only their types. `close_db` flushes the buffer into `slow_queries`, with the `EXPLAIN QUERY PLAN` of each shape the first time this process sees it, and `flask slow-queries` summarises the table.
+_pending = {} # maps (database, shape) to the aggregate of the slow statements not yet flushed.
+_explained = set() # (database, shape) pairs whose plan this process has written.
+_pending_lock = threading.Lock()
+
+
+def normalise(sql):
+    '''The shape of a statement: string and number literals become `?`, whitespace is collapsed, and lists of placeholders of any length are one shape.'''
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+
+
+def redact(parameters):
+    '''Describes parameters by their types only, e.g. `(int, str)`.'''
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
+def blank_parameters(parameters):
+    '''Parameters of the same shape, for explaining a statement without its values.'''
+    if isinstance(parameters, dict):
+        return dict.fromkeys(parameters)
+    return (None,) * len(parameters)
+
+
+def record_slow_query(database, sql, parameters, seconds):
+    shape_sql = normalise(sql)
+    shape = hashlib.blake2b(shape_sql.encode(), digest_size=8).hexdigest()
+    endpoint = request.endpoint if has_request_context() else None
+    ms = seconds * 1000
+    with _pending_lock:
+        entry = _pending.get((database, shape))
+        if entry is None:
+            _pending[(database, shape)] = {
+                'sql': sql, # the original, only for `EXPLAIN QUERY PLAN`. it's not stored.
+                'statement': shape_sql,
+                'parameters': redact(parameters),
+                'blank_parameters': blank_parameters(parameters),
+                'endpoint': endpoint,
+                'count': 1,
+                'total_ms': ms,
+                'max_ms': ms,
+            }
+        else:
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['endpoint'] = endpoint or entry['endpoint']
+
+
+def explain(db, sql, parameters):
+    '''The `EXPLAIN QUERY PLAN` of a statement as indented lines, or None if it can't be explained.'''
+    try:
+        rows = db.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except sqlite3.Error:
+        return None
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append('  ' * depths[node_id] + detail)
+    return '\n'.join(lines)
+
+
+def flush_slow_queries(database):
+    '''Writes this process's buffered slow statements for a database into `slow_queries`. Returns the number of shapes written.'''
+    with _pending_lock:
+        entries = {shape: entry for (path, shape), entry in _pending.items() if path == database}
+        for shape in entries:
+            del _pending[(database, shape)]
+    if not entries:
+        return 0
+    db = sqlite3.connect(database)
+    try:
+        rows = []
+        for shape, entry in entries.items():
+            plan = None
+            if (database, shape) not in _explained:
+                plan = explain(db, entry['sql'], entry['blank_parameters'])
+                _explained.add((database, shape))
+            rows.append((shape, entry['statement'], entry['parameters'], plan, entry['endpoint'], entry['count'], entry['total_ms'], entry['max_ms']))
+        db.executemany(
+            'INSERT INTO slow_queries (shape, statement, parameters, plan, endpoint, count, total_ms, max_ms)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (shape) DO UPDATE SET'
+            '  parameters = excluded.parameters,'
+            '  plan = COALESCE(excluded.plan, plan),'
+            '  endpoint = COALESCE(excluded.endpoint, endpoint),'
+            '  count = count + excluded.count,'
+            '  total_ms = total_ms + excluded.total_ms,'
+            '  max_ms = MAX(max_ms, excluded.max_ms),'
+            '  last_seen = CURRENT_TIMESTAMP',
+            rows
+        )
+        db.commit()
+    except sqlite3.OperationalError: # no `slow_queries` table yet, or the database stayed locked. the log is best effort.
+        return 0
+    finally:
+        db.close()
+    return len(rows)
+
+
+class TimedCursor(sqlite3.Cursor):
+    '''A cursor that times its current statement across `execute` and the fetches, and records it when it's done: when its rows run out, the cursor executes something else, or it's closed or dropped.'''
+    _sql = None
+    _parameters = ()
+    _elapsed = 0.0
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is not None and self._elapsed * 1000 >= self.connection.slow_query_ms:
+            record_slow_query(self.connection.database, sql, self._parameters, self._elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._parameters, self._elapsed = sql, parameters, 0.0
+        return self._timed(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        seq_of_parameters = list(seq_of_parameters)
+        self._sql, self._parameters, self._elapsed = sql, seq_of_parameters[0] if seq_of_parameters else (), 0.0
+        self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+        self._finish() # `executemany` can't return rows.
+        return self
+
+    def fetchone(self):
+        row = self._timed(sqlite3.Cursor.fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(sqlite3.Cursor.fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(sqlite3.Cursor.fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(sqlite3.Cursor.__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self): # e.g. `db.execute(...).fetchone()` leaves the rest of the rows unfetched.
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    '''A connection whose statements are timed by `TimedCursor`. `database` and `slow_query_ms` are set by `get_db`.'''
+    database = None
+    slow_query_ms = 0
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()): # `sqlite3.Connection.execute` wouldn't call the cursor's `execute`.
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+@click.command('slow-queries')
+@click.option('--limit', default=10, show_default=True, help='Statement shapes to show.')
+@click.option('--sort', type=click.Choice(['total', 'max', 'count']), default='total', show_default=True)
+@click.option('--plans/--no-plans', default=True, show_default=True, help='Show the query plan of each statement.')
+@click.option('--reset', is_flag=True, help='Empty the log after showing it.')
+@with_appcontext
+def slow_queries_command(limit, sort, plans, reset):
+    '''Summarise the slowest statement shapes.'''
+    from incontext.db import get_db
+    database = current_app.config['DATABASE']
+    flush_slow_queries(database)
+    db = get_db()
+    order = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count'}[sort]
+    rows = db.execute(
+        'SELECT statement, parameters, plan, endpoint, count, total_ms, max_ms, last_seen FROM slow_queries'
+        f' ORDER BY {order} DESC LIMIT ?',
+        (limit,)
+    ).fetchall()
+    if not rows:
+        click.echo('No slow queries.')
+    for row in rows:
+        click.echo(f'{row["total_ms"]:.1f} ms total, {row["count"]} times, {row["total_ms"] / row["count"]:.1f} ms mean, {row["max_ms"]:.1f} ms max. last seen {row["last_seen"]} in {row["endpoint"] or "(no request)"}')
+        click.echo(f'  {row["statement"]}')
+        click.echo(f'  parameters: {row["parameters"]}')
+        if plans and row['plan']:
+            for line in row['plan'].splitlines():
+                click.echo(f'    {line}')
+        click.echo()
+    if reset:
+        db.execute('DELETE FROM slow_queries')
+        db.commit()
+        with _pending_lock:
+            _explained.difference_update({key for key in _explained if key[0] == database})
+
+
+def init_app(app):
+    app.cli.add_command(slow_queries_command)
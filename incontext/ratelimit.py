@@ -0,0 +1,96 @@
+import time
+
+# Token buckets live in the `rate_limit_buckets` table, so every worker process reads and updates the same state. A bucket holds up to `burst` tokens and refills at `rate` tokens per second. A rate of 0 or less never refills: the bucket allows `burst` requests and then refuses, e.g. (0, 0) refuses everything.
+NO_REFILL_RETRY_AFTER = 3600 # the seconds to wait reported by an empty bucket that never refills.
+
+
+def take_tokens(db, limits, now=None):
+    '''Takes one token from every bucket in `limits`, a list of (key, rate, burst) tuples, or from none of them.
+
+    Returns 0 if the tokens were taken, otherwise the number of seconds until all buckets have a token again. The check and the update run in one `BEGIN IMMEDIATE` transaction, so concurrent workers cannot both take the last token. The connection must not be in a transaction already.'''
+    if not limits:
+        return 0
+    if now is None:
+        now = time.time() # wall clock time, because it's compared across processes.
+    db.execute('BEGIN IMMEDIATE') # takes the write lock up front. other workers wait here (up to the connection timeout).
+    try:
+        buckets = []
+        retry_after = 0
+        for key, rate, burst in limits:
+            bucket = db.execute(
+                'SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket['tokens'] + (now - bucket['updated']) * max(rate, 0))
+            if tokens < 1:
+                retry_after = max(retry_after, (1 - tokens) / rate if rate > 0 else NO_REFILL_RETRY_AFTER)
+            buckets.append((key, tokens - 1, now))
+        if retry_after:
+            db.rollback()
+            return retry_after
+        db.executemany(
+            'INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)'
+            ' ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+            buckets
+        )
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return 0
+
+
+def per_minute(key, limit):
+    '''Builds a (key, rate, burst) bucket from a config value of (requests per minute, burst), or returns None when `limit` is None.'''
+    if limit is None:
+        return None
+    requests_per_minute, burst = limit
+    return (key, requests_per_minute / 60, burst)
+
+
+# Sliding window counters live in the `rate_limit_windows` table, one row per key and fixed window. The count over the last `window` seconds is estimated from the current window plus the overlapping share of the previous one.
+
+
+def count_hits(db, key, window, now=None):
+    '''Returns the estimated number of hits on `key` in the last `window` seconds.'''
+    if now is None:
+        now = time.time()
+    start = int(now // window * window)
+    cur = db.cursor()
+    cur.row_factory = None
+    counts = dict(cur.execute(
+        'SELECT window_start, count FROM rate_limit_windows'
+        ' WHERE key = ? AND window_start >= ?',
+        (key, start - window)
+    ).fetchall())
+    overlap = 1 - (now - start) / window # the share of the previous window that's still inside the sliding window.
+    return counts.get(start, 0) + counts.get(start - window, 0) * overlap
+
+
+def record_hit(db, key, window, now=None):
+    '''Counts one hit on `key`, and drops windows of that key that are too old to matter. Commit afterwards.'''
+    if now is None:
+        now = time.time()
+    start = int(now // window * window)
+    db.execute(
+        'INSERT INTO rate_limit_windows (key, window_start, count) VALUES (?, ?, 1)'
+        ' ON CONFLICT (key, window_start) DO UPDATE SET count = count + 1',
+        (key, start)
+    )
+    db.execute(
+        'DELETE FROM rate_limit_windows WHERE key = ? AND window_start < ?',
+        (key, start - window)
+    )
+
+
+def sweep_windows(db, max_window, now=None):
+    '''Drops the windows of every key that are too old to matter for a window of up to `max_window` seconds. `record_hit` only drops its own key's, so keys that are never hit again, e.g. the usernames of a credential stuffing run, need this. Commit afterwards. Returns the number of windows dropped.'''
+    if now is None:
+        now = time.time()
+    return db.execute(
+        'DELETE FROM rate_limit_windows WHERE window_start < ?',
+        (int(now // max_window * max_window) - max_window,)
+    ).rowcount
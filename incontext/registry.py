@@ -0,0 +1,69 @@
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from incontext.db import bump_cache_version, get_cache_version, get_db
+
+# The `agent_models` table is seeded once from the `AGENT_MODELS` config and almost never changes, so each worker keeps it in memory. A worker checks the `agent_models` row of `cache_versions` at most every `CACHE_VERSION_TTL` seconds and reloads when the version has moved.
+_registries = {} # maps a database path to its loaded registry.
+_lock = threading.Lock()
+
+
+def get_registry():
+    database = current_app.config['DATABASE']
+    version = get_cache_version('agent_models', current_app.config['CACHE_VERSION_TTL'])
+    registry = _registries.get(database)
+    if registry is None or registry['version'] != version:
+        with _lock:
+            registry = load_registry(get_db(), version)
+            _registries[database] = registry
+    return registry
+
+
+def load_registry(db, version):
+    cur = db.cursor()
+    cur.row_factory = None
+    rows = cur.execute(
+        'SELECT id, provider_name, provider_code, model_name, model_code, model_description'
+        ' FROM agent_models'
+        ' ORDER BY id'
+    ).fetchall()
+    fields = ('id', 'provider_name', 'provider_code', 'model_name', 'model_code', 'model_description')
+    models = [dict(zip(fields, row)) for row in rows]
+    return {
+        'version': version,
+        'models': models,
+        'by_id': {model['id']: model for model in models},
+        'by_code': {model['model_code']: model for model in models},
+    }
+
+
+def get_agent_models():
+    '''All agent models, in id order. The dicts are shared, so don't modify them.'''
+    return get_registry()['models']
+
+
+def get_agent_model(model_id):
+    '''The agent model with this id, or None.'''
+    return get_registry()['by_id'].get(model_id)
+
+
+def get_agent_model_by_code(model_code):
+    '''The agent model with this `model_code`, or None.'''
+    return get_registry()['by_code'].get(model_code)
+
+
+@click.command('reload-models')
+@with_appcontext
+def reload_models_command():
+    '''Make all workers reload the agent model registry.'''
+    db = get_db()
+    bump_cache_version(db, 'agent_models')
+    db.commit()
+    click.echo('Agent models will be reloaded.')
+
+
+def init_app(app):
+    app.cli.add_command(reload_models_command)
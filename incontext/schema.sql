@@ -12,11 +12,21 @@ DROP TABLE IF EXISTS lists;
 DROP TABLE IF EXISTS list_item_relations;
 DROP TABLE IF EXISTS list_detail_relations;
 DROP TABLE IF EXISTS list_tethers;
+DROP TABLE IF EXISTS list_grids;
+DROP TABLE IF EXISTS snapshot_items;
+DROP TABLE IF EXISTS master_changes;
 DROP TABLE IF EXISTS untethered_content;
 DROP TABLE IF EXISTS master_agents;
 DROP TABLE IF EXISTS agents;
 DROP TABLE IF EXISTS agent_models;
 DROP TABLE IF EXISTS tethered_agents;
+DROP TABLE IF EXISTS agent_runs;
+DROP TABLE IF EXISTS agent_usage_ledger;
+DROP TABLE IF EXISTS agent_usage_hourly;
+DROP TABLE IF EXISTS rate_limit_buckets;
+DROP TABLE IF EXISTS rate_limit_windows;
+DROP TABLE IF EXISTS sessions;
+DROP TABLE IF EXISTS slow_queries;
 
 
 CREATE TABLE users (
@@ -33,6 +43,8 @@ CREATE TABLE master_lists (
 	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
 	name TEXT NOT NULL,
 	description TEXT,
+	version INTEGER NOT NULL DEFAULT 0, -- bumped by every write to the master list, its items or its details.
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- set with every version bump. used for Last-Modified headers.
 	FOREIGN KEY (creator_id) REFERENCES users (id)
 );
 
@@ -65,6 +77,8 @@ CREATE TABLE master_item_detail_relations (
 	FOREIGN KEY (master_detail_id) REFERENCES master_details (id)
 );
 
+CREATE INDEX master_item_detail_relations_master_item_id ON master_item_detail_relations (master_item_id, master_detail_id); -- the cells of a master item.
+
 
 CREATE TABLE master_list_item_relations (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -74,6 +88,8 @@ CREATE TABLE master_list_item_relations (
 	FOREIGN KEY (master_item_id) REFERENCES master_items (id)
 );
 
+CREATE INDEX master_list_item_relations_master_list_id ON master_list_item_relations (master_list_id, master_item_id); -- the items of a master list.
+
 
 CREATE TABLE master_list_detail_relations (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -83,15 +99,49 @@ CREATE TABLE master_list_detail_relations (
 	FOREIGN KEY (master_detail_id) REFERENCES master_details (id)
 );
 
+CREATE INDEX master_list_detail_relations_master_list_id ON master_list_detail_relations (master_list_id, master_detail_id); -- the details of a master list.
+
 
 CREATE TABLE list_tethers (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     list_id INTEGER NOT NULL,
     master_list_id INTEGER NOT NULL,
+    snapshot BOOL NOT NULL DEFAULT 0, -- the list got copies of the master items when it was created. see `snapshots.py`.
+    applied_seq INTEGER NOT NULL DEFAULT 0, -- the last `master_changes` row applied to the list.
     FOREIGN KEY (list_id) REFERENCES lists (id),
     FOREIGN KEY (master_list_id) REFERENCES master_lists (id)
 );
 
+CREATE INDEX list_tethers_list_id ON list_tethers (list_id, master_list_id); -- the master list of a tethered list.
+
+CREATE INDEX list_tethers_master_list_id ON list_tethers (master_list_id, applied_seq); -- the tethers that are behind on a master list's changes.
+
+
+CREATE TABLE master_changes ( -- master list writes that tethered lists apply in `seq` order. see `master_changes.py`.
+	seq INTEGER PRIMARY KEY AUTOINCREMENT,
+	master_list_id INTEGER NOT NULL,
+	kind TEXT NOT NULL, -- 'add_detail', 'delete_detail', 'edit_item' or 'delete_item'.
+	master_item_id INTEGER,
+	master_detail_id INTEGER,
+	cells TEXT, -- for item changes, a JSON object of the old contents of the cells that were overwritten or deleted.
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	FOREIGN KEY (master_list_id) REFERENCES master_lists (id)
+);
+
+CREATE INDEX master_changes_master_list_id ON master_changes (master_list_id, seq); -- a master list's changes after a tether's `applied_seq`.
+
+
+CREATE TABLE snapshot_items ( -- the items of snapshot lists that were copied from a master item, and still share its cells until they change.
+	item_id INTEGER PRIMARY KEY,
+	list_id INTEGER NOT NULL,
+	master_item_id INTEGER NOT NULL,
+	FOREIGN KEY (item_id) REFERENCES items (id),
+	FOREIGN KEY (list_id) REFERENCES lists (id),
+	FOREIGN KEY (master_item_id) REFERENCES master_items (id)
+);
+
+CREATE INDEX snapshot_items_master_item_id ON snapshot_items (master_item_id); -- the copies of a master item, for copy on write.
+
 
 CREATE TABLE untethered_content (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -104,6 +154,8 @@ CREATE TABLE untethered_content (
     FOREIGN KEY (master_detail_id) REFERENCES master_details (id)
 );
 
+CREATE INDEX untethered_content_list_id_item_id ON untethered_content (list_id, item_id); -- the cells of a tethered list, by item.
+
 
 CREATE TABLE items (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -133,6 +185,8 @@ CREATE TABLE item_detail_relations (
 	FOREIGN KEY (detail_id) REFERENCES details (id)
 );
 
+CREATE INDEX item_detail_relations_item_id ON item_detail_relations (item_id, detail_id); -- the cells of an item.
+
 
 CREATE TABLE lists (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -141,10 +195,23 @@ CREATE TABLE lists (
 	name TEXT NOT NULL,
 	description TEXT,
     tethered BOOL NOT NULL DEFAULT 0,
+	version INTEGER NOT NULL DEFAULT 0, -- bumped by every write to the list, its items or its details.
+	updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- set with every version bump. used for Last-Modified headers.
+	grid_version INTEGER, -- the version the list's `list_grids` rows match. NULL or another version means they must be rebuilt.
 	FOREIGN KEY (creator_id) REFERENCES users (id)
 );
 
 
+CREATE TABLE list_grids ( -- one row per item of a list, with all of its cells. a read model kept up to date by the write paths. see `grids.py`.
+	list_id INTEGER NOT NULL,
+	item_id INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	created TIMESTAMP NOT NULL,
+	cells TEXT NOT NULL, -- a JSON object mapping detail ids to contents.
+	PRIMARY KEY (list_id, item_id)
+) WITHOUT ROWID; -- the rows of a list are stored together, in item order.
+
+
 CREATE TABLE list_item_relations (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
 	list_id INTEGER NOT NULL,
@@ -153,6 +220,8 @@ CREATE TABLE list_item_relations (
 	FOREIGN KEY (item_id) REFERENCES items (id)
 );
 
+CREATE INDEX list_item_relations_list_id ON list_item_relations (list_id, item_id); -- the items of a list.
+
 
 CREATE TABLE list_detail_relations (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -162,6 +231,8 @@ CREATE TABLE list_detail_relations (
 	FOREIGN KEY (detail_id) REFERENCES details (id)
 );
 
+CREATE INDEX list_detail_relations_list_id ON list_detail_relations (list_id, detail_id); -- the details of a list.
+
 
 CREATE TABLE master_agents (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -209,3 +280,99 @@ CREATE TABLE tethered_agents (
 	FOREIGN KEY (master_agent_id) REFERENCES master_agents (id)
 );
 
+
+CREATE TABLE agent_runs (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	creator_id INTEGER NOT NULL,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	finished TIMESTAMP,
+	agent_id INTEGER NOT NULL,
+	model_id INTEGER NOT NULL,
+	list_id INTEGER, -- the list given to the agent as context, if any.
+	prompt TEXT NOT NULL,
+	output TEXT,
+	status TEXT NOT NULL DEFAULT 'pending',
+	FOREIGN KEY (creator_id) REFERENCES users (id),
+	FOREIGN KEY (agent_id) REFERENCES agents (id),
+	FOREIGN KEY (model_id) REFERENCES agent_models (id),
+	FOREIGN KEY (list_id) REFERENCES lists (id)
+);
+
+CREATE INDEX agent_runs_creator_status ON agent_runs (creator_id, status); -- counts a user's pending runs for the concurrency limit.
+
+
+CREATE TABLE agent_usage_ledger ( -- append-only. one row per finished run.
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	hour TIMESTAMP NOT NULL,
+	user_id INTEGER NOT NULL,
+	agent_id INTEGER NOT NULL,
+	model_id INTEGER NOT NULL,
+	input_tokens INTEGER NOT NULL,
+	output_tokens INTEGER NOT NULL,
+	latency_ms REAL NOT NULL,
+	cost REAL NOT NULL,
+	FOREIGN KEY (user_id) REFERENCES users (id),
+	FOREIGN KEY (agent_id) REFERENCES agents (id),
+	FOREIGN KEY (model_id) REFERENCES agent_models (id)
+);
+
+
+CREATE TABLE agent_usage_hourly ( -- the ledger pre-aggregated per hour, updated in the same transaction as the ledger.
+	hour TIMESTAMP NOT NULL,
+	user_id INTEGER NOT NULL,
+	agent_id INTEGER NOT NULL,
+	model_id INTEGER NOT NULL,
+	runs INTEGER NOT NULL,
+	input_tokens INTEGER NOT NULL,
+	output_tokens INTEGER NOT NULL,
+	latency_ms REAL NOT NULL,
+	cost REAL NOT NULL,
+	PRIMARY KEY (hour, user_id, agent_id, model_id)
+);
+
+
+CREATE TABLE rate_limit_buckets ( -- token buckets shared by all worker processes. see `ratelimit.py`.
+	key TEXT PRIMARY KEY,
+	tokens REAL NOT NULL,
+	updated REAL NOT NULL
+);
+
+
+CREATE TABLE rate_limit_windows ( -- sliding window counters shared by all worker processes. see `ratelimit.py`.
+	key TEXT NOT NULL,
+	window_start INTEGER NOT NULL,
+	count INTEGER NOT NULL,
+	PRIMARY KEY (key, window_start)
+);
+
+CREATE TABLE sessions ( -- server-side sessions for `SESSION_BACKEND = 'sqlite'`. see `sessions.py`.
+	id TEXT PRIMARY KEY, -- the random session id in the cookie.
+	user_id INTEGER, -- the logged in user, so all of a user's sessions can be deleted.
+	data TEXT NOT NULL,
+	expires REAL NOT NULL
+);
+
+CREATE INDEX sessions_user_id ON sessions (user_id);
+
+CREATE INDEX sessions_expires ON sessions (expires);
+
+
+CREATE TABLE slow_queries ( -- statements slower than `SLOW_QUERY_MS`, one row per statement shape. see `querylog.py`.
+	shape TEXT PRIMARY KEY, -- a hash of the normalised statement.
+	statement TEXT NOT NULL, -- the statement with its literals replaced by `?`.
+	parameters TEXT NOT NULL, -- the types of the last parameters. never their values.
+	plan TEXT, -- the output of `EXPLAIN QUERY PLAN`.
+	endpoint TEXT, -- the last endpoint that ran it.
+	count INTEGER NOT NULL,
+	total_ms REAL NOT NULL,
+	max_ms REAL NOT NULL,
+	first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+
+CREATE TABLE IF NOT EXISTS cache_versions ( -- not dropped above, so versions keep increasing across `init-db` runs and workers notice the change.
+	name TEXT PRIMARY KEY,
+	version INTEGER NOT NULL
+);
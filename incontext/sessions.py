@@ -0,0 +1,196 @@
+import random
+import secrets
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+from incontext.db import execute_write, get_db
+
+# Server-side sessions. The cookie only holds a random session id and the data stays on the server, so responses aren't signed and sessions can be revoked. Pick the backend with the `SESSION_BACKEND` config.
+
+
+class ServerSideSession(SessionMixin):
+    '''A session whose data is loaded on first access, so requests that never touch the session (static files, for example, see `auth.load_logged_in_user`) don't read the store.'''
+
+    def __init__(self, interface, sid):
+        self.interface = interface
+        self.sid = sid # None until the session is first saved.
+        self.old_sid = None # a replaced id whose stored data must be deleted.
+        self._data = None
+        self.modified = False
+        self.accessed = False
+
+    @property
+    def data(self):
+        self.accessed = True
+        if self._data is None:
+            self._data = self.interface.load(self.sid) if self.sid is not None else None
+            if self._data is None: # a missing or expired session. a new id is made when it's saved, so clients can't choose their own.
+                self.sid = None
+                self._data = {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        '''Empties the session and drops its id. `auth.login` clears the session first, so an id handed out before a login is never valid after it.'''
+        if self.sid is not None:
+            self.old_sid = self.sid
+        self.sid = None
+        self._data = {}
+        self.accessed = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    '''Stores sessions with `load`, `save` and `delete`, which the backends implement. Sessions are only written when they changed.'''
+    serializer = TaggedJSONSerializer() # the serializer of Flask's cookie sessions, so the same values can be stored.
+
+    def open_session(self, app, request):
+        return ServerSideSession(self, request.cookies.get(self.get_cookie_name(app)))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.old_sid is not None:
+            self.delete(session.old_sid)
+            session.old_sid = None
+        if not session.modified: # nothing to write back. the stored expiry is only pushed back when the session changes.
+            return
+        if not session:
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(24)
+        self.save(
+            session.sid,
+            session.get('user_id'),
+            self.serializer.dumps(dict(session)),
+            time.time() + app.permanent_session_lifetime.total_seconds()
+        )
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session), # a browser session cookie unless `session.permanent` is set.
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class SqliteSessionInterface(ServerSideSessionInterface):
+    '''Keeps sessions in the `sessions` table, which every worker shares.'''
+
+    def load(self, sid):
+        cur = get_db().cursor()
+        cur.row_factory = None
+        row = cur.execute(
+            'SELECT data FROM sessions WHERE id = ? AND expires > ?', (sid, time.time())
+        ).fetchone()
+        return self.serializer.loads(row[0]) if row is not None else None
+
+    # writes use their own connection, because sessions are saved even when a view failed and left uncommitted changes on `get_db()`.
+
+    def save(self, sid, user_id, data, expires):
+        rate = current_app.config['SESSION_SWEEP_RATE']
+        db = sqlite3.connect(current_app.config['DATABASE'])
+        try:
+            db.execute(
+                'INSERT INTO sessions (id, user_id, data, expires) VALUES (?, ?, ?, ?)'
+                ' ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, data = excluded.data, expires = excluded.expires',
+                (sid, user_id, data, expires)
+            )
+            if rate and random.randrange(rate) == 0:
+                sweep_sessions(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def delete(self, sid):
+        execute_write(current_app.config['DATABASE'], 'DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def delete_user_sessions(self, user_id):
+        '''Logs the user out everywhere.'''
+        execute_write(current_app.config['DATABASE'], 'DELETE FROM sessions WHERE user_id = ?', (user_id,))
+
+
+def sweep_sessions(db):
+    '''Deletes the expired sessions. They're never loaded, so they only take up space. Returns the number deleted.'''
+    return db.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),)).rowcount
+
+
+class MemorySessionInterface(ServerSideSessionInterface):
+    '''Keeps sessions in a dict. Other worker processes don't see them, so use it with a single worker or in tests.'''
+
+    def __init__(self):
+        self.sessions = {} # maps a session id to (user_id, data, expires).
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        stored = self.sessions.get(sid)
+        if stored is None or stored[2] <= time.time():
+            return None
+        return self.serializer.loads(stored[1]) # a copy, so concurrent requests of the same session don't share objects.
+
+    def save(self, sid, user_id, data, expires):
+        with self.lock:
+            self.sessions[sid] = (user_id, data, expires)
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def delete_user_sessions(self, user_id):
+        '''Logs the user out everywhere.'''
+        with self.lock:
+            for sid in [sid for sid, stored in self.sessions.items() if stored[0] == user_id]:
+                del self.sessions[sid]
+
+
+SESSION_INTERFACES = { # maps `SESSION_BACKEND` to a session interface. 'cookie' keeps Flask's signed cookie sessions.
+    'sqlite': SqliteSessionInterface,
+    'memory': MemorySessionInterface,
+}
+
+
+@click.command('sweep-sessions')
+@with_appcontext
+def sweep_sessions_command():
+    '''Delete the expired sessions of the sqlite session backend.'''
+    db = get_db()
+    deleted = sweep_sessions(db)
+    db.commit()
+    click.echo(f'Deleted {deleted} expired sessions.')
+
+
+def init_app(app):
+    backend = app.config['SESSION_BACKEND']
+    if backend != 'cookie':
+        app.session_interface = SESSION_INTERFACES[backend]()
+    app.cli.add_command(sweep_sessions_command)
@@ -0,0 +1,56 @@
+# Snapshot tethers. A tethered list created as a snapshot gets its own copy of each of the master list's items when it's created, instead of showing the master items next to its own. Only the names are copied: the copy's cells stay shared with the master item until they change, copy on write.
+# `snapshot_items` links each copy to the master item it was taken from. A cell of a copy is its `untethered_content` row if it has one, and the master item's content otherwise. A user's edit of a copy writes only the cells that changed (see `set_untethered_content`). A master write logs the old content of the cells it changes, and the change log gives every copy that still shares one of them its own copy before the list is read again (see `copy_shared_cells` and `master_changes.py`). So later master changes never show up in a snapshot.
+# Snapshot lists are always read from their `list_grids` rows (see `grids.py`), which hold the resolved cells. Reading one takes only the list's own rows, however big the master list gets.
+
+
+def snapshot_master_items(db, list_id, master_list_id, creator_id):
+    '''Copies the items of a master list into a new snapshot list. Returns the number of items copied.'''
+    cur = db.cursor()
+    cur.row_factory = None
+    master_items = cur.execute(
+        'SELECT i.id, i.name'
+        ' FROM master_list_item_relations m'
+        ' JOIN master_items i ON i.id = m.master_item_id'
+        ' WHERE m.master_list_id = ?'
+        ' ORDER BY i.id',
+        (master_list_id,)
+    ).fetchall()
+    copies = []
+    for master_item_id, name in master_items:
+        cur.execute('INSERT INTO items (name, creator_id) VALUES (?, ?)', (name, creator_id))
+        copies.append((list_id, cur.lastrowid, master_item_id))
+    cur.executemany('INSERT INTO list_item_relations (list_id, item_id) VALUES (?, ?)', [copy[:2] for copy in copies])
+    cur.executemany('INSERT INTO snapshot_items (list_id, item_id, master_item_id) VALUES (?, ?, ?)', copies)
+    return len(copies)
+
+
+def set_untethered_content(db, list_id, item_id, master_detail_id, content):
+    '''Writes a cell of a tethered list's item. The cell of a snapshot copy that still shares the master's content gets its row here.'''
+    cur = db.execute(
+        'UPDATE untethered_content SET content = ?'
+        ' WHERE list_id = ? AND item_id = ? AND master_detail_id = ?',
+        (content, list_id, item_id, master_detail_id)
+    )
+    if cur.rowcount == 0:
+        db.execute(
+            'INSERT INTO untethered_content (list_id, item_id, master_detail_id, content) VALUES (?, ?, ?, ?)',
+            (list_id, item_id, master_detail_id, content)
+        )
+
+
+def copy_shared_cells(db, list_id, master_item_id, cells):
+    '''Gives the copies of a master item in a snapshot list their own copy of `cells`, {master detail id: content}, where they still share them. Applied for master changes that overwrite or delete those cells (see `master_changes.py`).'''
+    db.executemany(
+        'INSERT INTO untethered_content (list_id, item_id, master_detail_id, content)'
+        ' SELECT s.list_id, s.item_id, ?, ?'
+        ' FROM snapshot_items s'
+        ' WHERE s.list_id = ? AND s.master_item_id = ?'
+        '  AND NOT EXISTS (SELECT 1 FROM untethered_content u WHERE u.list_id = s.list_id AND u.item_id = s.item_id AND u.master_detail_id = ?)',
+        [(int(master_detail_id), content, list_id, master_item_id, int(master_detail_id)) for master_detail_id, content in cells.items()]
+    )
+
+
+def release_copies(db, list_id, master_item_id, cells):
+    '''For a deleted master item: its copies in a snapshot list get all of the cells they still share, and become plain items.'''
+    copy_shared_cells(db, list_id, master_item_id, cells)
+    db.execute('DELETE FROM snapshot_items WHERE list_id = ? AND master_item_id = ?', (list_id, master_item_id))
@@ -0,0 +1,67 @@
+import importlib
+import sqlite3
+import sys
+import time
+
+from incontext.db import close_pool, open_pool
+
+# Helpers for starting workers quickly. `create_app` times its steps with a `StartupProfile` when the `IC_PROFILE_STARTUP` environment variable is set, and `warm` does the work every worker would otherwise repeat, so it can run once in the gunicorn master before the workers are forked. `gunicorn_conf.py` calls `before_fork` and `after_fork`.
+
+
+class StartupProfile:
+    '''Records how long each step of `create_app` takes, by module.'''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.steps = [] # (module, step, seconds), in the order they ran.
+
+    def run(self, module, step, function, *args):
+        if not self.enabled:
+            return function(*args)
+        started = time.perf_counter()
+        result = function(*args)
+        self.steps.append((module, step, time.perf_counter() - started))
+        return result
+
+    def import_module(self, name):
+        '''Imports `incontext.<name>`. Modules imported by an earlier `create_app` call take no time.'''
+        return self.run(name, 'import', importlib.import_module, f'incontext.{name}')
+
+    def report(self, stream=None):
+        if not self.enabled:
+            return
+        stream = stream or sys.stderr
+        print(f'{"module":<16}{"step":<12}{"ms":>10}', file=stream)
+        for module, step, seconds in self.steps:
+            print(f'{module:<16}{step:<12}{seconds * 1000:>10.2f}', file=stream)
+        print(f'{"total":<28}{sum(step[2] for step in self.steps) * 1000:>10.2f}', file=stream)
+
+
+def warm_templates(app):
+    '''Compiles every template into the Jinja environment's cache. Returns the number of templates.'''
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm(app):
+    '''Fills the per-process caches that don't depend on a request. Call it in a preloading server's master process, so forked workers share the result copy-on-write instead of each building their own.'''
+    from incontext.registry import get_agent_models
+    warm_templates(app)
+    with app.app_context():
+        try:
+            get_agent_models()
+        except sqlite3.OperationalError: # the database isn't initialised yet. workers load the models on first use.
+            pass
+    close_pool()
+
+
+def before_fork(app):
+    '''Runs in the master process before each worker is forked. sqlite connections must not be shared with the child.'''
+    close_pool()
+
+
+def after_fork(app):
+    '''Runs in each new worker. Per-process state such as the agent engine's event loop and the hashing pool notices the new pid and starts over by itself. The database pool is opened here, so the first requests don't wait for connections.'''
+    open_pool(app)
@@ -0,0 +1,30 @@
+from flask import Response, current_app, get_flashed_messages, stream_template
+
+# Streamed rendering of the list and master list pages. Lists with at least `STREAM_MIN_ITEMS` items aren't rendered into a fragment: the template is rendered while the response is sent, and reads the items from a database cursor as it goes. The first bytes go out right away, and a worker holds about one item at a time instead of the whole page.
+# The app context is torn down when the view returns, before the body is sent, so `close_db` has already closed or pooled the view's connection. The row generators call `get_db` when they're first read, and `stream_template` pushes the context again while it renders, so that connection is closed by the teardown at the end of the stream.
+
+
+class RowStream:
+    '''Rows that are read while a template iterates over them. The number of rows is known beforehand, so templates can check `|length` without reading them. It can be iterated once.'''
+
+    def __init__(self, rows, length):
+        self.rows = rows
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def should_stream(*counts):
+    '''Whether a page showing `counts` items is big enough to stream.'''
+    threshold = current_app.config['STREAM_MIN_ITEMS']
+    return threshold is not None and sum(counts) >= threshold
+
+
+def stream_page(template, **context):
+    '''A response that renders `template` while it's sent, in the request context of the view.'''
+    get_flashed_messages(with_categories=True) # the session is saved before the body is rendered, so the messages are taken from it now. the template gets them from the request.
+    return Response(stream_template(template, **context))
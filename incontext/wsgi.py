@@ -0,0 +1,11 @@
+'''The application for WSGI servers, already warmed up.
+
+    gunicorn --preload 'incontext.wsgi:app'
+
+With `--preload` the master process imports this module once, so the app, its imported modules and its compiled templates are built before the workers are forked and are shared by them copy-on-write.
+'''
+from incontext import create_app
+from incontext.startup import warm
+
+app = create_app()
+warm(app)
@@ -0,0 +1,6 @@
+AGENT_MODELS = [
+    ("OpenAI", "openai", "GPT-4.1 nano", "gpt-4.1-nano", "Local test model")
+    if i == 3 else
+    ("OpenAI", "openai", f"Test Model {i}", f"test-{i}", f"Local test model {i}")
+    for i in range(1, 11)
+]
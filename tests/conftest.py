@@ -17,6 +17,7 @@ def app():
         'TESTING': True, # tells Flask that the app is in test mode. makes testing better in Flask, and also tapped by extensions.
         'DATABASE': db_path, # override so it points to the temp path instead of the instance folder.
         'AGENT_MODELS': AGENT_MODELS,
+        'PROPAGATE_MASTER_CHANGES': 'sync', # tethered lists are up to date when a master write returns, instead of racing a background thread.
     })
 
     with app.app_context(): # create the test db (at the temp file path)
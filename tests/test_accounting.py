@@ -0,0 +1,113 @@
+import time
+
+import pytest
+from incontext.accounting import estimate_tokens, flush_usage, record_usage
+from incontext.db import get_db
+
+
+def make_run(agent_id=1, creator_id=2):
+    return {
+        "id": 1,
+        "creator_id": creator_id,
+        "agent_id": agent_id,
+        "model_id": 3,
+        "model_code": "gpt-4.1-nano",
+        "role": "agent role 1",
+        "instructions": "Reply with one word: Working",
+        "context": "",
+        "prompt": "Are you working?",
+    }
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_record_usage_batches(app):
+    settings = {
+        "AGENT_STUB_PRICES": {"default": (1.0, 2.0), "gpt-4.1-nano": (1000000.0, 0.0)},
+        "LEDGER_BATCH_SIZE": 3,
+        "LEDGER_FLUSH_INTERVAL": 3600,
+    }
+    database = app.config["DATABASE"]
+    with app.app_context():
+        db = get_db()
+        # entries are buffered until the batch is full
+        record_usage(database, settings, make_run(), "Working", 10.0)
+        record_usage(database, settings, make_run(), "Working", 30.0)
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 0
+        record_usage(database, settings, make_run(agent_id=2), "Working", 20.0)
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 3
+        # the hourly rollup is aggregated per agent
+        rollups = db.execute("SELECT * FROM agent_usage_hourly ORDER BY agent_id").fetchall()
+        assert len(rollups) == 2
+        assert rollups[0]["runs"] == 2
+        assert rollups[0]["latency_ms"] == 40.0
+        assert rollups[1]["runs"] == 1
+        input_tokens = estimate_tokens("agent role 1Reply with one word: WorkingAre you working?")
+        assert rollups[0]["input_tokens"] == 2 * input_tokens
+        assert rollups[0]["cost"] == pytest.approx(2 * input_tokens)
+        # a partial batch can be flushed explicitly
+        record_usage(database, settings, make_run(), "Working", 10.0)
+        assert flush_usage(database) == 1
+        assert flush_usage(database) == 0
+        assert db.execute("SELECT runs FROM agent_usage_hourly WHERE agent_id = 1").fetchone()["runs"] == 3
+
+
+def test_run_is_accounted(app, client, auth):
+    app.config["AGENT_ENGINE"] = "sync"
+    app.config["LEDGER_BATCH_SIZE"] = 1
+    auth.login()
+    client.post("agents/1/run", data={"prompt": "Are you working?"})
+    with app.app_context():
+        entry = get_db().execute("SELECT * FROM agent_usage_ledger").fetchone()
+        assert entry["user_id"] == 2
+        assert entry["agent_id"] == 1
+        assert entry["model_id"] == 3
+        assert entry["output_tokens"] > 0
+        assert entry["cost"] > 0
+
+
+def test_timed_flush(app):
+    settings = {
+        "AGENT_STUB_PRICES": {"default": (1.0, 2.0)},
+        "LEDGER_BATCH_SIZE": 50,
+        "LEDGER_FLUSH_INTERVAL": 0.1,
+    }
+    database = app.config["DATABASE"]
+    with app.app_context():
+        db = get_db()
+        record_usage(database, settings, make_run(), "Working", 10.0)
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 0
+        # the partial batch is written after the interval without another run
+        for _ in range(50):
+            time.sleep(0.05)
+            if db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"]:
+                break
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 1
+
+
+def test_failed_flush_keeps_entries(app, caplog):
+    settings = {
+        "AGENT_STUB_PRICES": {"default": (1.0, 2.0)},
+        "LEDGER_BATCH_SIZE": 50,
+        "LEDGER_FLUSH_INTERVAL": 3600,
+    }
+    database = app.config["DATABASE"]
+    with app.app_context():
+        db = get_db()
+        record_usage(database, settings, make_run(), "Working", 10.0)
+        record_usage(database, settings, make_run(), "Working", 20.0)
+        # the rollup can't be written, so neither is the ledger
+        db.execute("ALTER TABLE agent_usage_hourly RENAME TO agent_usage_hourly_moved")
+        db.commit()
+        assert flush_usage(database) == 0
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 0
+        assert "2 usage entries could not be written" in caplog.text
+        # the entries are written by the next flush
+        db.execute("ALTER TABLE agent_usage_hourly_moved RENAME TO agent_usage_hourly")
+        db.commit()
+        assert flush_usage(database) == 2
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_usage_ledger").fetchone()["count"] == 2
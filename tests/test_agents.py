@@ -1,5 +1,10 @@
+import concurrent.futures
+import sqlite3
+
 import pytest
+from incontext import agents, engine
 from incontext.db import get_db
+from incontext.engine import submit_run
 
 
 def test_index_agents(client, auth):
@@ -212,6 +217,130 @@ def test_edit_agent(app, client, auth):
     assert response.headers['Location'] == '/agents/'
 
 
+def test_run_agent(app, client, auth):
+    # user must be logged in
+    response = client.get("agents/1/run")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/auth/login"
+    # user must be agent creator
+    auth.login("other", "other")
+    assert client.get("agents/1/run").status_code == 403
+    auth.login()
+    response = client.get("agents/1/run")
+    assert response.status_code == 200
+    assert b"agent name 1" in response.data
+    # data validation
+    response = client.post("agents/1/run", data={"prompt": ""})
+    assert b"Prompt is required." in response.data
+    # the run is saved and answered by the stub provider inside the request
+    app.config["AGENT_ENGINE"] = "sync"
+    response = client.post("agents/1/run", data={"prompt": "Are you working?"})
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/agents/1/runs/1/view"
+    with app.app_context():
+        agent_run = get_db().execute("SELECT * FROM agent_runs WHERE id = 1").fetchone()
+        assert agent_run["agent_id"] == 1
+        assert agent_run["creator_id"] == 2
+        assert agent_run["model_id"] == 3
+        assert agent_run["prompt"] == "Are you working?"
+        assert agent_run["status"] == "done"
+        assert agent_run["finished"] is not None
+    response = client.get("agents/1/runs/1/view")
+    assert b"Are you working?" in response.data
+    assert b"Received 16 characters." in response.data
+    # a list can be given as context
+    response = client.post("agents/1/run", data={"prompt": "Are you working?", "list_id": "1"})
+    assert response.headers["Location"] == "/agents/1/runs/2/view"
+    response = client.get("agents/1/runs/2/view")
+    assert b"list name 1" in response.data
+    assert b"and 5 lines of context." in response.data
+    # the list must belong to the user
+    assert client.post("agents/1/run", data={"prompt": "Are you working?", "list_id": "3"}).status_code == 403
+
+
+def test_run_agent_limits(app, client, auth, monkeypatch):
+    app.config["AGENT_ENGINE"] = "sync"
+    app.config["AGENT_RATE_LIMITS"] = {"user": (1, 2)}
+    contexts = []
+    monkeypatch.setattr(agents, "get_list_context", lambda alist: contexts.append(alist["id"]) or "")
+    auth.login()
+    # the user's burst is used up
+    assert client.post("agents/1/run", data={"prompt": "Working?", "list_id": "1"}).status_code == 302
+    assert client.post("agents/1/run", data={"prompt": "Working?"}).status_code == 302
+    response = client.post("agents/1/run", data={"prompt": "Working?", "list_id": "1"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert b"Too many agent runs." in response.data
+    # refused runs don't build the list context
+    client.post("agents/1/run", data={"prompt": "", "list_id": "1"})
+    assert contexts == [1]
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) AS count FROM agent_runs").fetchone()["count"] == 2
+        # too many runs in flight
+        app.config["AGENT_RATE_LIMITS"] = {}
+        app.config["AGENT_MAX_PENDING_PER_USER"] = 2
+        db.executemany(
+            "INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt) VALUES (2, 1, 3, 'Working?')",
+            [(), ()]
+        )
+        db.commit()
+    assert client.post("agents/1/run", data={"prompt": "Working?"}).status_code == 429
+
+
+def test_run_agent_async(app):
+    app.config["AGENT_STUB_LATENCY"] = 0.05
+    with app.app_context():
+        db = get_db()
+        for run_id in range(1, 101):
+            db.execute(
+                "INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt) VALUES (2, 1, 3, 'Working?')"
+            )
+        db.commit()
+        # the runs are handed to the engine loop and wait on the provider concurrently
+        futures = [
+            submit_run({
+                "id": run_id,
+                "creator_id": 2,
+                "agent_id": 1,
+                "model_id": 3,
+                "provider_code": "stub",
+                "model_code": "stub",
+                "role": "agent role 1",
+                "instructions": "Reply with one word: Working",
+                "context": "",
+                "prompt": "Working?",
+            })
+            for run_id in range(1, 101)
+        ]
+        assert [future.result(timeout=10) for future in futures] == ["done"] * 100
+        pending = db.execute("SELECT COUNT(*) AS count FROM agent_runs WHERE status != 'done'").fetchone()
+        assert pending["count"] == 0
+
+
+def test_view_run(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt) VALUES (2, 1, 3, 'pending prompt')"
+        )
+        db.commit()
+    # user must be logged in
+    response = client.get("agents/1/runs/1/view")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/auth/login"
+    # user must be agent creator
+    auth.login("other", "other")
+    assert client.get("agents/1/runs/1/view").status_code == 403
+    auth.login()
+    response = client.get("agents/1/runs/1/view")
+    assert response.status_code == 200
+    assert b"pending prompt" in response.data
+    assert b"pending" in response.data
+    # run must belong to the agent
+    assert client.get("agents/2/runs/1/view").status_code == 404
+
+
 def test_delete_agent(client, auth, app):
     # user must be logged in
     response = client.post("/agents/1/delete")
@@ -291,3 +420,81 @@ def test_delete_tethered_agent(client, auth, app):
     assert response.headers["Location"] == "/agents/"
 
 
+
+
+def test_run_agent_disabled(app, client, auth):
+    app.config["AGENT_RATE_LIMITS"] = {"user": (0, 0)}
+    auth.login()
+    response = client.post("agents/1/run", data={"prompt": "Working?"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3600"
+
+
+def test_run_agent_forbidden_list(app, client, auth):
+    app.config["AGENT_RATE_LIMITS"] = {"model": (1, 1)}
+    auth.login()
+    # the list isn't the user's, so the run is refused before it takes a token
+    assert client.post("agents/1/run", data={"prompt": "Working?", "list_id": "3"}).status_code == 403
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) AS count FROM rate_limit_buckets").fetchone()["count"] == 0
+
+
+def make_run(run_id):
+    return {
+        "id": run_id,
+        "creator_id": 2,
+        "agent_id": 1,
+        "model_id": 3,
+        "provider_code": "stub",
+        "model_code": "stub",
+        "role": "agent role 1",
+        "instructions": "Reply with one word: Working",
+        "context": "",
+        "prompt": "Working?",
+    }
+
+
+def test_run_write_failures(app, monkeypatch, caplog):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt) VALUES (2, 1, 3, 'Working?')")
+        db.commit()
+        write = engine.execute_write_async
+        async def locked_once(database, sql, parameters=()):
+            monkeypatch.setattr(engine, "execute_write_async", write)
+            raise sqlite3.OperationalError("database is locked")
+        monkeypatch.setattr(engine, "execute_write_async", locked_once)
+        def broken_ledger(*args):
+            raise sqlite3.OperationalError("disk I/O error")
+        monkeypatch.setattr(engine, "record_usage", broken_ledger)
+        # the failures are logged, and the run is marked as failed instead of staying pending
+        assert submit_run(make_run(1)).result(timeout=10) == "error"
+        run = db.execute("SELECT status, output FROM agent_runs WHERE id = 1").fetchone()
+        assert run["status"] == "error"
+        assert run["output"] == "The outcome of the run could not be stored."
+    messages = [record.getMessage() for record in caplog.records]
+    assert "The outcome of agent run 1 could not be stored." in messages
+    assert "The usage of agent run 1 could not be recorded." in messages
+
+
+def test_log_run_failure(caplog):
+    future = concurrent.futures.Future()
+    future.set_exception(RuntimeError("engine bug"))
+    engine.log_run_failure(future)
+    record = [record for record in caplog.records if record.getMessage() == "An agent run failed."][0]
+    assert record.exc_info[1].args == ("engine bug",)
+
+
+def test_orphaned_runs(app, client, auth):
+    app.config["AGENT_ENGINE"] = "sync"
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt, created) VALUES (2, 1, 3, 'Working?', datetime('now', '-20 minutes'))")
+        db.execute("INSERT INTO agent_runs (creator_id, agent_id, model_id, prompt) VALUES (2, 1, 3, 'Working?')")
+        db.commit()
+    auth.login()
+    client.post("agents/1/run", data={"prompt": "Working?"})
+    with app.app_context():
+        statuses = [row["status"] for row in get_db().execute("SELECT status FROM agent_runs ORDER BY id")]
+    # the lost run is given up on, the recent one may still be in flight
+    assert statuses == ["error", "pending", "done"]
@@ -0,0 +1,34 @@
+import os
+
+from flask import url_for
+
+from incontext.assets import STATIC_MAX_AGE
+
+
+def test_fingerprinted_urls(app, client):
+    with app.test_request_context():
+        url = url_for('static', filename='styles.css')
+        assert url.startswith('/static/styles.css?v=')
+        assert url_for('static', filename='missing.css') == '/static/missing.css'
+    assert url.encode() in client.get('/auth/login').data
+    # the fingerprinted url may be cached for a year
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.max_age == STATIC_MAX_AGE
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    # other urls of the file may not
+    for other in ('/static/styles.css', '/static/styles.css?v=old'):
+        response = client.get(other)
+        assert response.status_code == 200
+        assert response.cache_control.max_age != STATIC_MAX_AGE
+
+
+def test_fingerprint_changes(app, tmp_path):
+    app.static_folder = str(tmp_path)
+    (tmp_path / 'app.css').write_text('body {}')
+    with app.test_request_context():
+        first = url_for('static', filename='app.css')
+        (tmp_path / 'app.css').write_text('body { color: red; }')
+        os.utime(tmp_path / 'app.css', ns=(0, 0)) # a different mtime, even on file systems with coarse timestamps.
+        assert url_for('static', filename='app.css') != first
@@ -1,6 +1,7 @@
 import pytest
 from flask import g, session
-from incontext.db import get_db
+from incontext.db import bump_cache_version, get_db
+from incontext.ratelimit import count_hits, record_hit, sweep_windows
 
 def test_register(client, app):
     assert client.get('/auth/register').status_code == 200 # the register view should render successfully on GET
@@ -52,3 +53,121 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert 'user_id' not in session
+
+
+def test_user_snapshot(app, client, auth):
+    auth.login()
+    with client:
+        client.get('/')
+        assert session['user']['id'] == 2
+        assert session['user']['username'] == 'test'
+        assert session['user']['admin'] == True
+        assert 'password' not in session['user']
+    # the users table is not queried while the snapshot is fresh
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET username = 'renamed' WHERE id = 2")
+        db.commit()
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'test'
+    # a new users cache version, e.g. from `flask init-db`, reloads the snapshot
+    app.config['CACHE_VERSION_TTL'] = 0
+    with app.app_context():
+        db = get_db()
+        bump_cache_version(db, 'users')
+        db.commit()
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'renamed'
+    # so does an expired snapshot
+    app.config['USER_SNAPSHOT_TTL'] = 0
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET admin = 0 WHERE id = 2")
+        db.commit()
+    with client:
+        client.get('/')
+        assert g.user['admin'] == False
+    # a deleted user is logged out
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM users WHERE id = 2")
+        db.commit()
+    with client:
+        response = client.get('/')
+        assert response.headers['Location'] == '/auth/login'
+        assert 'user_id' not in session
+
+
+def test_login_rehash(app, auth):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT password FROM users WHERE id = 3").fetchone()["password"].startswith("pbkdf2:sha256:50000$")
+    # a hash made with old parameters is upgraded at login
+    auth.login('other', 'other')
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT password FROM users WHERE id = 3").fetchone()["password"].startswith(app.config["PASSWORD_HASH_METHOD"] + "$")
+    auth.logout()
+    response = auth.login('other', 'other')
+    assert response.headers["Location"] == "/"
+
+
+def test_login_throttle(app, client, auth, monkeypatch):
+    app.config['LOGIN_THROTTLE'] = {'user': (3, 300), 'ip': (5, 300)}
+    for _ in range(3):
+        assert b'Incorrect password' in auth.login('test', 'wrong').data
+    # the username is throttled before its password is hashed
+    def fail(*args):
+        raise AssertionError('the password was checked')
+    monkeypatch.setattr('incontext.auth.verify_password', fail)
+    response = auth.login('test', 'test')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '300'
+    assert b'Too many failed logins' in response.data
+    monkeypatch.undo()
+    # other usernames are not affected until the address is throttled
+    assert auth.login('other', 'other').status_code == 302
+    assert b'Incorrect username' in auth.login('nobody', 'wrong').data
+    assert b'Incorrect username' in auth.login('nobody2', 'wrong').data
+    assert auth.login('other', 'other').status_code == 429
+    # another client address is not throttled
+    response = client.post(
+        '/auth/login',
+        data={'username': 'other', 'password': 'other'},
+        environ_base={'REMOTE_ADDR': '10.0.0.2'}
+    )
+    assert response.status_code == 302
+
+
+def test_sliding_window(app):
+    with app.app_context():
+        db = get_db()
+        record_hit(db, 'key', 100, now=1050)
+        record_hit(db, 'key', 100, now=1099)
+        assert count_hits(db, 'key', 100, now=1099) == 2
+        # the previous window counts in proportion to its overlap
+        record_hit(db, 'key', 100, now=1120)
+        assert count_hits(db, 'key', 100, now=1125) == pytest.approx(1 + 2 * 0.75)
+        assert count_hits(db, 'key', 100, now=1199) == pytest.approx(1 + 2 * 0.01)
+        assert count_hits(db, 'key', 100, now=1300) == 0
+        assert count_hits(db, 'other', 100, now=1125) == 0
+
+
+def test_sweep_windows(app, client):
+    with app.app_context():
+        db = get_db()
+        record_hit(db, 'login:user:gone', 100, now=1050)
+        record_hit(db, 'login:user:recent', 100, now=1150)
+        # windows of other keys that are too old to count are dropped
+        assert sweep_windows(db, 100, now=1250) == 1
+        assert count_hits(db, 'login:user:recent', 100, now=1250) == pytest.approx(0.5)
+        db.commit()
+    # failed logins sweep in 1 in LOGIN_THROTTLE_SWEEP_RATE attempts
+    app.config['LOGIN_THROTTLE_SWEEP_RATE'] = 1
+    client.post('/auth/login', data={'username': 'a', 'password': 'wrong'})
+    with app.app_context():
+        keys = [row[0] for row in get_db().execute('SELECT key FROM rate_limit_windows')]
+    assert 'login:user:recent' not in keys
+    assert 'login:user:a' in keys
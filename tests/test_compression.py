@@ -0,0 +1,95 @@
+import gzip
+
+from flask import Response, stream_with_context
+
+from incontext import compression
+from incontext.db import get_db
+
+
+def test_gzip(client, auth):
+    auth.login()
+    response = client.get('/lists/1/view', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert b'item name 1' in gzip.decompress(response.data)
+    # the ETag stays strong, and names the encoding
+    etag = response.headers['ETag']
+    assert etag.startswith('"') and etag.endswith('-gzip"')
+    response = client.get('/lists/1/view', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag # the same validator as the 200.
+    assert 'Accept-Encoding' in response.headers['Vary']
+    # without Accept-Encoding the response isn't compressed
+    response = client.get('/lists/1/view')
+    assert 'Content-Encoding' not in response.headers
+    assert b'item name 1' in response.data
+    assert response.headers['ETag'] == etag.replace('-gzip', '')
+    assert client.get('/lists/1/view', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_small_responses(app, client):
+    response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) > 500
+    assert response.headers['Content-Encoding'] == 'gzip'
+    app.config['COMPRESS_MIN_SIZE'] = 100000
+    response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    app.config['COMPRESS_MIN_SIZE'] = None
+    response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_other_types(client):
+    response = client.get('/static/favicon/favicon-32x32.png', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_streamed(app):
+    @app.route('/stream')
+    def stream():
+        def generate():
+            yield 'first part\n'
+            yield 'second part\n' * 10
+        return Response(stream_with_context(generate()), mimetype='text/plain')
+    response = app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data) == b'first part\n' + b'second part\n' * 10
+
+
+def test_brotli(client, monkeypatch):
+    class FakeBrotli:
+        class Compressor:
+            def __init__(self, quality):
+                self.quality = quality
+            def process(self, data):
+                return data
+            def flush(self):
+                return b''
+            def finish(self):
+                return b'(br)'
+    monkeypatch.setattr(compression, 'brotli', FakeBrotli)
+    response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.data.endswith(b'(br)')
+    response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_streamed_page_size(app, client, runner):
+    # a list big enough that the chunks of its streamed page are small next to the buffer
+    result = runner.invoke(args=['gen-data', '--users', '1', '--lists', '1', '--tethered', '0', '--items', '1000', '--details', '3', '--master-lists', '0'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        user = get_db().execute('SELECT id, username FROM users ORDER BY id DESC LIMIT 1').fetchone()
+        list_id = get_db().execute('SELECT id FROM lists WHERE creator_id = ?', (user['id'],)).fetchone()['id']
+    client.post('/auth/login', data={'username': user['username'], 'password': 'password'})
+    path = f'/lists/{list_id}/view'
+    app.config['STREAM_MIN_ITEMS'] = None
+    buffered = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    app.config['STREAM_MIN_ITEMS'] = 1
+    streamed = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Length' not in streamed.headers
+    assert len(gzip.decompress(streamed.data)) > 100000
+    # flushing every chunk made the streamed page many times bigger than the buffered one
+    assert len(streamed.data) < len(buffered.data) * 1.2
@@ -0,0 +1,76 @@
+import pytest
+from flask import g
+from incontext.context import get_list_context, get_master_list_context
+from incontext.db import get_db
+from incontext.lists import get_list
+
+
+def test_list_context(app):
+    with app.app_context():
+        g.user = {"id": 2}
+        context = get_list_context(get_list(1))
+        assert context.splitlines() == [
+            "List: list name 1",
+            "Description: list description 1",
+            "Name | detail name 1 | detail name 2",
+            "item name 1 | relation content 1 | relation content 2",
+            "item name 2 | relation content 3 | relation content 4",
+        ]
+        # columns are selected and ordered, unknown ids are ignored
+        context = get_list_context(get_list(1), columns=[2, 3])
+        assert context.splitlines()[2:] == [
+            "Name | detail name 2",
+            "item name 1 | relation content 2",
+            "item name 2 | relation content 4",
+        ]
+
+
+def test_tethered_list_context(app):
+    with app.app_context():
+        g.user = {"id": 2}
+        context = get_list_context(get_list(5))
+        assert context.splitlines()[2:] == [
+            "Name | master detail name 1 | master detail name 2",
+            "master item name 1 | master relation content 1 | master relation content 2",
+            "master item name 2 | master relation content 3 | master relation content 4",
+            "item name 7 | untethered content 1 | untethered content 2",
+        ]
+        assert "untethered content 3" not in context
+
+
+def test_master_list_context(app):
+    with app.app_context():
+        context = get_master_list_context(2)
+        assert context.splitlines() == [
+            "Master List: master list name 2",
+            "Description: master list description 2",
+            "Name | master detail name 3",
+            "master item name 3 | master relation content 5",
+        ]
+        assert get_master_list_context(50) is None
+
+
+def test_context_budget(app):
+    with app.app_context():
+        g.user = {"id": 2}
+        context = get_list_context(get_list(1), budget=40)
+        lines = context.splitlines()
+        assert lines[-1] == "[truncated at the budget of 40 tokens]"
+        assert "item name 1 | relation content 1 | relation content 2" in lines
+        assert "item name 2 | relation content 3 | relation content 4" not in lines
+
+
+def test_context_cache(app):
+    with app.app_context():
+        g.user = {"id": 2}
+        db = get_db()
+        before = get_list_context(get_list(1))
+        # the cached context is served while the list version is unchanged
+        db.execute("UPDATE item_detail_relations SET content = 'changed | content' WHERE id = 1")
+        db.commit()
+        assert get_list_context(get_list(1)) == before
+        # a new version is serialised again
+        db.execute("UPDATE lists SET version = version + 1 WHERE id = 1")
+        db.commit()
+        after = get_list_context(get_list(1))
+        assert "item name 1 | changed / content | relation content 2" in after
@@ -2,7 +2,7 @@ import sqlite3
 import os
 
 import pytest
-from incontext.db import get_db
+from incontext.db import close_pool, dict_factory, get_db, get_pool, open_pool, take_connection
 from flask import g, session
 
 
@@ -17,6 +17,53 @@ def test_get_close_db(app):
     assert 'closed' in str(e.value) # After the context, the connection should be closed.
 
 
+def test_pool(app, monkeypatch):
+    app.config['DB_POOL_SIZE'] = 1
+    with app.app_context():
+        db = get_db()
+        db.row_factory = dict_factory
+        db.execute("UPDATE lists SET name = 'uncommitted' WHERE id = 1")
+    # the connection is reused, in a clean state
+    with app.app_context():
+        assert get_db() is db
+        assert db.row_factory is sqlite3.Row
+        assert db.execute('SELECT name FROM lists WHERE id = 1').fetchone()['name'] == 'list name 1'
+        # a concurrent context gets a new connection
+        with app.app_context():
+            other = get_db()
+            assert other is not db
+    # the pool holds one idle connection, so the one released last is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1')
+    with app.app_context():
+        assert get_db() is other
+    # a forked process doesn't use its parent's connections
+    monkeypatch.setattr('os.getpid', lambda: -1)
+    with app.app_context():
+        assert get_db() is not other
+    monkeypatch.undo()
+    # closing the pool closes the idle connections
+    with app.app_context():
+        db = get_db()
+    close_pool()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1')
+
+
+def test_open_pool(app):
+    app.config['DB_POOL_SIZE'] = 3
+    open_pool(app)
+    with app.app_context():
+        assert get_pool().qsize() == 3
+        connections = set()
+        for _ in range(3):
+            connections.add(take_connection())
+        assert None not in connections and len(connections) == 3
+        for db in connections:
+            db.close()
+    close_pool()
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder:
         called = False
@@ -0,0 +1,57 @@
+from incontext.db import get_db
+
+OPTIONS = ['--users', '4', '--admins', '1', '--lists', '2', '--tethered', '1', '--items', '3', '--details', '2', '--master-lists', '2', '--master-items', '3', '--master-details', '2', '--batch-size', '7']
+
+
+def count(table):
+    return get_db().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_gen_data(app, runner, client):
+    with app.app_context():
+        before = {table: count(table) for table in ('users', 'lists', 'items', 'item_detail_relations', 'untethered_content', 'master_item_detail_relations')}
+    result = runner.invoke(args=['gen-data', '--seed', '1'] + OPTIONS)
+    assert result.exit_code == 0, result.output
+    assert 'Generated 84 content cells' in result.output # 4 users * 2 lists * 3 items * 2 details, 4 users * 1 tethered list * 3 items * 2 master details, and 2 master lists * 3 items * 2 details
+    with app.app_context():
+        db = get_db()
+        assert count('users') == before['users'] + 4
+        assert count('lists') == before['lists'] + 12
+        assert count('items') == before['items'] + 36
+        assert count('item_detail_relations') == before['item_detail_relations'] + 48
+        assert count('untethered_content') == before['untethered_content'] + 24
+        assert count('master_item_detail_relations') == before['master_item_detail_relations'] + 12
+        user = db.execute('SELECT id, username FROM users ORDER BY id DESC LIMIT 1').fetchone()
+        plain = db.execute('SELECT id FROM lists WHERE creator_id = ? AND NOT tethered', (user['id'],)).fetchone()
+        tethered = db.execute('SELECT id FROM lists WHERE creator_id = ? AND tethered', (user['id'],)).fetchone()
+        master_list_id = db.execute('SELECT master_list_id FROM list_tethers WHERE list_id = ?', (tethered['id'],)).fetchone()['master_list_id']
+    # the generated lists work in the app
+    client.post('/auth/login', data={'username': user['username'], 'password': 'password'})
+    response = client.get(f'/lists/{plain["id"]}/view')
+    assert response.status_code == 200
+    assert response.data.count(b'<tr>') == 4
+    response = client.get(f'/lists/{tethered["id"]}/view')
+    assert response.status_code == 200
+    assert f'master list {master_list_id} (tethered)'.encode() in response.data
+
+
+def test_gen_data_seed(app, runner):
+    def contents():
+        return get_db().execute(
+            'SELECT content FROM item_detail_relations ORDER BY id DESC LIMIT 20'
+        ).fetchall()
+    runner.invoke(args=['gen-data', '--seed', '5'] + OPTIONS)
+    with app.app_context():
+        first = [row['content'] for row in contents()]
+    runner.invoke(args=['gen-data', '--seed', '5'] + OPTIONS)
+    with app.app_context():
+        assert [row['content'] for row in contents()] == first
+    runner.invoke(args=['gen-data', '--seed', '6'] + OPTIONS)
+    with app.app_context():
+        assert [row['content'] for row in contents()] != first
+
+
+def test_gen_data_needs_masters(runner):
+    result = runner.invoke(args=['gen-data', '--master-lists', '0', '--tethered', '1', '--users', '1'])
+    assert result.exit_code != 0
+    assert 'need master lists' in result.output
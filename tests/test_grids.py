@@ -0,0 +1,126 @@
+import json
+
+from flask import g
+from incontext import context
+from incontext.context import get_list_context
+from incontext.db import get_db
+from incontext.grids import Grid, build_list_grid
+from incontext.lists import get_list, get_list_items_with_details
+
+
+def get_grid_rows(db, list_id):
+    return [
+        (row['item_id'], row['name'], row['created'], json.loads(row['cells']))
+        for row in db.execute('SELECT item_id, name, created, cells FROM list_grids WHERE list_id = ? ORDER BY item_id', (list_id,))
+    ]
+
+
+def assert_grid_current(app, list_id, tethered):
+    '''The grid matches the list version, and a rebuild from the relational tables gives the same rows.'''
+    with app.app_context():
+        db = get_db()
+        grid_version, version = db.execute('SELECT grid_version, version FROM lists WHERE id = ?', (list_id,)).fetchone()
+        assert grid_version == version
+        rows = get_grid_rows(db, list_id)
+        build_list_grid(db, list_id, tethered)
+        assert get_grid_rows(db, list_id) == rows
+        db.rollback()
+        return rows
+
+
+def test_built_on_read(app, client, auth):
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM list_grids').fetchone()[0] == 0
+    auth.login()
+    response = client.get('/lists/1/view')
+    assert b'relation content 4' in response.data
+    rows = assert_grid_current(app, 1, False)
+    assert [row[0] for row in rows] == [1, 2]
+    assert rows[0][3] == {'1': 'relation content 1', '2': 'relation content 2'}
+
+
+def test_write_paths(app, client, auth):
+    auth.login()
+    client.get('/lists/1/view')
+    client.post('/lists/1/items/new', data={'name': 'item name 10', '1': 'new content 1', '2': 'new content 2'})
+    rows = assert_grid_current(app, 1, False)
+    assert rows[-1][1] == 'item name 10'
+    client.post('/lists/1/items/1/edit', data={'name': 'item name 1 updated', '1': 'edited content', '2': 'relation content 2'})
+    rows = assert_grid_current(app, 1, False)
+    assert rows[0][1] == 'item name 1 updated'
+    assert rows[0][3]['1'] == 'edited content'
+    client.post('/lists/1/details/new', data={'name': 'detail name 10', 'description': 'detail description 10'})
+    rows = assert_grid_current(app, 1, False)
+    assert all(len(row[3]) == 3 for row in rows)
+    client.post('/lists/1/details/1/delete')
+    rows = assert_grid_current(app, 1, False)
+    assert all(len(row[3]) == 2 for row in rows)
+    client.post('/lists/1/items/2/delete')
+    rows = assert_grid_current(app, 1, False)
+    assert 2 not in [row[0] for row in rows]
+    client.post('/lists/1/delete')
+    with app.app_context():
+        assert get_grid_rows(get_db(), 1) == []
+
+
+def test_tethered_write_paths(app, client, auth):
+    auth.login()
+    client.get('/lists/5/view')
+    client.post('/lists/5/items/new', data={'name': 'item name 10', '1': 'untethered content 6', '2': 'untethered content 7'})
+    client.post('/lists/5/items/7/edit', data={'name': 'item name 7 updated', '1': 'edited content', '2': 'untethered content 2'})
+    rows = assert_grid_current(app, 5, True)
+    assert [row[1] for row in rows] == ['item name 7 updated', 'item name 10']
+    auth.login('admin2', 'admin2')
+    client.post('/master-lists/1/master-details/new', data={'name': 'master detail name 10', 'description': 'master detail description 10'})
+    rows = assert_grid_current(app, 5, True)
+    assert all(len(row[3]) == 3 for row in rows)
+    client.post('/master-lists/1/master-details/1/delete')
+    rows = assert_grid_current(app, 5, True)
+    assert all(len(row[3]) == 2 for row in rows)
+
+
+def grid_rows(grid):
+    return [(item.id, item.name, item.created, item.cells) for item in grid]
+
+
+def test_same_items(app, client, auth):
+    auth.login()
+    client.post('/lists/1/items/new', data={'name': 'item name 10', '1': 'new content 1', '2': 'new content 2'})
+    with app.test_request_context():
+        g.user = get_list(1, False) | {'id': 2} # the creator of lists 1 and 5.
+        for list_id in (1, 5):
+            app.config['LIST_GRIDS'] = False
+            expected = grid_rows(get_list_items_with_details(get_list(list_id)))
+            assert expected
+            app.config['LIST_GRIDS'] = True
+            assert grid_rows(get_list_items_with_details(get_list(list_id))) == expected
+            assert grid_rows(get_list_items_with_details(get_list(list_id))) == expected # from the built grid.
+            app.config['LIST_GRIDS'] = False
+            expected = get_list_context(get_list(list_id))
+            app.config['LIST_GRIDS'] = True
+            context._contexts.clear()
+            assert get_list_context(get_list(list_id)) == expected
+
+
+def test_grid():
+    grid = Grid([3, 1])
+    grid.append(10, 'first', None, ['a', 'b'])
+    grid.append(11, 'second', None, ['c', ''])
+    assert len(grid) == 2
+    assert [item.id for item in grid] == [10, 11]
+    assert grid.items[1].cells == ['c', '']
+    assert grid.columns == [['a', 'c'], ['b', '']]
+    assert list(grid.iter_rows()) == [['first', 'a', 'b'], ['second', 'c', '']]
+    assert not hasattr(grid.items[0], '__dict__')
+
+
+def test_stale_grid_is_rebuilt(app, client, auth):
+    auth.login()
+    client.get('/lists/1/view')
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE items SET name = 'renamed behind the grid' WHERE id = 1")
+        db.execute('UPDATE lists SET version = version + 1 WHERE id = 1') # like a write that doesn't maintain the grid.
+        db.commit()
+    assert b'renamed behind the grid' in client.get('/lists/1/view').data
+    assert_grid_current(app, 1, False)
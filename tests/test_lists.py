@@ -1,4 +1,10 @@
+import os
+import time
+
 import pytest
+from flask import g
+from incontext import conditional
+from incontext.conditional import hash_files, make_etag
 from incontext.db import get_db, dict_factory
 
 def test_index(client, auth):
@@ -101,6 +107,146 @@ def test_view(app, client, auth):
     assert client.get('lists/50/view').status_code == 404
 
 
+def test_view_cache(app, client, auth, monkeypatch):
+    auth.login()
+    assert b'item name 1' in client.get('/lists/1/view').data
+    # an unchanged list is served from the fragment cache, without the item queries
+    def fail(*args):
+        raise AssertionError('the items were queried')
+    monkeypatch.setattr('incontext.lists.get_list_items_with_details', fail)
+    response = client.get('/lists/1/view')
+    assert b'item name 1' in response.data
+    assert b'relation content 4' in response.data
+    monkeypatch.undo()
+    # writes change the version, so the new data is served
+    client.post('lists/1/items/1/edit', data={'name': 'item name 1 updated', '1': 'relation content 1', '2': 'relation content 2'})
+    assert b'item name 1 updated' in client.get('/lists/1/view').data
+    # tethered lists also change with their master list
+    assert b'master item name 1' in client.get('/lists/5/view').data
+    auth.login('admin2', 'admin2')
+    client.post('master-lists/1/master-items/1/edit', data={'name': 'master item name 1 updated', '1': '', '2': ''})
+    auth.login()
+    assert b'master item name 1 updated' in client.get('/lists/5/view').data
+
+
+def test_view_conditional(app, client, auth, monkeypatch):
+    auth.login()
+    response = client.get('/lists/1/view')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert 'private' in response.headers['Cache-Control']
+    # an unchanged list is answered with 304, without the item queries
+    def fail(*args):
+        raise AssertionError('the items were queried')
+    monkeypatch.setattr('incontext.lists.get_list_items_with_details', fail)
+    response = client.get('/lists/1/view', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    response = client.get('/lists/1/view', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    monkeypatch.undo()
+    # writes change the ETag
+    client.post('lists/1/items/1/edit', data={'name': 'item name 1 updated', '1': 'relation content 1', '2': 'relation content 2'})
+    response = client.get('/lists/1/view', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    etag = response.headers['ETag']
+    # pages with flashed messages aren't answered with 304, and get no ETag
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'a pending message')]
+    response = client.get('/lists/1/view', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'a pending message' in response.data
+    assert 'ETag' not in response.headers
+    # the ETag depends on the user
+    with app.test_request_context():
+        g.user = {'id': 2, 'username': 'test', 'admin': True}
+        test_etag = make_etag('list', 1, 1)
+        g.user = {'id': 3, 'username': 'admin2', 'admin': True}
+        assert make_etag('list', 1, 1) != test_etag
+    # tethered lists change with their master list
+    auth.login()
+    etag = client.get('/lists/5/view').headers['ETag']
+    assert client.get('/lists/5/view', headers={'If-None-Match': etag}).status_code == 304
+    auth.login('admin2', 'admin2')
+    client.post('master-lists/1/master-items/1/edit', data={'name': 'master item name 1 updated', '1': '', '2': ''})
+    auth.login()
+    assert client.get('/lists/5/view', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_view_etag_build(app, client, auth, monkeypatch, tmp_path):
+    auth.login()
+    response = client.get('/lists/1/view')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert client.get('/lists/1/view', headers={'If-None-Match': etag}).status_code == 304
+    # a deploy that changes the templates or static files changes the validators
+    (tmp_path / 'base.html').write_text('a template')
+    build = hash_files([str(tmp_path)])
+    (tmp_path / 'base.html').write_text('a changed template')
+    os.utime(tmp_path / 'base.html', (time.time() + 60, time.time() + 60)) # later than the list's last change, whatever the clock's resolution.
+    assert hash_files([str(tmp_path)])[0] != build[0]
+    monkeypatch.setattr(conditional, 'get_build', lambda: hash_files([str(tmp_path)]))
+    response = client.get('/lists/1/view', headers={'If-None-Match': etag, 'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert client.get('/lists/1/view', headers={'If-Modified-Since': last_modified}).status_code == 200
+
+
+@pytest.mark.parametrize(('list_id', 'item_id', 'list_grids', 'queries'), (
+    (5, 7, True, 2), # the list with its page header, then the master items and the list's items.
+    (5, 7, False, 2),
+    (1, 1, True, 2), # the list with its page header, then the list's grid.
+    (1, 1, False, 3), # the list with its page header, then the items and their contents.
+))
+def test_view_queries(app, client, auth, list_id, item_id, list_grids, queries):
+    app.config['LIST_GRIDS'] = list_grids
+    app.config['SLOW_QUERY_MS'] = 0 # the slow query log records every statement.
+    auth.login()
+    client.get(f'/lists/{list_id}/view') # builds the grid.
+    client.post(f'lists/{list_id}/items/{item_id}/edit', data={'name': 'item name updated', '1': 'content 1', '2': 'content 2'}) # so the items aren't served from the fragment cache.
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM slow_queries')
+        db.commit()
+    response = client.get(f'/lists/{list_id}/view')
+    assert b'item name updated' in response.data
+    with app.app_context():
+        statements = get_db().execute("SELECT statement, count FROM slow_queries WHERE endpoint = 'lists.view'").fetchall()
+    assert all(statement['statement'].startswith('SELECT') for statement in statements)
+    assert sum(statement['count'] for statement in statements) == queries
+
+
+def test_export(app, client, auth):
+    # user must be logged in
+    response = client.get('lists/1/export')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/auth/login'
+    # user must be list creator
+    auth.login('other', 'other')
+    assert client.get('lists/1/export').status_code == 403
+    auth.login()
+    response = client.get('lists/1/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'item name 1 | relation content 1 | relation content 2' in response.data
+    assert b'item name 3' not in response.data
+    # columns can be selected
+    response = client.get('lists/1/export?column=2')
+    assert b'item name 1 | relation content 2\n' in response.data
+    assert b'relation content 1' not in response.data
+    # version is bumped by writes, so exports are not served stale
+    with app.app_context():
+        version = get_db().execute('SELECT version FROM lists WHERE id = 1').fetchone()['version']
+    client.post('lists/1/items/1/edit', data={'name': 'item name 1 updated', '1': 'relation content 1', '2': 'relation content 2'})
+    with app.app_context():
+        assert get_db().execute('SELECT version FROM lists WHERE id = 1').fetchone()['version'] == version + 1
+    assert b'item name 1 updated' in client.get('lists/1/export').data
+    # exports are conditional too
+    etag = client.get('lists/1/export').headers['ETag']
+    assert client.get('lists/1/export', headers={'If-None-Match': etag}).status_code == 304
+
+
 def test_edit(app, client, auth):
     # user must be logged in
     response = client.get('/lists/1/edit')
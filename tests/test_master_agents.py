@@ -24,6 +24,42 @@ def test_index_master_agent(app, client, auth):
     assert b"master agent description 3" in response.data
 
 
+def test_usage(app, client, auth):
+    # user must be logged in
+    response = client.get("master-agents/usage")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/auth/login"
+    # user must be admin
+    auth.login("other", "other")
+    assert client.get("master-agents/usage").status_code == 403
+    auth.login()
+    response = client.get("master-agents/usage")
+    assert response.status_code == 200
+    assert b"Empty" in response.data
+    # hot agents and users are served from the hourly rollup
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO agent_usage_hourly (hour, user_id, agent_id, model_id, runs, input_tokens, output_tokens, latency_ms, cost)"
+            " VALUES (strftime('%Y-%m-%d %H:00:00', 'now', ?), ?, ?, 3, ?, 100, 100, 1000, ?)",
+            [
+                ("-1 hours", 2, 1, 10, 1.5),
+                ("-1 hours", 3, 3, 2, 0.25),
+                ("-48 hours", 3, 3, 2, 99.0),
+            ]
+        )
+        db.commit()
+    response = client.get("master-agents/usage")
+    assert b"agent name 1" in response.data
+    assert b"agent name 3" in response.data
+    assert b"1.5000" in response.data
+    assert b"0.2500" in response.data
+    # usage outside the window is not counted
+    assert b"99.0000" not in response.data
+    response = client.get("master-agents/usage?hours=168")
+    assert b"99.2500" in response.data
+
+
 def test_new_master_agent(app, client, auth):
     # user must be logged in
     response = client.get("/master-agents/new")
@@ -0,0 +1,166 @@
+import json
+import sqlite3
+
+from incontext import master_changes
+from incontext.db import get_db
+from incontext.master_changes import apply_master_changes, schedule_propagation
+
+
+def get_applied_seq(app, list_id):
+    with app.app_context():
+        return get_db().execute('SELECT applied_seq FROM list_tethers WHERE list_id = ?', (list_id,)).fetchone()[0]
+
+
+def get_untethered(app, list_id, master_detail_id):
+    with app.app_context():
+        rows = get_db().execute('SELECT item_id, content FROM untethered_content WHERE list_id = ? AND master_detail_id = ?', (list_id, master_detail_id)).fetchall()
+        return [tuple(row) for row in rows]
+
+
+def get_grid_cells(app, list_id):
+    with app.app_context():
+        return [json.loads(row[0]) for row in get_db().execute('SELECT cells FROM list_grids WHERE list_id = ? ORDER BY item_id', (list_id,))]
+
+
+def new_master_detail(client):
+    client.post('/master-lists/1/master-details/new', data={'name': 'master detail name 4', 'description': 'master detail description 4'})
+
+
+def test_logged_and_applied_on_read(app, client, auth):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login()
+    client.get('/lists/5/view') # builds the grid.
+    auth.login('admin2', 'admin2')
+    new_master_detail(client)
+    with app.app_context():
+        change = get_db().execute('SELECT seq, kind, master_detail_id FROM master_changes').fetchone()
+    assert tuple(change) == (1, 'add_detail', 4)
+    # the master write doesn't touch the tethered lists
+    assert get_untethered(app, 5, 4) == []
+    assert get_applied_seq(app, 5) == 0
+    # reading the list applies the change first
+    auth.login()
+    response = client.get('/lists/5/view')
+    assert b'master detail name 4' in response.data
+    assert get_untethered(app, 5, 4) == [(7, '')]
+    assert get_applied_seq(app, 5) == 1
+    assert get_grid_cells(app, 5) == [{'1': 'untethered content 1', '2': 'untethered content 2', '4': ''}]
+    # lists that weren't read are still behind
+    assert get_applied_seq(app, 6) == 0
+
+
+def test_delete_detail(app, client, auth):
+    auth.login()
+    client.get('/lists/5/view')
+    auth.login('admin2', 'admin2')
+    client.post('/master-lists/1/master-details/2/delete')
+    # the untethered content of the detail is deleted too
+    assert get_untethered(app, 5, 2) == []
+    assert get_untethered(app, 6, 2) == []
+    assert get_grid_cells(app, 5) == [{'1': 'untethered content 1'}]
+    # the log is pruned once every tether has applied it
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM master_changes').fetchone()[0] == 0
+
+
+def test_batches(app, client, auth, runner):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login('admin2', 'admin2')
+    new_master_detail(client)
+    client.post('/master-lists/1/master-details/4/delete')
+    client.post('/master-lists/1/master-items/1/edit', data={'name': 'master item name 1', '1': 'master content updated', '2': 'master relation content 2'})
+    with app.app_context():
+        db = get_db()
+        assert [row[0] for row in db.execute('SELECT kind FROM master_changes ORDER BY seq')] == ['add_detail', 'delete_detail', 'edit_item']
+        # each batch commits its progress, so an interrupted propagation resumes after it
+        tether = {'list_id': 5, 'master_list_id': 1, 'snapshot': 0, 'applied_seq': 0}
+        assert apply_master_changes(db, tether, 1) == 3
+    assert get_applied_seq(app, 5) == 3
+    assert get_applied_seq(app, 6) == 0
+    result = runner.invoke(args=['propagate-master-changes', '--batch-size', '2'])
+    assert 'Applied 3 changes for 1 master lists.' in result.output
+    assert get_applied_seq(app, 6) == 3
+    assert get_untethered(app, 6, 4) == []
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM master_changes').fetchone()[0] == 0
+
+
+def test_async(app, client, auth):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login('admin2', 'admin2')
+    new_master_detail(client)
+    app.config['PROPAGATE_MASTER_CHANGES'] = 'async'
+    with app.test_request_context():
+        future = schedule_propagation(1)
+    assert future.result(timeout=10) == 2 # one change for each of the two tethers.
+    assert get_untethered(app, 5, 4) == [(7, '')]
+    assert get_untethered(app, 6, 4) == [(8, '')]
+
+
+def test_new_tether(app, client, auth):
+    auth.login('admin2', 'admin2')
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    new_master_detail(client)
+    # a new tether starts from the master list as it is, after the logged changes
+    auth.login()
+    response = client.post('/lists/new-tethered', data={'master_list_id': 1})
+    list_id = int(response.headers['Location'].split('/')[-2])
+    assert get_applied_seq(app, list_id) == 1
+
+
+def test_snapshot_applied_on_read(app, client, auth):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login()
+    response = client.post('/lists/new-tethered', data={'master_list_id': 1, 'snapshot': '1'})
+    list_id = int(response.headers['Location'].split('/')[-2])
+    auth.login('admin2', 'admin2')
+    client.post('/master-lists/1/master-items/1/edit', data={'name': 'master item name 1', '1': 'master content updated', '2': 'master relation content 2'})
+    client.post('/master-lists/1/master-items/2/delete')
+    with app.app_context():
+        cells = json.loads(get_db().execute("SELECT cells FROM master_changes WHERE kind = 'edit_item'").fetchone()[0])
+    assert cells == {'1': 'master relation content 1'} # only the old content of the changed cell.
+    auth.login()
+    response = client.get(f'/lists/{list_id}/view')
+    assert b'master content updated' not in response.data
+    assert b'master relation content 1' in response.data
+    assert b'master relation content 4' in response.data
+    assert get_untethered(app, list_id, 1) != []
+
+
+def test_not_applied_by_writes_and_304s(app, client, auth):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login('admin2', 'admin2')
+    client.post('/master-lists/1/master-items/1/edit', data={'name': 'master item name 1', '1': 'master content updated', '2': 'master relation content 2'})
+    auth.login()
+    # writes to the list don't apply the master list's changes
+    client.post('/lists/5/items/new', data={'name': 'item name 10', '1': '', '2': ''})
+    assert get_applied_seq(app, 5) == 0
+    # reads do
+    etag = client.get('/lists/5/view').headers['ETag']
+    assert get_applied_seq(app, 5) == 1
+    # but not an answer from the client's cache, which stops after the list's query
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO master_changes (master_list_id, kind, master_item_id, cells) VALUES (1, 'edit_item', 1, '{}')")
+        db.commit()
+    assert client.get('/lists/5/view', headers={'If-None-Match': etag}).status_code == 304
+    assert get_applied_seq(app, 5) == 1
+
+
+def test_locked_read(app, client, auth, monkeypatch):
+    app.config['PROPAGATE_MASTER_CHANGES'] = None
+    auth.login('admin2', 'admin2')
+    new_master_detail(client)
+    def locked(*args):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(master_changes, 'apply_master_changes', locked)
+    # the page is shown as the list was, without validators, so it isn't kept
+    auth.login()
+    response = client.get('/lists/5/view')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert get_applied_seq(app, 5) == 0
+    monkeypatch.undo()
+    response = client.get('/lists/5/view')
+    assert 'ETag' in response.headers
+    assert get_applied_seq(app, 5) == 1
@@ -83,6 +83,51 @@ def test_view_master_list(app, client, auth):
     assert client.get("master-lists/4/view").status_code == 404
 
 
+def test_view_master_list_cache(app, client, auth, monkeypatch):
+    auth.login('admin2', 'admin2')
+    assert b'master item name 1' in client.get('master-lists/1/view').data
+    # an unchanged master list is served from the fragment cache, without the item queries
+    def fail(*args):
+        raise AssertionError('the items were queried')
+    monkeypatch.setattr('incontext.master_lists.get_master_list', fail)
+    response = client.get('master-lists/1/view')
+    assert b'master item name 1' in response.data
+    assert b'master relation content 4' in response.data
+    monkeypatch.undo()
+    # writes change the version, so the new data is served
+    client.post('master-lists/1/master-items/1/edit', data={'name': 'master item name 1 updated', '1': '', '2': ''})
+    assert b'master item name 1 updated' in client.get('master-lists/1/view').data
+
+
+def test_export_master_list(app, client, auth):
+    # user must be logged in
+    response = client.get('master-lists/1/export')
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/auth/login'
+    auth.login('other', 'other')
+    response = client.get('master-lists/1/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'master item name 1 | master relation content 1 | master relation content 2' in response.data
+    assert b'master item name 3' not in response.data
+    # master list must exist
+    assert client.get('master-lists/50/export').status_code == 404
+    # unchanged exports are answered with 304
+    etag = client.get('master-lists/1/export').headers['ETag']
+    assert client.get('master-lists/1/export', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_view_master_list_conditional(app, client, auth):
+    auth.login('admin2', 'admin2')
+    response = client.get('master-lists/1/view')
+    etag = response.headers['ETag']
+    assert client.get('master-lists/1/view', headers={'If-None-Match': etag}).status_code == 304
+    client.post('master-lists/1/master-items/1/edit', data={'name': 'master item name 1 updated', '1': '', '2': ''})
+    response = client.get('master-lists/1/view', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'master item name 1 updated' in response.data
+
+
 def test_edit_master_list(app, client, auth):
     # user must be logged in
     response = client.get('/master-lists/1/edit')
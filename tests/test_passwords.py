@@ -0,0 +1,34 @@
+import pytest
+from incontext.passwords import get_pool, hash_password, needs_rehash, verify_password
+
+
+@pytest.mark.parametrize("workers", (0, 1))
+def test_hash_and_verify(app, workers):
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    with app.app_context():
+        assert (get_pool() is None) == (workers == 0)
+        pwhash = hash_password("secret")
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert verify_password(pwhash, "secret")
+        assert not verify_password(pwhash, "wrong")
+
+
+def test_needs_rehash(app):
+    app.config["PASSWORD_HASH_METHOD"] = "scrypt:32768:8:1"
+    with app.app_context():
+        assert not needs_rehash("scrypt:32768:8:1$salt$hash")
+        assert needs_rehash("scrypt:16384:8:1$salt$hash")
+        assert needs_rehash("pbkdf2:sha256:50000$salt$hash")
+
+
+def test_pool_size(app):
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    with app.app_context():
+        pool = get_pool()
+        assert get_pool() is pool
+        assert pool._max_workers == 1
+        # a different size gets a new pool
+        app.config["PASSWORD_HASH_WORKERS"] = 2
+        assert get_pool() is not pool
+        assert get_pool()._max_workers == 2
@@ -0,0 +1,91 @@
+import os
+import pstats
+
+import pytest
+from incontext.profiling import list_profiles, parse_name, prune_profiles
+
+
+@pytest.fixture
+def profile_dir(app, tmp_path):
+    app.config['PROFILE_REQUESTS'] = True
+    app.config['PROFILE_DIR'] = str(tmp_path)
+    return str(tmp_path)
+
+
+def test_off(app, client, auth, profile_dir):
+    app.config['PROFILE_REQUESTS'] = False
+    auth.login()
+    client.get('/lists/?_profile=1')
+    assert os.listdir(profile_dir) == []
+
+
+def test_requested(client, auth, profile_dir):
+    auth.login()
+    client.get('/lists/')
+    assert os.listdir(profile_dir) == []
+    client.get('/lists/?_profile=1')
+    client.get('/agents/', headers={'X-Profile': '1'})
+    profiles = list_profiles(profile_dir)
+    assert [profile['endpoint'] for profile in profiles] == ['agents.index', 'lists.index']
+    assert profiles[0]['pid'] == os.getpid()
+    assert profiles[0]['duration_ms'] > 0
+
+
+def test_requested_not_admin(client, auth, profile_dir):
+    auth.login('other', 'other')
+    client.get('/lists/?_profile=1')
+    assert os.listdir(profile_dir) == []
+
+
+def test_sampled(app, client, auth, profile_dir):
+    auth.login('other', 'other')
+    app.config['PROFILE_SAMPLE_RATE'] = 1
+    client.get('/lists/')
+    assert [profile['endpoint'] for profile in list_profiles(profile_dir)] == ['lists.index']
+
+
+def test_prune(profile_dir):
+    for n in range(5):
+        open(os.path.join(profile_dir, f'{1700000000000 + n:013d}-1-lists.view-{n}.pstats'), 'w').close()
+    open(os.path.join(profile_dir, 'notes.txt'), 'w').close()
+    prune_profiles(profile_dir, 2)
+    assert sorted(os.listdir(profile_dir)) == ['1700000000003-1-lists.view-3.pstats', '1700000000004-1-lists.view-4.pstats', 'notes.txt']
+
+
+def test_parse_name():
+    profile = parse_name('1700000000000-42-master_lists.view-1500.pstats')
+    assert profile['pid'] == 42
+    assert profile['endpoint'] == 'master_lists.view'
+    assert profile['duration_ms'] == 1.5
+    assert parse_name('notes.txt') is None
+    assert parse_name('a-b.pstats') is None
+
+
+def test_views(client, auth, profile_dir):
+    auth.login()
+    client.get('/lists/?_profile=1')
+    name = list_profiles(profile_dir)[0]['name']
+    response = client.get('/profiles/')
+    assert b'lists.index' in response.data
+    assert name.encode() in response.data
+    response = client.get(f'/profiles/{name}?sort=tottime')
+    assert b'function calls' in response.data
+    response = client.get(f'/profiles/{name}/download')
+    assert response.status_code == 200
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert client.get('/profiles/1700000000000-1-lists.view-1.pstats').status_code == 404
+    assert len(os.listdir(profile_dir)) == 1 # the profile views aren't profiled.
+
+
+def test_views_admin_only(client, auth, profile_dir):
+    auth.login('other', 'other')
+    assert client.get('/profiles/').status_code == 403
+
+
+def test_covers_after_request(client, auth, profile_dir):
+    auth.login()
+    client.get('/lists/?_profile=1', headers={'Accept-Encoding': 'gzip'})
+    profile = list_profiles(profile_dir)[0]
+    functions = {function for _, _, function in pstats.Stats(os.path.join(profile_dir, profile['name'])).stats}
+    # compression is registered before the profiler, so without the reordering it would run after the profile was saved
+    assert 'compress_response' in functions
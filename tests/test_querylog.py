@@ -0,0 +1,99 @@
+import sqlite3
+
+from flask import g
+from incontext.db import get_db
+from incontext.querylog import TimedConnection, flush_slow_queries, normalise, redact
+
+
+def test_normalise():
+    assert normalise("SELECT *  FROM items\n WHERE name = 'it''s' AND id = 42") == 'SELECT * FROM items WHERE name = ? AND id = ?'
+    assert normalise('SELECT * FROM items WHERE id IN (?, ?, ?)') == normalise('SELECT * FROM items WHERE id IN (?,?)')
+    assert normalise('SELECT agent2 FROM t') == 'SELECT agent2 FROM t'
+
+
+def test_redact():
+    assert redact((1, 'secret', None)) == '(int, str, NoneType)'
+    assert redact({'name': 'secret'}) == '{name: str}'
+
+
+def get_slow_queries(app):
+    with app.app_context():
+        db = get_db()
+        return db.execute('SELECT * FROM slow_queries ORDER BY statement').fetchall()
+
+
+def test_off(app, client, auth):
+    with app.app_context():
+        assert type(get_db()) is sqlite3.Connection
+    auth.login()
+    client.get('/lists/1/view')
+    assert get_slow_queries(app) == []
+
+
+def test_log(app, client, auth):
+    app.config['SLOW_QUERY_MS'] = 0 # every statement is slow.
+    with app.app_context():
+        assert isinstance(get_db(), TimedConnection)
+    auth.login()
+    client.get('/lists/1/view')
+    client.get('/lists/1/view')
+    rows = get_slow_queries(app)
+    assert rows
+    assert all('test' not in row['statement'] for row in rows) # the username was a parameter.
+    login = [row for row in rows if row['endpoint'] == 'auth.login' and 'FROM users' in row['statement']][0]
+    assert login['parameters'] == '(str)'
+    assert login['plan']
+    views = [row for row in rows if row['endpoint'] == 'lists.view']
+    assert views
+    assert all(row['max_ms'] <= row['total_ms'] for row in rows)
+
+
+def test_timed_cursor(app):
+    app.config['SLOW_QUERY_MS'] = 0
+    with app.app_context():
+        db = get_db()
+        db.execute('SELECT id FROM users WHERE username = ?', ('test',)).fetchone() # recorded when the cursor is dropped.
+        cur = db.cursor()
+        cur.row_factory = None
+        assert [row for row in cur.execute('SELECT id FROM items WHERE id < 3 ORDER BY id')] == [(1,), (2,)]
+        cur.executemany('UPDATE items SET name = name WHERE id = ?', [(1,), (2,)])
+        db.commit()
+        assert flush_slow_queries(app.config['DATABASE']) == 3
+        statements = {row['statement']: row for row in db.execute('SELECT * FROM slow_queries')}
+    assert set(statements) == {
+        'SELECT id FROM users WHERE username = ?',
+        'SELECT id FROM items WHERE id < ? ORDER BY id',
+        'UPDATE items SET name = name WHERE id = ?',
+    }
+    assert 'SEARCH' in statements['SELECT id FROM users WHERE username = ?']['plan']
+
+
+def test_scan_shows_up(app):
+    app.config['SLOW_QUERY_MS'] = 0
+    with app.app_context():
+        get_db().execute('SELECT content FROM untethered_content WHERE content = ?', ('x',)).fetchall()
+        flush_slow_queries(app.config['DATABASE'])
+        row = get_db().execute("SELECT plan FROM slow_queries WHERE statement LIKE '%untethered_content%'").fetchone()
+    assert 'SCAN untethered_content' in row['plan']
+
+
+def test_threshold(app, client, auth):
+    app.config['SLOW_QUERY_MS'] = 60 * 1000
+    auth.login()
+    client.get('/lists/1/view')
+    assert get_slow_queries(app) == []
+
+
+def test_slow_queries_command(app, runner):
+    result = runner.invoke(args=['slow-queries'])
+    assert 'No slow queries.' in result.output
+    app.config['SLOW_QUERY_MS'] = 0
+    with app.app_context():
+        get_db().execute('SELECT content FROM untethered_content WHERE content = ?', ('secret',)).fetchall()
+        g.pop('db').close() # leaves the statement buffered.
+    app.config['SLOW_QUERY_MS'] = None
+    result = runner.invoke(args=['slow-queries', '--sort', 'max', '--reset'])
+    assert 'SELECT content FROM untethered_content WHERE content = ?' in result.output
+    assert 'SCAN untethered_content' in result.output
+    assert 'secret' not in result.output
+    assert get_slow_queries(app) == []
@@ -0,0 +1,49 @@
+import pytest
+from incontext.db import get_db
+from incontext.ratelimit import NO_REFILL_RETRY_AFTER, per_minute, take_tokens
+
+
+def test_per_minute():
+    assert per_minute("key", None) is None
+    assert per_minute("key", (60, 5)) == ("key", 1.0, 5)
+
+
+def test_take_tokens(app):
+    with app.app_context():
+        db = get_db()
+        limits = [("a", 1.0, 2)]
+        # the burst is available straight away
+        assert take_tokens(db, limits, now=100.0) == 0
+        assert take_tokens(db, limits, now=100.0) == 0
+        # then the bucket is empty until it refills
+        assert take_tokens(db, limits, now=100.0) == pytest.approx(1.0)
+        assert take_tokens(db, limits, now=100.5) == pytest.approx(0.5)
+        assert take_tokens(db, limits, now=101.0) == 0
+        # a bucket never holds more than its burst
+        assert take_tokens(db, limits, now=1000.0) == 0
+        assert take_tokens(db, limits, now=1000.0) == 0
+        assert take_tokens(db, limits, now=1000.0) > 0
+        assert not db.in_transaction
+
+
+def test_take_tokens_no_refill(app):
+    with app.app_context():
+        db = get_db()
+        # a rate of 0 allows the burst and then refuses, however long the wait
+        assert take_tokens(db, [("d", 0.0, 1)], now=100.0) == 0
+        assert take_tokens(db, [("d", 0.0, 1)], now=100.0) == NO_REFILL_RETRY_AFTER
+        assert take_tokens(db, [("d", 0.0, 1)], now=100000.0) == NO_REFILL_RETRY_AFTER
+        assert take_tokens(db, [("e", 0.0, 0)], now=100.0) == NO_REFILL_RETRY_AFTER
+        assert take_tokens(db, [("f", -1.0, 1)], now=100.0) == 0
+        assert take_tokens(db, [("f", -1.0, 1)], now=200.0) == NO_REFILL_RETRY_AFTER
+        assert not db.in_transaction
+
+
+def test_take_tokens_all_or_nothing(app):
+    with app.app_context():
+        db = get_db()
+        assert take_tokens(db, [("b", 1.0, 1)], now=100.0) == 0
+        # "c" has tokens, but "b" doesn't, so nothing is taken from "c" either
+        assert take_tokens(db, [("c", 1.0, 1), ("b", 1.0, 1)], now=100.0) > 0
+        assert db.execute("SELECT * FROM rate_limit_buckets WHERE key = 'c'").fetchone() is None
+        assert take_tokens(db, [("c", 1.0, 1)], now=100.0) == 0
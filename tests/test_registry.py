@@ -0,0 +1,45 @@
+import pytest
+from incontext.db import get_db
+from incontext.registry import get_agent_model, get_agent_model_by_code, get_agent_models
+from instance.config import AGENT_MODELS
+
+
+def test_registry(app):
+    with app.app_context():
+        models = get_agent_models()
+        assert len(models) == len(AGENT_MODELS)
+        assert [model["id"] for model in models] == list(range(1, len(AGENT_MODELS) + 1))
+        assert get_agent_model(3)["model_name"] == "GPT-4.1 nano"
+        assert get_agent_model(50) is None
+        assert get_agent_model(None) is None
+        assert get_agent_model_by_code(AGENT_MODELS[0][3])["id"] == 1
+        assert get_agent_model_by_code("unknown") is None
+
+
+def test_registry_reload(app, runner):
+    app.config["CACHE_VERSION_TTL"] = 0
+    with app.app_context():
+        db = get_db()
+        assert get_agent_model(3)["model_name"] == "GPT-4.1 nano"
+        # the table is not read again until the version changes
+        db.execute("UPDATE agent_models SET model_name = 'renamed' WHERE id = 3")
+        db.commit()
+        assert get_agent_model(3)["model_name"] == "GPT-4.1 nano"
+    result = runner.invoke(args=["reload-models"])
+    assert "reloaded" in result.output
+    with app.app_context():
+        assert get_agent_model(3)["model_name"] == "renamed"
+
+
+def test_registry_ttl(app):
+    app.config["CACHE_VERSION_TTL"] = 3600
+    with app.app_context():
+        db = get_db()
+        assert get_agent_model(3)["model_name"] == "GPT-4.1 nano"
+        # a version bump is only noticed after the TTL
+        db.execute("UPDATE agent_models SET model_name = 'renamed' WHERE id = 3")
+        db.execute("UPDATE cache_versions SET version = version + 1 WHERE name = 'agent_models'")
+        db.commit()
+        assert get_agent_model(3)["model_name"] == "GPT-4.1 nano"
+        app.config["CACHE_VERSION_TTL"] = 0
+        assert get_agent_model(3)["model_name"] == "renamed"
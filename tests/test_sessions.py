@@ -0,0 +1,140 @@
+import time
+
+import pytest
+from flask import session
+
+from incontext.db import get_db
+from incontext.sessions import MemorySessionInterface, SqliteSessionInterface
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(app, request):
+    app.config['SESSION_BACKEND'] = request.param
+    app.session_interface = {'sqlite': SqliteSessionInterface, 'memory': MemorySessionInterface}[request.param]()
+    return app.session_interface
+
+
+def count_saves(backend, monkeypatch):
+    saves = []
+    save = backend.save
+    def counting_save(*args):
+        saves.append(args)
+        save(*args)
+    monkeypatch.setattr(backend, 'save', counting_save)
+    return saves
+
+
+def test_login(app, client, auth, backend):
+    assert auth.login().headers['Location'] == '/'
+    sid = client.get_cookie('session').value
+    assert len(sid) == 32 # only the id is in the cookie.
+    with app.app_context():
+        assert backend.load(sid)['user_id'] == 2
+    with client:
+        client.get('/')
+        assert session['user_id'] == 2
+        assert session.sid == sid
+    if isinstance(backend, SqliteSessionInterface):
+        with app.app_context():
+            assert get_db().execute('SELECT user_id FROM sessions WHERE id = ?', (sid,)).fetchone()['user_id'] == 2
+
+
+def test_write_back_on_change(client, auth, backend, monkeypatch):
+    auth.login()
+    saves = count_saves(backend, monkeypatch)
+    assert client.get('/lists/').status_code == 200
+    assert client.get('/static/styles.css').status_code == 200
+    assert saves == []
+    client.get('/lists/new') # no change
+    client.post('/lists/new', data={'name': '', 'description': ''}) # flashes a message
+    assert len(saves) == 1
+
+
+def test_anonymous_requests_dont_store(client, backend, monkeypatch):
+    saves = count_saves(backend, monkeypatch)
+    assert client.get('/').status_code == 302
+    assert client.get('/auth/login').status_code == 200
+    assert saves == []
+    assert client.get_cookie('session') is None
+
+
+def test_login_replaces_id(client, auth, backend):
+    with client.application.app_context():
+        backend.save('old-id', None, backend.serializer.dumps({'seen': True}), time.time() + 60)
+    client.set_cookie('session', 'old-id')
+    with client:
+        client.get('/auth/login')
+        assert session['seen'] # a session from before the login.
+    old_sid = 'old-id'
+    auth.login()
+    assert client.get_cookie('session').value != old_sid
+    with client.application.app_context():
+        assert backend.load(old_sid) is None
+
+
+def test_unknown_id_is_not_used(client, auth, backend):
+    client.set_cookie('session', 'chosen-by-the-client')
+    auth.login()
+    sid = client.get_cookie('session').value
+    assert sid != 'chosen-by-the-client'
+
+
+def test_logout(client, auth, backend):
+    auth.login()
+    sid = client.get_cookie('session').value
+    auth.logout()
+    assert client.get_cookie('session') is None
+    with client.application.app_context():
+        assert backend.load(sid) is None
+
+
+def test_logout_everywhere(app, auth, backend):
+    clients = [app.test_client() for _ in range(3)]
+    for client, username in zip(clients, ('test', 'test', 'other')):
+        client.post('/auth/login', data={'username': username, 'password': username})
+    assert b'Log Out Everywhere' in clients[0].get('/').data
+    response = clients[0].get('/auth/logout-everywhere')
+    assert response.headers['Location'] == '/'
+    assert clients[0].get('/lists/').headers['Location'] == '/auth/login'
+    assert clients[1].get('/lists/').headers['Location'] == '/auth/login'
+    assert clients[2].get('/lists/').status_code == 200
+
+
+def test_logout_everywhere_with_cookie_sessions(client, auth):
+    auth.login()
+    assert b'Log Out Everywhere' not in client.get('/').data
+    assert client.get('/auth/logout-everywhere').status_code == 404
+
+
+def test_static_requests_dont_load(client, auth, backend, monkeypatch):
+    auth.login()
+    loads = []
+    load = backend.load
+    monkeypatch.setattr(backend, 'load', lambda sid: loads.append(sid) or load(sid))
+    assert client.get('/static/styles.css').status_code == 200
+    assert loads == []
+    client.get('/lists/')
+    assert len(loads) == 1
+
+
+def test_sweep(app, client, auth, runner):
+    app.config['SESSION_BACKEND'] = 'sqlite'
+    app.session_interface = SqliteSessionInterface()
+    def count_sessions():
+        with app.app_context():
+            return get_db().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+    with app.app_context():
+        app.session_interface.save('expired', None, '{}', time.time() - 1)
+    # session writes don't sweep, unless the sample says so
+    app.config['SESSION_SWEEP_RATE'] = 0
+    auth.login()
+    assert count_sessions() == 2
+    app.config['SESSION_SWEEP_RATE'] = 1
+    auth.login()
+    assert count_sessions() == 1
+    app.config['SESSION_SWEEP_RATE'] = 0
+    with app.app_context():
+        app.session_interface.save('expired', None, '{}', time.time() - 1)
+    result = runner.invoke(args=['sweep-sessions'])
+    assert 'Deleted 1 expired sessions.' in result.output
+    assert count_sessions() == 1
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+from incontext.db import get_db
+from incontext.grids import build_list_grid
+
+
+def new_snapshot(client):
+    response = client.post('/lists/new-tethered', data={'master_list_id': 1, 'snapshot': '1'})
+    return int(response.headers['Location'].split('/')[-2])
+
+
+def get_cells(app, list_id):
+    '''The list's grid by item name. Checks that a rebuild from the relational tables gives the same cells.'''
+    with app.app_context():
+        db = get_db()
+        query = 'SELECT name, cells FROM list_grids WHERE list_id = ? ORDER BY item_id'
+        cells = {name: json.loads(cells) for name, cells in db.execute(query, (list_id,)).fetchall()}
+        build_list_grid(db, list_id, True)
+        assert {name: json.loads(cells) for name, cells in db.execute(query, (list_id,)).fetchall()} == cells
+        db.rollback()
+        return cells
+
+
+def count_untethered(app, list_id):
+    with app.app_context():
+        return get_db().execute('SELECT COUNT(*) FROM untethered_content WHERE list_id = ?', (list_id,)).fetchone()[0]
+
+
+@pytest.mark.parametrize('list_grids', (True, False))
+def test_new_snapshot(app, client, auth, list_grids):
+    app.config['LIST_GRIDS'] = list_grids
+    auth.login()
+    list_id = new_snapshot(client)
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT snapshot FROM list_tethers WHERE list_id = ?', (list_id,)).fetchone()[0] == 1
+        assert db.execute('SELECT COUNT(*) FROM snapshot_items WHERE list_id = ?', (list_id,)).fetchone()[0] == 2
+    # only the names are copied. the cells are shared with the master items
+    assert count_untethered(app, list_id) == 0
+    response = client.get(f'/lists/{list_id}/view')
+    assert b'(snapshot)' in response.data
+    assert b'master relation content 4' in response.data
+    assert b'(tethered)</td>' not in response.data # the master items are shown as the list's own.
+    app.config['STREAM_MIN_ITEMS'] = 1
+    streamed = client.get(f'/lists/{list_id}/view')
+    assert b'master relation content 4' in streamed.data
+    assert b'(tethered)</td>' not in streamed.data
+    assert get_cells(app, list_id) == {
+        'master item name 1': {'1': 'master relation content 1', '2': 'master relation content 2'},
+        'master item name 2': {'1': 'master relation content 3', '2': 'master relation content 4'},
+    }
+    # live tethers still show the master items
+    response = client.post('/lists/new-tethered', data={'master_list_id': 1})
+    assert b'(tethered)</td>' in client.get(response.headers['Location']).data
+
+
+def test_edit_copy(app, client, auth):
+    auth.login()
+    list_id = new_snapshot(client)
+    with app.app_context():
+        item_id = get_db().execute('SELECT item_id FROM snapshot_items WHERE list_id = ? AND master_item_id = 1', (list_id,)).fetchone()[0]
+    response = client.get(f'/lists/{list_id}/items/{item_id}/view')
+    assert b'master relation content 2' in response.data
+    client.post(f'/lists/{list_id}/items/{item_id}/edit', data={'name': 'copy 1', '1': 'own content 1', '2': 'master relation content 2'})
+    # only the changed cell is written
+    assert count_untethered(app, list_id) == 1
+    assert get_cells(app, list_id)['copy 1'] == {'1': 'own content 1', '2': 'master relation content 2'}
+    # the master item is unchanged
+    auth.login('admin2', 'admin2')
+    assert b'own content 1' not in client.get('/master-lists/1/view').data
+
+
+def test_master_changes(app, client, auth):
+    auth.login()
+    list_id = new_snapshot(client)
+    before = get_cells(app, list_id)
+    auth.login('admin2', 'admin2')
+    client.post('/master-lists/1/master-items/1/edit', data={'name': 'master item name 1 updated', '1': 'master content updated', '2': 'master relation content 2'})
+    # the changed cell is copied before it's overwritten, the unchanged one stays shared
+    assert count_untethered(app, list_id) == 1
+    client.post('/master-lists/1/master-items/2/delete')
+    assert count_untethered(app, list_id) == 3
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM snapshot_items WHERE list_id = ?', (list_id,)).fetchone()[0] == 1
+    # the snapshot doesn't change
+    assert get_cells(app, list_id) == before
+    auth.login()
+    response = client.get(f'/lists/{list_id}/view')
+    assert b'master content updated' not in response.data
+    assert b'master relation content 1' in response.data
+    assert b'master relation content 4' in response.data
+
+
+def test_delete(app, client, auth):
+    auth.login()
+    list_id = new_snapshot(client)
+    with app.app_context():
+        item_id = get_db().execute('SELECT item_id FROM snapshot_items WHERE list_id = ?', (list_id,)).fetchone()[0]
+    client.post(f'/lists/{list_id}/items/{item_id}/delete')
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM snapshot_items WHERE list_id = ?', (list_id,)).fetchone()[0] == 1
+    client.post(f'/lists/{list_id}/delete')
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM snapshot_items').fetchone()[0] == 0
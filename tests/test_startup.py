@@ -0,0 +1,60 @@
+import io
+
+from incontext import BLUEPRINTS, EXTENSIONS, create_app
+from incontext import registry
+from incontext.db import get_pool
+from incontext.startup import StartupProfile, after_fork, before_fork, warm, warm_templates
+
+
+def test_profile(monkeypatch, capsys):
+    monkeypatch.setenv('IC_PROFILE_STARTUP', '1')
+    create_app({'TESTING': True})
+    report = capsys.readouterr().err
+    for name in EXTENSIONS + BLUEPRINTS:
+        assert name in report
+    assert 'register' in report
+    assert 'init_app' in report
+    assert 'total' in report
+
+
+def test_no_profile(monkeypatch, capsys):
+    monkeypatch.delenv('IC_PROFILE_STARTUP', raising=False)
+    create_app({'TESTING': True})
+    assert capsys.readouterr().err == ''
+
+
+def test_profile_report():
+    profile = StartupProfile()
+    assert profile.run('module', 'step', lambda x: x * 2, 21) == 42
+    stream = io.StringIO()
+    profile.report(stream)
+    assert 'module' in stream.getvalue().splitlines()[1]
+    disabled = StartupProfile(enabled=False)
+    assert disabled.run('module', 'step', lambda: 1) == 1
+    assert disabled.steps == []
+
+
+def test_warm_templates(app):
+    count = warm_templates(app)
+    assert count == len(app.jinja_env.list_templates())
+    assert app.jinja_env.cache is not None and len(app.jinja_env.cache) == count
+
+
+def test_warm(app, tmp_path):
+    registry._registries.pop(app.config['DATABASE'], None)
+    warm(app)
+    assert app.config['DATABASE'] in registry._registries
+    assert len(app.jinja_env.cache) == len(app.jinja_env.list_templates())
+    # an uninitialised database is skipped
+    app.config['DATABASE'] = str(tmp_path / 'empty.sqlite')
+    warm(app)
+
+
+def test_fork_hooks(app):
+    app.config['DB_POOL_SIZE'] = 2
+    after_fork(app)
+    with app.app_context():
+        assert get_pool().qsize() == 2
+    before_fork(app)
+    with app.app_context():
+        assert get_pool().qsize() == 0
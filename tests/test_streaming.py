@@ -0,0 +1,54 @@
+import re
+
+import pytest
+
+
+def page_main(response):
+    '''The page without comments and with whitespace collapsed, so the cached and the streamed renderings compare equal.'''
+    html = re.sub(r'<!--.*?-->', '', response.get_data(as_text=True), flags=re.S)
+    return re.sub(r'\s+', ' ', html)
+
+
+def is_streamed(response):
+    '''Streamed bodies have no length up front. (`is_streamed` is true for every response the test client returns.)'''
+    return 'Content-Length' not in response.headers
+
+
+@pytest.mark.parametrize(('path', 'username', 'password'), (
+    ('/lists/1/view', 'test', 'test'),
+    ('/lists/5/view', 'test', 'test'),
+    ('/master-lists/1/view', 'admin2', 'admin2'),
+))
+@pytest.mark.parametrize('list_grids', (True, False))
+def test_streamed_pages(app, client, auth, path, username, password, list_grids):
+    app.config['LIST_GRIDS'] = list_grids
+    auth.login(username, password)
+    app.config['STREAM_MIN_ITEMS'] = None
+    cached = client.get(path)
+    assert not is_streamed(cached)
+    app.config['STREAM_MIN_ITEMS'] = 1
+    streamed = client.get(path)
+    assert streamed.status_code == 200
+    assert is_streamed(streamed)
+    assert page_main(streamed) == page_main(cached)
+    # streamed pages are still answered with 304
+    assert client.get(path, headers={'If-None-Match': streamed.headers['ETag']}).status_code == 304
+
+
+def test_threshold(app, client, auth):
+    auth.login()
+    app.config['STREAM_MIN_ITEMS'] = 3
+    assert not is_streamed(client.get('/lists/1/view')) # 2 items.
+    assert is_streamed(client.get('/lists/5/view')) # 1 item, and 2 master items.
+
+
+def test_flashes(app, client, auth):
+    auth.login()
+    app.config['STREAM_MIN_ITEMS'] = 1
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'a pending message')]
+    response = client.get('/lists/1/view')
+    assert is_streamed(response)
+    assert b'a pending message' in response.data
+    # the message was taken from the session before the page was sent
+    assert b'a pending message' not in client.get('/lists/1/view').data